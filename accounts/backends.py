@@ -0,0 +1,34 @@
+from django.contrib.auth.backends import ModelBackend
+from django.contrib.auth.models import User
+
+from core import sharding
+from .directory import aattach_account, attach_account
+
+
+def _related():
+    # with the ledger sharded the account is on another database, it's loaded
+    # from the shard the directory entry names
+    return ('account_directory', 'address') if sharding.enabled() else ('account', 'address')
+
+
+class AccountBackend(ModelBackend):
+    # request.user comes with its account and address in the same query, so the views,
+    # forms and navbar reading request.user.account don't each add a lookup
+    def get_user(self, user_id):
+        try:
+            user = User._default_manager.select_related(*_related()).get(pk=user_id)
+        except User.DoesNotExist:
+            return None
+        if sharding.enabled():
+            attach_account(user)
+        return user if self.user_can_authenticate(user) else None
+
+    async def aget_user(self, user_id):
+        # request.auser() in the async views
+        try:
+            user = await User._default_manager.select_related(*_related()).aget(pk=user_id)
+        except User.DoesNotExist:
+            return None
+        if sharding.enabled():
+            await aattach_account(user)
+        return user if self.user_can_authenticate(user) else None
@@ -0,0 +1,39 @@
+from django.core.cache import cache
+
+from .models import UserAddress, UserBankAccount
+
+PROFILE_TIMEOUT = 60 * 60
+
+
+def profile_key(user_id):
+    return f'accounts:profile:{user_id}'
+
+
+def get_profile(user):
+    """
+    Read-only account/address details of a user, cached across requests. The balance is
+    left out on purpose, it changes through queryset updates that don't send signals.
+    """
+    profile = cache.get(profile_key(user.pk))
+    if profile is None:
+        try:
+            account = user.account
+            address = user.address
+        except (UserBankAccount.DoesNotExist, UserAddress.DoesNotExist):
+            return None
+        profile = {
+            'account_no': account.account_no,
+            'account_type': account.account_type,
+            'gender': account.gender,
+            'birth_date': account.birth_date,
+            'street_address': address.street_address,
+            'city': address.city,
+            'postal_code': address.postal_code,
+            'country': address.country,
+        }
+        cache.set(profile_key(user.pk), profile, PROFILE_TIMEOUT)
+    return profile
+
+
+def invalidate_profile(user_id):
+    cache.delete(profile_key(user_id))
@@ -0,0 +1,125 @@
+"""
+Opening accounts and finding them again, on whichever ledger shard they are
+(core/sharding.py).
+
+AccountDirectory on 'default' maps every user and account number to the shard
+the account was opened on, which is how request.user.account and a transfer's
+receiver are found without asking every shard. With sharding on, a new account
+also takes its number as primary key, so account ids (cache keys, rate limits,
+journal lines) stay unique across shards.
+"""
+from collections import defaultdict
+
+from django.contrib.auth.models import User
+
+from core import sharding
+from .models import AccountDirectory, UserBankAccount
+
+
+def open_account(user, **fields):
+    """Create the user's account on its shard, with its directory entry."""
+    account = UserBankAccount(user=user, **fields)
+    if sharding.enabled():
+        account.pk = account.account_no
+    account.save(force_insert=True)  # ShardRouter places it by account_no
+    AccountDirectory.objects.create(user=user, account_no=account.account_no, shard=sharding.shard_of(account))
+    return account
+
+
+def open_accounts(accounts, batch_size=1000):
+    """bulk_create for new UserBankAccount instances, each on its shard. Returns them."""
+    placed = defaultdict(list)
+    for account in accounts:
+        if sharding.enabled():
+            account.pk = account.account_no
+        placed[sharding.shard_of(account)].append(account)
+    for alias, group in placed.items():
+        UserBankAccount.objects.using(alias).bulk_create(group, batch_size=batch_size)
+    AccountDirectory.objects.bulk_create([
+        AccountDirectory(user_id=account.user_id, account_no=account.account_no, shard=alias)
+        for alias, group in placed.items() for account in group
+    ], batch_size=batch_size)
+    return accounts
+
+
+def user_shard(user):
+    """The shard of the user's account, or the current one if they have none."""
+    try:
+        return user.account_directory.shard
+    except AccountDirectory.DoesNotExist:
+        return sharding.current()
+
+
+def shards_of(account_nos):
+    """{shard: account numbers on it}, unknown numbers are left out. No query without sharding."""
+    if not sharding.enabled():
+        return {sharding.current(): list(account_nos)}
+    placed = defaultdict(list)
+    for account_no, shard in AccountDirectory.objects.filter(account_no__in=account_nos).values_list('account_no', 'shard'):
+        placed[shard].append(account_no)
+    return placed
+
+
+def _attach(user, account):
+    # what select_related('account') would have cached, in both directions
+    User.account.related.set_cached_value(user, account)
+    if account is not None:
+        UserBankAccount.user.field.set_cached_value(account, user)
+    return account
+
+
+def find_account(account_no):
+    """The account with that number, with its user, or None."""
+    if not sharding.enabled():
+        return UserBankAccount.objects.select_related('user').filter(account_no=account_no).first()
+    entry = AccountDirectory.objects.select_related('user').filter(account_no=account_no).first()
+    if entry is None:
+        return None
+    account = UserBankAccount.objects.using(entry.shard).filter(account_no=account_no).first()
+    return account and _attach(entry.user, account)
+
+
+def find_accounts(account_nos):
+    """{account_no: account, with its user} for the numbers that exist, one query per shard they are on."""
+    if not sharding.enabled():
+        return UserBankAccount.objects.select_related('user').in_bulk(account_nos, field_name='account_no')
+    found = {}
+    for shard, numbers in shards_of(account_nos).items():
+        found.update(UserBankAccount.objects.using(shard).in_bulk(numbers, field_name='account_no'))
+    attach_users(found.values())
+    return found
+
+
+def attach_users(accounts):
+    """Load the users of accounts read from a shard, where select_related('user') can't join them."""
+    accounts = [account for account in accounts if not UserBankAccount.user.is_cached(account)]
+    users = User.objects.in_bulk({account.user_id for account in accounts})
+    for account in accounts:
+        _attach(users[account.user_id], account)
+
+
+async def afind_account(account_no):
+    if not sharding.enabled():
+        return await UserBankAccount.objects.select_related('user').filter(account_no=account_no).afirst()
+    entry = await AccountDirectory.objects.select_related('user').filter(account_no=account_no).afirst()
+    if entry is None:
+        return None
+    account = await UserBankAccount.objects.using(entry.shard).filter(account_no=account_no).afirst()
+    return account and _attach(entry.user, account)
+
+
+def attach_account(user):
+    """Load the account of a user read with select_related('account_directory') from its shard."""
+    try:
+        entry = user.account_directory
+    except AccountDirectory.DoesNotExist:
+        return _attach(user, None)
+    return _attach(user, UserBankAccount.objects.using(entry.shard).filter(user_id=user.pk).first())
+
+
+async def aattach_account(user):
+    try:
+        entry = user.account_directory
+    except AccountDirectory.DoesNotExist:
+        return _attach(user, None)
+    return _attach(user, await UserBankAccount.objects.using(entry.shard).filter(user_id=user.pk).afirst())
@@ -3,6 +3,9 @@ from django.contrib.auth.models import User
 from .constants import ACCOUNT_TYPE,GENDER_TYPE
 from django import forms
 from .models import UserBankAccount,UserAddress
+from .cache import get_profile
+from .directory import open_account
+from .numbers import next_account_no
 
 class UserRegistrationForm(UserCreationForm):
     birth_date = forms.DateField(widget=forms.DateInput(attrs={'type':'date'}))
@@ -37,12 +40,12 @@ class UserRegistrationForm(UserCreationForm):
                 city = city,
                 street_address = street_address
             )
-            UserBankAccount.objects.create(
-                user = our_user,
+            open_account(
+                our_user,
                 account_type = account_type,
                 birth_date = birth_date,
                 gender = gender,
-                account_no = 2220109 + our_user.id
+                account_no = next_account_no()
             )
             return our_user
     
@@ -85,35 +88,28 @@ class UserUpdateForm(forms.ModelForm):
                 )
             })
         # IF the user has already assigned to an account
-        if self.instance:
-            try:
-                user_account = self.instance.account
-                user_address = self.instance.address
-            except UserBankAccount.DoesNotExist:
-                user_account = None
-                user_address = None
-
-            if user_account:
-                self.fields['account_type'].initial = user_account.account_type
-                self.fields['gender'].initial = user_account.gender
-                self.fields['birth_date'].initial = user_account.birth_date
-                self.fields['street_address'].initial = user_address.street_address
-                self.fields['city'].initial = user_address.city
-                self.fields['postal_code'].initial = user_address.postal_code
-                self.fields['country'].initial = user_address.country
+        if self.instance and self.instance.pk:
+            profile = get_profile(self.instance)  # cached, no account/address lookups
+
+            if profile:
+                for field in ['account_type', 'gender', 'birth_date', 'street_address', 'city', 'postal_code', 'country']:
+                    self.fields[field].initial = profile[field]
 
     def save(self, commit=True):
         user = super().save(commit=False)
         if commit:
             user.save()
 
-            user_account, created = UserBankAccount.objects.get_or_create(user=user) # if the user already has an account then it will go though otherwise an account will be created and it will go into 'created'
+            try:
+                user_account = user.account
+            except UserBankAccount.DoesNotExist:
+                user_account = open_account(user, account_no=next_account_no())
             user_address, created = UserAddress.objects.get_or_create(user=user) 
 
             user_account.account_type = self.cleaned_data['account_type']
             user_account.gender = self.cleaned_data['gender']
             user_account.birth_date = self.cleaned_data['birth_date']
-            user_account.save()
+            user_account.save(update_fields=['account_type', 'gender', 'birth_date'])  # never write back a stale balance
 
             user_address.street_address = self.cleaned_data['street_address']
             user_address.city = self.cleaned_data['city']
@@ -122,3 +118,12 @@ class UserUpdateForm(forms.ModelForm):
             user_address.save()
 
         return user
+
+
+class ImportRowForm(UserRegistrationForm):
+    # used by accounts.importer, which checks username uniqueness with one query per chunk
+    def clean_username(self):
+        return self.cleaned_data.get('username')
+
+    def validate_unique(self):
+        pass
@@ -0,0 +1,147 @@
+"""
+Password hashers for PASSWORD_HASH_PROFILE, the same algorithms as Django's own
+(existing hashes keep working) with two changes:
+
+- the work factors come from PASSWORD_HASH_PARAMS. A login whose stored hash was
+  made with another profile or other parameters is re-hashed with the current ones
+  by Django's check_password, so switching profiles needs no migration.
+- with PASSWORD_HASH_WORKERS set, at most that many hashes run at once and the
+  other logins wait for a slot, so a login storm can't take every CPU from the money
+  views. hashlib, scrypt and argon2 let go of the GIL while hashing, so the slots are
+  a semaphore in the request threads: a pool of processes measured no better
+  (bench_login on one CPU with 4 login threads: deposit p95 around 19 ms without a
+  limit, 6 ms with one slot either way).
+
+The time spent hashing is added up per request (QueryBudgetMiddleware reports it as
+hash in Server-Timing).
+"""
+import base64
+import hashlib
+import threading
+import time
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.contrib.auth import hashers
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+_perf = ContextVar('password_hash_perf', default=None)
+_slots = None
+_slots_lock = threading.Lock()
+
+
+def track(perf):
+    """Add hashing time to perf['hash'] for the rest of this request, returns the token for untrack."""
+    return _perf.set(perf)
+
+
+def untrack(token):
+    _perf.reset(token)
+
+
+def _limit():
+    global _slots
+    workers = settings.PASSWORD_HASH_WORKERS
+    if not workers:
+        return None
+    with _slots_lock:
+        if _slots is None:
+            _slots = threading.BoundedSemaphore(workers)
+        return _slots
+
+
+@receiver(setting_changed)
+def _settings_changed(setting, **kwargs):
+    global _slots
+    if setting == 'PASSWORD_HASH_WORKERS':
+        with _slots_lock:
+            _slots = None
+    elif setting == 'PASSWORD_HASH_PARAMS':
+        # the hashers read their parameters once, when Django first builds them
+        hashers.get_hashers.cache_clear()
+        hashers.get_hashers_by_algorithm.cache_clear()
+
+
+def run(fn, *args, **kwargs):
+    """fn(*args, **kwargs), waiting for one of the PASSWORD_HASH_WORKERS slots when that is set."""
+    start = time.perf_counter()
+    try:
+        slots = _limit()
+        if slots is None:
+            return fn(*args, **kwargs)
+        with slots:
+            return fn(*args, **kwargs)
+    finally:
+        perf = _perf.get()
+        if perf is not None:
+            perf['hash'] = perf.get('hash', 0.0) + time.perf_counter() - start
+
+
+class TunedHasher:
+    # which PASSWORD_HASH_PARAMS entry sets the class attributes
+    profile = None
+
+    def __init__(self):
+        for name, value in settings.PASSWORD_HASH_PARAMS.get(self.profile, {}).items():
+            setattr(self, name, value)
+
+
+class PBKDF2PasswordHasher(TunedHasher, hashers.PBKDF2PasswordHasher):
+    profile = 'pbkdf2'
+
+    def encode(self, password, salt, iterations=None):
+        self._check_encode_args(password, salt)
+        iterations = iterations or self.iterations
+        hash = run(hashlib.pbkdf2_hmac, self.digest().name, password.encode(), salt.encode(), iterations)
+        hash = base64.b64encode(hash).decode('ascii').strip()
+        return '%s$%d$%s$%s' % (self.algorithm, iterations, salt, hash)
+
+
+class ScryptPasswordHasher(TunedHasher, hashers.ScryptPasswordHasher):
+    profile = 'scrypt'
+
+    def encode(self, password, salt, n=None, r=None, p=None):
+        self._check_encode_args(password, salt)
+        n = n or self.work_factor
+        r = r or self.block_size
+        p = p or self.parallelism
+        hash_ = run(
+            hashlib.scrypt, password.encode(), salt=salt.encode(), n=n, r=r, p=p, maxmem=self.maxmem, dklen=64,
+        )
+        hash_ = base64.b64encode(hash_).decode('ascii').strip()
+        return '%s$%d$%s$%d$%d$%s' % (self.algorithm, n, salt, r, p, hash_)
+
+
+def _argon2_verify(encoded, password):
+    import argon2
+
+    try:
+        return argon2.PasswordHasher().verify(encoded, password)
+    except argon2.exceptions.VerificationError:
+        return False
+
+
+class Argon2PasswordHasher(TunedHasher, hashers.Argon2PasswordHasher):
+    # needs argon2-cffi installed, like Django's
+    profile = 'argon2'
+
+    def encode(self, password, salt):
+        argon2 = self._load_library()
+        params = self.params()
+        data = run(
+            argon2.low_level.hash_secret,
+            password.encode(),
+            salt.encode(),
+            time_cost=params.time_cost,
+            memory_cost=params.memory_cost,
+            parallelism=params.parallelism,
+            hash_len=params.hash_len,
+            type=params.type,
+        )
+        return self.algorithm + data.decode('ascii')
+
+    def verify(self, password, encoded):
+        algorithm, rest = encoded.split('$', 1)
+        assert algorithm == self.algorithm
+        return run(_argon2_verify, '$' + rest, password)
@@ -0,0 +1,38 @@
+"""
+The part of accounts.importer that runs in the worker processes. Workers are spawned,
+so this module must import without Django being set up; init_worker does that first.
+"""
+import os
+
+FIELDS = [
+    'username', 'first_name', 'last_name', 'email', 'account_type', 'birth_date',
+    'gender', 'street_address', 'city', 'postal_code', 'country',
+]
+
+
+def init_worker(settings_module):
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', settings_module)
+    import django
+    django.setup()
+
+
+def prepare(chunk):
+    """Returns (line_no, values, error) per row, values holds the cleaned fields and the hashed password."""
+    from django.contrib.auth.hashers import make_password
+    from .forms import ImportRowForm
+
+    prepared = []
+    for line_no, row in chunk:
+        if not isinstance(row, dict):
+            prepared.append((line_no, None, 'Could not read the row'))
+            continue
+        data = {**row, 'password1': row.get('password'), 'password2': row.get('password')}
+        form = ImportRowForm(data)
+        if not form.is_valid():
+            error = '; '.join(f'{field}: {" ".join(messages)}' for field, messages in form.errors.items())
+            prepared.append((line_no, None, error))
+            continue
+        values = {field: form.cleaned_data[field] for field in FIELDS}
+        values['password'] = make_password(form.cleaned_data['password1'])
+        prepared.append((line_no, values, None))
+    return prepared
@@ -0,0 +1,153 @@
+"""
+Bulk onboarding of customers from a CSV/JSONL file.
+
+Rows carry the registration form fields (username, password, first_name, last_name,
+email, account_type, birth_date, gender, street_address, city, postal_code,
+country). They are read lazily in chunks; each chunk is validated with the
+registration form rules and its passwords hashed in a worker process, then written
+with one bulk_create per table. Only a few chunks are in flight at any time, so
+memory use doesn't grow with the file.
+"""
+import csv
+import json
+import multiprocessing
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models.functions import Lower
+
+from .directory import open_accounts
+from .import_worker import init_worker, prepare
+from .models import UserAddress, UserBankAccount
+from .numbers import allocator
+
+EXISTS = 'username: A user with that username already exists.'
+
+
+def read_rows(stream, fmt='csv'):
+    """Yield (line_no, row dict) from a CSV (with header) or JSONL stream."""
+    if fmt == 'jsonl':
+        for line_no, line in enumerate(stream, start=1):
+            if line.strip():
+                try:
+                    yield line_no, json.loads(line)
+                except ValueError:
+                    yield line_no, None
+    else:
+        reader = csv.DictReader(stream)
+        for row in reader:
+            yield reader.line_num, row
+
+
+def chunks(rows, size):
+    rows = iter(rows)
+    while chunk := list(islice(rows, size)):
+        yield chunk
+
+
+def _fold(username):
+    # usernames are unique regardless of case, as the registration form checks them
+    return username.lower() if isinstance(username, str) else username
+
+
+def _taken(usernames):
+    """The ones of usernames (folded with _fold) that a user already has, in any case."""
+    folded = {_fold(username) for username in usernames}
+    return set(
+        User.objects.annotate(folded=Lower('username')).filter(folded__in=list(folded)).values_list('folded', flat=True)
+    )
+
+
+def skip_existing(chunk):
+    """Drop rows whose username is already in the database before paying for their hashing."""
+    taken = _taken({row.get('username') for _, row in chunk if isinstance(row, dict)})
+    keep, rejected = [], []
+    for line_no, row in chunk:
+        if isinstance(row, dict) and _fold(row.get('username')) in taken:
+            rejected.append((line_no, EXISTS))
+        else:
+            keep.append((line_no, row))
+    return keep, rejected
+
+
+def insert(prepared, rejected=()):
+    """Write one prepared chunk, returns (created, rejected) with rejected as (line_no, error) pairs."""
+    rejected = list(rejected) + [(line_no, error) for line_no, values, error in prepared if error]
+    rows = {}
+    for line_no, values, error in prepared:
+        if error:
+            continue
+        if _fold(values['username']) in rows:
+            rejected.append((line_no, 'username: duplicate username in this file'))
+        else:
+            rows[_fold(values['username'])] = (line_no, values)
+
+    # again, an earlier chunk of the same file may have been inserted since skip_existing
+    for username in _taken(rows):
+        line_no, _ = rows.pop(username)
+        rejected.append((line_no, EXISTS))
+    if not rows:
+        return 0, rejected
+
+    with transaction.atomic():
+        users = User.objects.bulk_create([
+            User(
+                username=values['username'],
+                password=values['password'],
+                first_name=values['first_name'],
+                last_name=values['last_name'],
+                email=values['email'],
+            )
+            for _, values in rows.values()
+        ])
+        UserAddress.objects.bulk_create([
+            UserAddress(
+                user=user,
+                street_address=values['street_address'],
+                city=values['city'],
+                postal_code=values['postal_code'],
+                country=values['country'],
+            )
+            for user, (_, values) in zip(users, rows.values())
+        ])
+        account_nos = allocator.take(len(users))
+        open_accounts([
+            UserBankAccount(
+                user=user,
+                account_type=values['account_type'],
+                birth_date=values['birth_date'],
+                gender=values['gender'],
+                account_no=account_no,
+            )
+            for user, (_, values), account_no in zip(users, rows.values(), account_nos)
+        ])
+    return len(users), rejected
+
+
+def import_rows(rows, chunk_size=500, workers=None):
+    """
+    Validate, hash and insert rows (an iterable of (line_no, row dict)) chunk by chunk.
+    Yields (created, rejected) per chunk, in file order.
+    """
+    workers = workers or os.cpu_count() or 1
+    # spawned, not forked: a forked worker would inherit (and on exit close) our database connection
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context('spawn'),
+        initializer=init_worker,
+        initargs=(os.environ.get('DJANGO_SETTINGS_MODULE', 'swiss_bank.settings'),),
+    ) as pool:
+        pending = deque()
+        for chunk in chunks(rows, chunk_size):
+            chunk, rejected = skip_existing(chunk)
+            pending.append((pool.submit(prepare, chunk), rejected))
+            if len(pending) >= workers * 2:
+                future, rejected = pending.popleft()
+                yield insert(future.result(), rejected)
+        while pending:
+            future, rejected = pending.popleft()
+            yield insert(future.result(), rejected)
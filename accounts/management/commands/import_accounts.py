@@ -0,0 +1,48 @@
+import json
+import time
+
+from django.core.management.base import BaseCommand
+
+from accounts import importer
+
+
+class Command(BaseCommand):
+    help = (
+        'Create users, addresses and bank accounts from a CSV (with header) or JSONL file. '
+        'Rows are validated like the registration form and rejected rows are reported.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=['csv', 'jsonl'], help='defaults to the file extension')
+        parser.add_argument('--chunk-size', type=int, default=500)
+        parser.add_argument('--workers', type=int, help='password hashing processes, defaults to the CPU count')
+        parser.add_argument('--report', help='write rejected rows to this JSONL file instead of stdout')
+
+    def handle(self, *args, **options):
+        fmt = options['format'] or ('jsonl' if options['path'].endswith(('.jsonl', '.ndjson')) else 'csv')
+        report = open(options['report'], 'w', encoding='utf-8') if options['report'] else None
+        created = rejected = 0
+        start = time.perf_counter()
+        try:
+            with open(options['path'], newline='', encoding='utf-8') as stream:
+                rows = importer.read_rows(stream, fmt)
+                for chunk_created, chunk_rejected in importer.import_rows(
+                    rows, options['chunk_size'], options['workers']
+                ):
+                    created += chunk_created
+                    rejected += len(chunk_rejected)
+                    for line_no, error in sorted(chunk_rejected):
+                        if report:
+                            report.write(json.dumps({'line': line_no, 'error': error}) + '\n')
+                        else:
+                            self.stdout.write(f'line {line_no}: {error}')
+                    if options['verbosity'] > 1:
+                        self.stdout.write(f'{created} created, {rejected} rejected')
+        finally:
+            if report:
+                report.close()
+
+        self.stdout.write(self.style.SUCCESS(
+            f'{created} accounts created, {rejected} rows rejected in {time.perf_counter() - start:.1f}s'
+        ))
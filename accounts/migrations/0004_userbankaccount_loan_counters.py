@@ -0,0 +1,23 @@
+# Generated by Django 5.1 on 2026-10-18 05:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0003_userbankaccount_is_bankrupt'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userbankaccount',
+            name='active_loans',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='userbankaccount',
+            name='outstanding_loan',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=12),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.1 on 2026-10-18 07:40
+
+from django.db import migrations, models
+from django.db.models import Max
+
+
+def start_sequence(apps, schema_editor):
+    # continue after the numbers handed out as 2220109 + user id
+    UserBankAccount = apps.get_model('accounts', 'UserBankAccount')
+    AccountNumberSequence = apps.get_model('accounts', 'AccountNumberSequence')
+    highest = UserBankAccount.objects.aggregate(highest=Max('account_no'))['highest']
+    AccountNumberSequence.objects.create(name='account_no', next_value=max(2220110, (highest or 0) + 1))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0004_userbankaccount_loan_counters'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AccountNumberSequence',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True)),
+                ('next_value', models.BigIntegerField()),
+            ],
+        ),
+        migrations.RunPython(start_sequence, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 5.1 on 2026-10-18 16:12
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def fill_directory(apps, schema_editor):
+    # every account so far is on 'default'
+    UserBankAccount = apps.get_model('accounts', 'UserBankAccount')
+    AccountDirectory = apps.get_model('accounts', 'AccountDirectory')
+    batch = []
+    for user_id, account_no in UserBankAccount.objects.values_list('user_id', 'account_no').iterator(chunk_size=1000):
+        batch.append(AccountDirectory(user_id=user_id, account_no=account_no, shard='default'))
+        if len(batch) == 1000:
+            AccountDirectory.objects.bulk_create(batch)
+            batch = []
+    AccountDirectory.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0005_account_number_sequence'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='userbankaccount',
+            name='user',
+            field=models.OneToOneField(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, related_name='account', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.CreateModel(
+            name='AccountDirectory',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('account_no', models.IntegerField(unique=True)),
+                ('shard', models.CharField(default='default', max_length=50)),
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='account_directory', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.RunPython(fill_directory, migrations.RunPython.noop),
+    ]
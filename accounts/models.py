@@ -5,7 +5,8 @@ from .constants import ACCOUNT_TYPE,GENDER_TYPE
 # Create your models here.
 
 class UserBankAccount(models.Model):
-    user = models.OneToOneField(User, related_name='account',on_delete=models.CASCADE)
+    # no foreign key constraint, the account may be on another database than its user (core/sharding.py)
+    user = models.OneToOneField(User, related_name='account', on_delete=models.CASCADE, db_constraint=False)
     account_type = models.CharField(max_length=10,choices = ACCOUNT_TYPE)
     account_no = models.IntegerField(unique=True)
     birth_date = models.DateField(null=True,blank=True)
@@ -13,6 +14,9 @@ class UserBankAccount(models.Model):
     initial_deposit_date = models.DateField(auto_now_add=True)
     balance = models.DecimalField(max_digits=12, decimal_places=2, default=0)
     is_bankrupt = models.BooleanField(default=False)
+    # approved, unpaid loans, maintained by transactions.ledger (rebuild_loan_counters fixes them up)
+    active_loans = models.PositiveIntegerField(default=0)
+    outstanding_loan = models.DecimalField(max_digits=12, decimal_places=2, default=0)
 
     def __str__(self):
         return f"Account no: {str(self.account_no)}"
@@ -28,3 +32,22 @@ class UserAddress(models.Model):
     def __str__(self):
         return f"{self.user.username} - {self.street_address}"
 
+
+
+class AccountDirectory(models.Model):
+    # which ledger shard each account is on, kept on 'default' by accounts.directory
+    user = models.OneToOneField(User, related_name='account_directory', on_delete=models.CASCADE)
+    account_no = models.IntegerField(unique=True)
+    shard = models.CharField(max_length=50, default='default')
+
+    def __str__(self):
+        return f"{self.account_no} on {self.shard}"
+
+
+class AccountNumberSequence(models.Model):
+    # hi-lo counter for account numbers, see accounts/numbers.py
+    name = models.CharField(max_length=50, unique=True)
+    next_value = models.BigIntegerField()
+
+    def __str__(self):
+        return f"{self.name}: {self.next_value}"
@@ -0,0 +1,89 @@
+"""
+Account number allocation.
+
+Numbers come from the AccountNumberSequence table in blocks: one short transaction
+moves the counter ACCOUNT_NUMBER_BLOCK_SIZE ahead and the block is handed out from
+memory, so registrations only touch the table once per block. With
+ACCOUNT_NUMBER_CHECK_DIGIT on, a Luhn digit is appended (base * 10 + digit). Don't
+switch the check digit off again once numbers were issued with it, the shorter
+numbers could collide with them.
+"""
+import threading
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Max
+
+from .models import AccountNumberSequence, UserBankAccount
+
+SEQUENCE = 'account_no'
+FIRST_ACCOUNT_NO = 2220110
+
+
+def luhn_digit(number):
+    total = 0
+    for i, digit in enumerate(reversed(str(number))):
+        digit = int(digit)
+        if i % 2 == 0:
+            digit *= 2
+            if digit > 9:
+                digit -= 9
+        total += digit
+    return (10 - total % 10) % 10
+
+
+def is_valid(account_no):
+    return luhn_digit(account_no // 10) == account_no % 10
+
+
+def reserve(size):
+    """Move the counter size numbers ahead and return the first base number of the block."""
+    with transaction.atomic():
+        sequence = AccountNumberSequence.objects.select_for_update().filter(name=SEQUENCE).first()
+        if sequence is None:
+            # normally created by the migration, start after whatever is already in use
+            highest = UserBankAccount.objects.aggregate(highest=Max('account_no'))['highest']
+            sequence = AccountNumberSequence.objects.create(
+                name=SEQUENCE, next_value=max(FIRST_ACCOUNT_NO, (highest or 0) + 1)
+            )
+        AccountNumberSequence.objects.filter(pk=sequence.pk).update(next_value=F('next_value') + size)
+    return sequence.next_value
+
+
+def _format(base):
+    if getattr(settings, 'ACCOUNT_NUMBER_CHECK_DIGIT', False):
+        return base * 10 + luhn_digit(base)
+    return base
+
+
+class Allocator:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.free = []
+
+    def next(self):
+        with self.lock:
+            if self.free:
+                return _format(self.free.pop())
+        block_size = getattr(settings, 'ACCOUNT_NUMBER_BLOCK_SIZE', 100)
+        start = reserve(block_size)
+        # if the caller's transaction rolls back so does the reservation, so the rest
+        # of the block is only used once it's committed
+        transaction.on_commit(lambda: self._release(range(start + 1, start + block_size)))
+        return _format(start)
+
+    def take(self, count):
+        """count numbers from a block of their own, for bulk inserts."""
+        start = reserve(count)
+        return [_format(base) for base in range(start, start + count)]
+
+    def _release(self, bases):
+        with self.lock:
+            self.free.extend(reversed(bases))
+
+
+allocator = Allocator()
+
+
+def next_account_no():
+    return allocator.next()
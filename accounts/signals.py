@@ -0,0 +1,11 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .cache import invalidate_profile
+from .models import UserAddress, UserBankAccount
+
+
+@receiver([post_save, post_delete], sender=UserBankAccount)
+@receiver([post_save, post_delete], sender=UserAddress)
+def clear_cached_profile(sender, instance, **kwargs):
+    invalidate_profile(instance.user_id)
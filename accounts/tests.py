@@ -1,3 +1,258 @@
-from django.test import TestCase
+import threading
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth import hashers as django_hashers
+from django.contrib.auth.hashers import check_password, make_password
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connections, transaction
+from django.test import Client, TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+
+from core.testing import assert_query_budget
+
+from . import hashers, numbers
+from .cache import get_profile
+from .directory import open_account
+from .import_worker import prepare
+from .importer import EXISTS, insert, skip_existing
+from .models import AccountDirectory, AccountNumberSequence, UserAddress
+
+
+class ProfileTests(TransactionTestCase):
+    databases = '__all__'
+
+    def test_query_budget(self):
+        user = User.objects.create_user(username='alice', email='alice@example.com', password='pass-1234')
+        open_account(user, account_type='Savings', account_no=10_000_000)
+        UserAddress.objects.create(user=user, street_address='Main Street 1', city='Bern', postal_code=3000, country='Switzerland')
+        self.client.force_login(user)
+        self.assertEqual(assert_query_budget(self.client, 'profile').status_code, 200)
+        response = assert_query_budget(self.client, 'profile', method='post', data={
+            'first_name': 'Alice', 'last_name': 'Smith', 'email': 'alice@example.com', 'birth_date': '1990-01-01',
+            'gender': 'Female', 'account_type': 'Current', 'street_address': 'Main Street 1', 'city': 'Zurich',
+            'postal_code': 8000, 'country': 'Switzerland',
+        })
+        self.assertEqual(response.status_code, 302)
+        user.account.refresh_from_db()
+        self.assertEqual(user.account.account_type, 'Current')
+
+
+class ProfileCacheTests(TestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='alice', email='alice@example.com', password='pass-1234')
+        self.account = open_account(self.user, account_type='Savings', account_no=10_000_000)
+        self.address = UserAddress.objects.create(
+            user=self.user, street_address='Main Street 1', city='Bern', postal_code=3000, country='Switzerland',
+        )
+
+    def profile(self):
+        return get_profile(User.objects.get(pk=self.user.pk))
+
+    def test_second_read_is_cached(self):
+        self.assertEqual((self.profile()['account_no'], self.profile()['city']), (10_000_000, 'Bern'))
+        user = User.objects.get(pk=self.user.pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(get_profile(user)['account_type'], 'Savings')
+
+    def test_saving_the_account_or_address_invalidates_it(self):
+        self.profile()
+        self.account.account_type = 'Current'
+        self.account.save()
+        self.assertEqual(self.profile()['account_type'], 'Current')
+        self.address.city = 'Zurich'
+        self.address.save()
+        self.assertEqual(self.profile()['city'], 'Zurich')
+        self.address.delete()
+        self.assertIsNone(self.profile())
+
+
+def import_row(username):
+    return {
+        'username': username, 'password': 'a-Long-pass-1234', 'first_name': 'A', 'last_name': 'B',
+        'email': f'{username.lower()}@example.com', 'account_type': 'Savings', 'birth_date': '1990-01-01',
+        'gender': 'Female', 'street_address': 'Main Street 1', 'city': 'Bern', 'postal_code': '3000',
+        'country': 'Switzerland',
+    }
+
+
+class RegistrationTests(TestCase):
+    databases = '__all__'
+
+    def test_sign_up_opens_an_account_and_logs_in(self):
+        response = self.client.post(reverse('register'), {
+            **import_row('newcomer'), 'password1': 'a-Long-pass-1234', 'password2': 'a-Long-pass-1234',
+        })
+        self.assertEqual(response.status_code, 302)
+        user = User.objects.get(username='newcomer')
+        self.assertEqual(int(self.client.session['_auth_user_id']), user.pk)
+        self.assertEqual(self.client.session['_auth_user_backend'], 'accounts.backends.AccountBackend')
+        self.assertEqual(user.account.account_type, 'Savings')
+
+
+class ImporterTests(TestCase):
+    databases = '__all__'
+
+    def test_usernames_are_unique_in_any_case(self):
+        User.objects.create_user(username='Alice', password='pass-1234')
+        chunk, rejected = skip_existing([(1, import_row('alice')), (2, import_row('carol')), (3, import_row('CAROL'))])
+        self.assertEqual(rejected, [(1, EXISTS)])
+
+        created, rejected = insert(prepare(chunk))
+        self.assertEqual((created, rejected), (1, [(3, 'username: duplicate username in this file')]))
+        self.assertEqual(
+            list(User.objects.order_by('username').values_list('username', flat=True)), ['Alice', 'carol'],
+        )
+        self.assertEqual(insert(prepare([(4, import_row('ALICE'))])), (0, [(4, EXISTS)]))
+
+
+# cheap enough for tests, the hashers are the same as with the real parameters
+FAST_HASHES = {
+    'pbkdf2': {'iterations': 1000},
+    'scrypt': {'work_factor': 2 ** 10, 'block_size': 8, 'parallelism': 1},
+}
+
+
+@override_settings(PASSWORD_HASH_PARAMS=FAST_HASHES)
+class PasswordHasherTests(TestCase):
+    databases = '__all__'
+
+    def test_hashes_are_djangos_own(self):
+        encoded = make_password('a-Long-pass-1234', salt='fixedsalt123')
+        self.assertEqual(encoded, django_hashers.PBKDF2PasswordHasher().encode('a-Long-pass-1234', 'fixedsalt123', 1000))
+        self.assertTrue(check_password('a-Long-pass-1234', encoded))
+        self.assertFalse(check_password('a-wrong-pass-1234', encoded))
+        scrypt = hashers.ScryptPasswordHasher().encode('a-Long-pass-1234', 'fixedsalt123')
+        self.assertEqual(
+            scrypt, django_hashers.ScryptPasswordHasher().encode('a-Long-pass-1234', 'fixedsalt123', n=2 ** 10, r=8, p=1),
+        )
+
+    def test_login_rehashes_with_new_parameters(self):
+        user = User.objects.create_user('rehash', password='a-Long-pass-1234')
+        self.assertTrue(user.password.startswith('pbkdf2_sha256$1000$'))
+        with override_settings(PASSWORD_HASH_PARAMS={**FAST_HASHES, 'pbkdf2': {'iterations': 1200}}):
+            self.assertTrue(user.check_password('a-Long-pass-1234'))
+            user.refresh_from_db()
+            self.assertTrue(user.password.startswith('pbkdf2_sha256$1200$'))
+            self.assertFalse(user.check_password('a-wrong-pass-1234'))
+
+    def test_other_profiles_still_log_in_and_move_to_the_current_one(self):
+        user = User.objects.create_user('fallback')
+        for hasher in ('scrypt', 'pbkdf2_sha1'):
+            user.password = make_password('a-Long-pass-1234', hasher=hasher)
+            user.save(update_fields=['password'])
+            self.assertTrue(user.check_password('a-Long-pass-1234'))
+            user.refresh_from_db()
+            self.assertTrue(user.password.startswith('pbkdf2_sha256$1000$'), hasher)
+
+    @override_settings(PASSWORD_HASH_WORKERS=1)
+    def test_limited_hashing_is_timed(self):
+        perf = {}
+        token = hashers.track(perf)
+        try:
+            encoded = make_password('a-Long-pass-1234')
+        finally:
+            hashers.untrack(token)
+        self.assertTrue(check_password('a-Long-pass-1234', encoded))
+        self.assertGreater(perf['hash'], 0)
+
+
+class AccountNumberTests(TestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        # a fresh block cache, the process-wide one may hold numbers of another test's database
+        patcher = mock.patch.object(numbers, 'allocator', numbers.Allocator())
+        self.allocator = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_luhn_check_digit(self):
+        self.assertEqual(numbers.luhn_digit(7992739871), 3)
+        self.assertTrue(numbers.is_valid(79927398713))
+        self.assertFalse(numbers.is_valid(79927398714))
+        with override_settings(ACCOUNT_NUMBER_CHECK_DIGIT=True):
+            issued = [numbers.next_account_no() for _ in range(3)] + self.allocator.take(3)
+        self.assertTrue(all(numbers.is_valid(account_no) for account_no in issued))
+        self.assertEqual(len(set(issued)), 6)
+
+    @override_settings(ACCOUNT_NUMBER_BLOCK_SIZE=5)
+    def test_rest_of_the_block_is_used_after_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                first = numbers.next_account_no()
+        with self.assertNumQueries(0):
+            self.assertEqual([numbers.next_account_no() for _ in range(4)], list(range(first + 1, first + 5)))
+        self.assertEqual(numbers.next_account_no(), first + 5)  # a new block
+
+    @override_settings(ACCOUNT_NUMBER_BLOCK_SIZE=5)
+    def test_rolled_back_block_is_never_handed_out(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            try:
+                with transaction.atomic():
+                    first = numbers.next_account_no()
+                    raise ValueError('the registration failed')
+            except ValueError:
+                pass
+        self.assertEqual(self.allocator.free, [])
+        # the counter move was rolled back with it, the same block is reserved again
+        self.assertEqual(numbers.next_account_no(), first)
+
+
+class AccountNumberConcurrencyTests(TransactionTestCase):
+    databases = '__all__'
+
+    threads = 6
+
+    def setUp(self):
+        patcher = mock.patch.object(numbers, 'allocator', numbers.Allocator())
+        self.allocator = patcher.start()
+        self.addCleanup(patcher.stop)
+        # the migration's row, until an earlier TransactionTestCase flushed it
+        AccountNumberSequence.objects.update_or_create(
+            name=numbers.SEQUENCE, defaults={'next_value': numbers.FIRST_ACCOUNT_NO},
+        )
+
+    def run_threads(self, target):
+        start = threading.Barrier(self.threads)
+        errors = []
+
+        def worker(index):
+            start.wait()
+            try:
+                target(index)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=worker, args=(index,)) for index in range(self.threads)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+
+    def test_concurrent_reservations_get_separate_blocks(self):
+        starts = []
+        self.run_threads(lambda index: starts.extend(numbers.reserve(10) for _ in range(3)))
+        self.assertEqual(sorted(starts), list(range(numbers.FIRST_ACCOUNT_NO, numbers.FIRST_ACCOUNT_NO + 180, 10)))
+        self.assertEqual(
+            AccountNumberSequence.objects.get(name=numbers.SEQUENCE).next_value, numbers.FIRST_ACCOUNT_NO + 180,
+        )
+
+    @override_settings(ACCOUNT_NUMBER_BLOCK_SIZE=3, PASSWORD_HASH_PARAMS=FAST_HASHES)
+    def test_concurrent_sign_ups_get_different_numbers(self):
+        def sign_up(index):
+            for n in range(4):
+                response = Client().post(reverse('register'), {
+                    **import_row(f'signup_{index}_{n}'), 'password1': 'a-Long-pass-1234', 'password2': 'a-Long-pass-1234',
+                })
+                self.assertEqual(response.status_code, 302)
+
+        self.run_threads(sign_up)
+        account_nos = list(AccountDirectory.objects.values_list('account_no', flat=True))
+        self.assertEqual(len(account_nos), self.threads * 4)
+        self.assertEqual(len(set(account_nos)), len(account_nos))
@@ -7,6 +7,7 @@ from django.contrib.auth.views import LoginView, LogoutView
 from django.views import View
 from django.shortcuts import redirect
 from django.contrib.auth.forms import SetPasswordForm
+from django.db.transaction import atomic
 from transactions.views import send_transaction_email
 
 # Create your views here.
@@ -19,7 +20,8 @@ class UserRegistrationView(FormView):
     def form_valid(self,form):
         # print(form.cleaned_data)
         user = form.save() 
-        login(self.request, user)
+        # two backends are configured, the one that loads the account with the user
+        login(self.request, user, backend='accounts.backends.AccountBackend')
         return super().form_valid(form)
 
 
@@ -54,8 +56,9 @@ def password_change(request):
         if request.method == 'POST':
             form = SetPasswordForm(user = request.user, data=request.POST)
             if form.is_valid():
-                form.save()
-                send_transaction_email(request.user, 'Password Change', "Password Change Mail", "accounts/password_change_mail.html")
+                with atomic():
+                    form.save()
+                    send_transaction_email(request.user, 'Password Change', "Password Change Mail", "accounts/password_change_mail.html")
                 update_session_auth_hash(request, form.user)
                 return redirect('profile')
         else:
@@ -1,3 +1,15 @@
 from django.contrib import admin
+from .models import IdempotencyKey, QueuedEmail
 
 # Register your models here.
+@admin.register(QueuedEmail)
+class QueuedEmailAdmin(admin.ModelAdmin):
+    list_display = ['subject', 'to', 'status', 'attempts', 'created', 'sent_at']
+    list_filter = ['status']
+
+
+@admin.register(IdempotencyKey)
+class IdempotencyKeyAdmin(admin.ModelAdmin):
+    list_display = ['user', 'key', 'status_code', 'created', 'expires_at']
+    list_select_related = ['user']
+    search_fields = ['key']
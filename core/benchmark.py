@@ -0,0 +1,144 @@
+"""Helpers shared by the bench_* management commands."""
+import random
+import statistics
+import time
+from collections import defaultdict
+from datetime import timedelta
+from decimal import Decimal
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db.models import F
+from django.utils import timezone
+
+from accounts.directory import attach_users, open_account, open_accounts
+from accounts.models import UserAddress, UserBankAccount
+from accounts.numbers import allocator, next_account_no
+from core import sharding
+from transactions import journal
+from transactions.constants import DEPOSIT, WITHDRAWAL
+from transactions.models import Transaction
+
+
+def percentile(values, p):
+    values = sorted(values)
+    if not values:
+        return 0
+    index = min(len(values) - 1, max(0, round(p / 100 * len(values)) - 1))
+    return values[index]
+
+
+def summarize(latencies_ms):
+    return {
+        'count': len(latencies_ms),
+        'mean_ms': round(statistics.fmean(latencies_ms), 3) if latencies_ms else 0,
+        'p50_ms': round(percentile(latencies_ms, 50), 3),
+        'p95_ms': round(percentile(latencies_ms, 95), 3),
+        'p99_ms': round(percentile(latencies_ms, 99), 3),
+    }
+
+
+def timed(fn, repeat=5):
+    """Run fn repeat times, returns (last result, list of run times in ms)."""
+    result, times = None, []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        times.append((time.perf_counter() - start) * 1000)
+    return result, times
+
+
+def bench_account(username, account_type='Savings'):
+    user, _ = User.objects.get_or_create(username=username, defaults={'email': f'{username}@example.com'})
+    try:
+        return user.account
+    except UserBankAccount.DoesNotExist:
+        return open_account(user, account_type=account_type, account_no=next_account_no())
+
+
+def seed_users(count, password, prefix='bench_user', batch_size=1000):
+    """
+    Create count users with an address and a funded-later account, the same rows
+    UserRegistrationForm.save writes but with bulk inserts. The password is hashed once
+    and shared. Returns the created accounts.
+    """
+    encoded = make_password(password)
+    # go on from the highest number, a count would hand out a taken one after a user is deleted
+    taken = User.objects.filter(username__startswith=f'{prefix}_').values_list('username', flat=True)
+    suffixes = (username[len(prefix) + 1:] for username in taken.iterator())
+    start = max((int(suffix) for suffix in suffixes if suffix.isdigit()), default=-1) + 1
+    accounts = []
+    for offset in range(start, start + count, batch_size):
+        users = User.objects.bulk_create([
+            User(username=f'{prefix}_{i}', email=f'{prefix}_{i}@example.com', password=encoded, first_name='Bench')
+            for i in range(offset, min(offset + batch_size, start + count))
+        ])
+        UserAddress.objects.bulk_create([
+            UserAddress(user=user, street_address='1 Bench Street', city='Zurich', postal_code=8000, country='CH')
+            for user in users
+        ])
+        accounts += open_accounts([
+            UserBankAccount(user=user, account_type='Savings', gender='Male', account_no=account_no)
+            for user, account_no in zip(users, allocator.take(len(users)))
+        ])
+    return accounts
+
+
+def bench_accounts(prefix):
+    """The accounts of the users seed_users made with prefix, from every ledger shard, with their users."""
+    user_ids = list(User.objects.filter(username__startswith=prefix).values_list('pk', flat=True))
+    accounts = []
+    for alias in sharding.shards():
+        accounts += UserBankAccount.objects.using(alias).filter(user_id__in=user_ids)
+    attach_users(accounts)
+    return accounts
+
+
+def by_shard(accounts):
+    """{shard: its accounts}"""
+    placed = defaultdict(list)
+    for account in accounts:
+        placed[sharding.shard_of(account)].append(account)
+    return placed
+
+
+def fund(accounts, opening):
+    """Credit opening to every account, booked as opening entries so verify_journal still agrees."""
+    for alias, group in by_shard(accounts).items():
+        with sharding.on(alias), sharding.atomic():
+            journal.post([(None, opening, account.pk, None) for account in group])
+            UserBankAccount.objects.filter(pk__in=[account.pk for account in group]).update(
+                balance=F('balance') + opening
+            )
+
+
+def seed_transactions(account, count, days=3650, batch_size=5000):
+    """Bulk insert count random transactions for account, spread over the last `days` days."""
+    now = timezone.now()
+    step = timedelta(days=days) / max(count, 1)
+    start = now - timedelta(days=days)
+    balance = Decimal(0)
+    for offset in range(0, count, batch_size):
+        rows, timestamps = [], []
+        for i in range(offset, min(offset + batch_size, count)):
+            amount = Decimal(random.randint(100, 5000))
+            transaction_type = DEPOSIT if balance < amount or random.random() < 0.6 else WITHDRAWAL
+            balance += amount if transaction_type == DEPOSIT else -amount
+            rows.append(Transaction(
+                account=account,
+                amount=amount,
+                balance_after_transaction=balance,
+                transaction_type=transaction_type,
+            ))
+            timestamps.append(start + step * i)
+        with sharding.atomic():
+            # auto_now_add stamps every row with now on insert, bulk_update doesn't run it
+            Transaction.objects.bulk_create(rows)
+            for row, timestamp in zip(rows, timestamps):
+                row.timestamp = timestamp
+            Transaction.objects.bulk_update(rows, ['timestamp'], batch_size=1000)
+    UserBankAccount.objects.filter(pk=account.pk).update(balance=F('balance') + balance)
+    # booked as one opening entry so verify_journal still agrees with the balance
+    if balance:
+        journal.record(None, balance, account.pk)
+    return balance
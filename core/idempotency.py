@@ -0,0 +1,153 @@
+"""
+Idempotency for money-moving POSTs.
+
+A POST that carries an Idempotency-Key header (API callers) or an idempotency_key
+form field ({% idempotency_field %} in the form) runs once per user and key. The key
+row is inserted before the view runs and the unique (user, key) index turns that
+insert into the lookup as well, so a fresh key costs one INSERT and one UPDATE.
+Sending the same key again returns the stored response without running the view;
+while the first request is still running the repeat gets a 409.
+"""
+import hashlib
+import json
+from datetime import timedelta
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.http import HttpResponse, HttpResponseBadRequest
+from django.utils import timezone
+
+from .models import IdempotencyKey
+
+HEADER = 'HTTP_IDEMPOTENCY_KEY'
+FIELD = 'idempotency_key'
+MAX_LENGTH = 64
+
+
+def request_key(request):
+    return (request.META.get(HEADER) or request.POST.get(FIELD) or '').strip() or None
+
+
+def fingerprint(request):
+    # the same key with different data is a client bug, not a retry
+    data = sorted(
+        (name, value) for name, values in request.POST.lists()
+        if name not in ('csrfmiddlewaretoken', FIELD) for value in values
+    )
+    if request.content_type == 'application/json':
+        data = request.body.decode(errors='replace')
+    files = sorted((name, upload.name, upload.size) for name, upload in request.FILES.items())
+    return hashlib.sha256(json.dumps([request.path, data, files]).encode()).hexdigest()
+
+
+def _insert(**fields):
+    # on its own the INSERT commits by itself; inside a transaction the savepoint keeps
+    # a duplicate key from breaking the enclosing one
+    if transaction.get_connection().in_atomic_block:
+        with transaction.atomic():
+            return IdempotencyKey.objects.create(**fields)
+    return IdempotencyKey.objects.create(**fields)
+
+
+def begin(user_id, key, request_fingerprint):
+    """
+    Claim the key. Returns (record, None) when this request should run the view, or
+    (None, response) with the response to send back instead.
+    """
+    now = timezone.now()
+    ttl = timedelta(seconds=getattr(settings, 'IDEMPOTENCY_KEY_TTL', 24 * 60 * 60))
+    for _ in range(2):
+        try:
+            return _insert(user_id=user_id, key=key, fingerprint=request_fingerprint, expires_at=now + ttl), None
+        except IntegrityError:
+            existing = IdempotencyKey.objects.filter(user_id=user_id, key=key).first()
+        if existing is None:
+            continue  # the first attempt failed and let go of the key, claim it again
+        if existing.expires_at <= now:
+            existing.delete()
+            continue
+        if existing.fingerprint != request_fingerprint:
+            return None, HttpResponse('This idempotency key was already used for a different request', status=422)
+        if existing.status_code is None:
+            return None, HttpResponse('A request with this idempotency key is still being processed', status=409)
+        return None, replay(existing)
+    return None, HttpResponse('A request with this idempotency key is still being processed', status=409)
+
+
+def replay(record):
+    response = HttpResponse(bytes(record.body), status=record.status_code, content_type=record.content_type or None)
+    if record.location:
+        response['Location'] = record.location
+    response['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def _keep(response):
+    if response.status_code >= 400 or response.streaming:
+        return False
+    # an HTML 200 to a POST is the form shown again with its errors, nothing was posted,
+    # so the key is released and the corrected form can be sent again
+    return not (response.status_code == 200 and response.get('Content-Type', '').startswith('text/html'))
+
+
+def finish(record, response):
+    if not _keep(response):
+        release(record)
+        return
+    if hasattr(response, 'render') and not response.is_rendered:
+        response.render()
+    IdempotencyKey.objects.filter(pk=record.pk).update(
+        status_code=response.status_code,
+        content_type=response.get('Content-Type', ''),
+        location=response.get('Location', ''),
+        body=response.content,
+    )
+
+
+def release(record):
+    IdempotencyKey.objects.filter(pk=record.pk).delete()
+
+
+def idempotent(view):
+    """Decorator for views (sync or async) that move money, use it inside login_required."""
+    if iscoroutinefunction(view):
+        @wraps(view)
+        async def async_wrapper(request, *args, **kwargs):
+            key = request_key(request) if request.method == 'POST' else None
+            user = await request.auser() if key else None
+            if not key or not user.is_authenticated:
+                return await view(request, *args, **kwargs)
+            if len(key) > MAX_LENGTH:
+                return HttpResponseBadRequest(f'Idempotency keys are at most {MAX_LENGTH} characters')
+            record, response = await sync_to_async(begin)(user.pk, key, fingerprint(request))
+            if response is not None:
+                return response
+            try:
+                response = await view(request, *args, **kwargs)
+            except BaseException:
+                await sync_to_async(release)(record)
+                raise
+            await sync_to_async(finish)(record, response)
+            return response
+        return async_wrapper
+
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        key = request_key(request) if request.method == 'POST' else None
+        if not key or not request.user.is_authenticated:
+            return view(request, *args, **kwargs)
+        if len(key) > MAX_LENGTH:
+            return HttpResponseBadRequest(f'Idempotency keys are at most {MAX_LENGTH} characters')
+        record, response = begin(request.user.pk, key, fingerprint(request))
+        if response is not None:
+            return response
+        try:
+            response = view(request, *args, **kwargs)
+        except BaseException:
+            release(record)
+            raise
+        finish(record, response)
+        return response
+    return wrapper
@@ -0,0 +1,127 @@
+import uuid
+from datetime import timedelta
+
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import QueuedEmail
+
+MAX_ATTEMPTS = 5
+RETRY_DELAY = timedelta(seconds=30)  # doubled on every failed attempt
+CLAIM_LEASE = timedelta(minutes=5)  # a crashed worker's batch is picked up again after this
+
+
+def queue_email(subject, html_body, to):
+    # only writes a row, so it commits (or rolls back) together with the caller's transaction
+    return QueuedEmail.objects.create(subject=subject, html_body=html_body, to=to)
+
+
+def queue_emails(messages):
+    """Queue many (subject, html_body, to) messages with one insert per 1000 rows."""
+    return QueuedEmail.objects.bulk_create(
+        [QueuedEmail(subject=subject, html_body=html_body, to=to) for subject, html_body, to in messages],
+        batch_size=1000,
+    )
+
+
+def _due():
+    now = timezone.now()
+    return Q(status=QueuedEmail.PENDING, next_attempt_at__lte=now) | Q(
+        status=QueuedEmail.SENDING, next_attempt_at__lte=now
+    )
+
+
+def _claim(ids, token):
+    # re-checking the due condition keeps two workers from claiming the same rows
+    QueuedEmail.objects.filter(_due(), id__in=ids).update(
+        status=QueuedEmail.SENDING,
+        claimed_by=token,
+        next_attempt_at=timezone.now() + CLAIM_LEASE,
+    )
+
+
+def claim_batch(batch_size):
+    """Mark up to batch_size due messages as ours, returns None once nothing is due."""
+    token = uuid.uuid4().hex
+    due = QueuedEmail.objects.filter(_due()).order_by('next_attempt_at', 'id')
+    if transaction.get_connection().features.has_select_for_update_skip_locked:
+        # workers skip each other's locked rows instead of queueing behind them
+        with transaction.atomic():
+            ids = list(due.select_for_update(skip_locked=True).values_list('id', flat=True)[:batch_size])
+            if ids:
+                _claim(ids, token)
+    else:
+        # SQLite has no row locks, the conditional update alone decides who wins
+        ids = list(due.values_list('id', flat=True)[:batch_size])
+        if ids:
+            _claim(ids, token)
+    if not ids:
+        return None
+    return list(QueuedEmail.objects.filter(claimed_by=token, status=QueuedEmail.SENDING))
+
+
+def deliver(batch, connection=None, max_attempts=MAX_ATTEMPTS):
+    """
+    Send a claimed batch over one connection and record the outcome of each message.
+    A message whose lease ran out is left alone, another worker may have claimed it by
+    now, and outcomes are only recorded on rows still claimed by this batch.
+    """
+    connection = connection or get_connection()
+    sent, failed = [], []
+    try:
+        connection.open()
+        for queued in batch:
+            if queued.next_attempt_at <= timezone.now():
+                continue  # the lease is over, the row is someone else's to send
+            email = EmailMultiAlternatives(queued.subject, '', to=[queued.to], connection=connection)
+            email.attach_alternative(queued.html_body, "text/html")
+            try:
+                connection.send_messages([email])
+            except Exception as e:
+                queued.last_error = str(e)
+                failed.append(queued)
+            else:
+                sent.append(queued)
+    except Exception as e:
+        # could not even connect, every message not yet sent is retried
+        done = {queued.id for queued in sent + failed}
+        for queued in batch:
+            if queued.id not in done:
+                queued.last_error = str(e)
+                failed.append(queued)
+    finally:
+        connection.close()
+
+    now = timezone.now()
+    sent_count = 0
+    for token in {queued.claimed_by for queued in sent}:
+        sent_count += QueuedEmail.objects.filter(
+            id__in=[queued.id for queued in sent if queued.claimed_by == token], claimed_by=token,
+        ).update(status=QueuedEmail.SENT, sent_at=now, claimed_by='', last_error='')
+    failed_count = 0
+    for queued in failed:
+        attempts = queued.attempts + 1
+        retry = {'status': QueuedEmail.FAILED} if attempts >= max_attempts else {
+            'status': QueuedEmail.PENDING, 'next_attempt_at': now + RETRY_DELAY * (2 ** (attempts - 1)),
+        }
+        # a row whose claim was lost belongs to the worker that claimed it since
+        failed_count += QueuedEmail.objects.filter(id=queued.id, claimed_by=queued.claimed_by).update(
+            attempts=attempts, claimed_by='', last_error=queued.last_error, **retry,
+        )
+    return sent_count, failed_count
+
+
+def drain(batch_size=100, max_attempts=MAX_ATTEMPTS):
+    """Keep sending batches until nothing is due, returns (sent, failed) totals."""
+    total_sent = total_failed = 0
+    while True:
+        batch = claim_batch(batch_size)
+        if batch is None:
+            return total_sent, total_failed
+        if not batch:
+            continue  # another worker claimed these first
+        sent, failed = deliver(batch, max_attempts=max_attempts)
+        total_sent += sent
+        total_failed += failed
@@ -0,0 +1,196 @@
+import json
+import random
+import re
+import threading
+import time
+import urllib.parse
+import urllib.request
+from collections import defaultdict
+from contextlib import nullcontext
+from http.cookiejar import CookieJar
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.test import Client
+from django.test.utils import override_settings, setup_test_environment
+from django.urls import reverse
+
+from core.benchmark import bench_accounts, summarize
+from transactions.constants import DEPOSIT, LOAN, WITHDRAWAL
+
+QUERIES = re.compile(r'desc="(\d+) queries"')
+
+
+# url names of transactions/async_views.py, loan_request has no async version
+ASYNC_URLS = {
+    'deposit_money': 'async_deposit_money',
+    'withdraw_money': 'async_withdraw_money',
+    'transfer_money': 'async_transfer_money',
+    'transaction_report': 'async_transaction_report',
+}
+
+
+def flow_requests(rng, account, others):
+    """(flow name, method, url name, data) for one round of the workload."""
+    return [
+        ('deposit', 'post', 'deposit_money', {'amount': rng.randint(100, 1000), 'transaction_type': DEPOSIT}),
+        ('withdraw', 'post', 'withdraw_money', {'amount': 500, 'transaction_type': WITHDRAWAL}),
+        ('transfer_money', 'post', 'transfer_money', {'receiver_account': rng.choice(others).account_no, 'amount': 10}),
+        ('loan_request', 'post', 'loan_request', {'amount': 100, 'transaction_type': LOAN}),
+        ('transaction_report', 'get', 'transaction_report', {}),
+    ]
+
+
+class ClientSession:
+    # in-process, through Django's test client
+    def __init__(self, account, password):
+        self.client = Client()
+        self.client.force_login(account.user)
+
+    def request(self, method, path, data):
+        response = getattr(self.client, method)(path, data)
+        return response.status_code, response.headers.get('Server-Timing', '')
+
+
+class HttpSession:
+    # over the network against a running server (runserver, gunicorn, uvicorn)
+    def __init__(self, account, password, base_url):
+        self.base_url = base_url.rstrip('/')
+        self.cookies = CookieJar()
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(self.cookies), NoRedirect()
+        )
+        self.request('get', reverse('login'), {})
+        status, _ = self.request('post', reverse('login'), {'username': account.user.username, 'password': password})
+        if status != 302:
+            raise CommandError(f'Could not log in as {account.user.username} (status {status})')
+
+    def _csrf(self):
+        return next((cookie.value for cookie in self.cookies if cookie.name == 'csrftoken'), '')
+
+    def request(self, method, path, data):
+        url = self.base_url + path
+        body = None
+        headers = {}
+        if method == 'post':
+            body = urllib.parse.urlencode({**data, 'csrfmiddlewaretoken': self._csrf()}).encode()
+            headers = {'X-CSRFToken': self._csrf(), 'Referer': url}
+        elif data:
+            url += '?' + urllib.parse.urlencode(data)
+        try:
+            with self.opener.open(urllib.request.Request(url, data=body, headers=headers)) as response:
+                response.read()
+                return response.status, response.headers.get('Server-Timing', '')
+        except urllib.error.HTTPError as e:
+            return e.code, e.headers.get('Server-Timing', '')
+
+
+class NoRedirect(urllib.request.HTTPRedirectHandler):
+    # a 302 is the success answer of every money form, don't follow it
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+    def http_error_302(self, req, fp, code, msg, headers):
+        return fp
+
+
+class Command(BaseCommand):
+    help = (
+        'Drive deposit, withdraw, transfer_money, loan_request and transaction_report with many '
+        'threads and print throughput, latency percentiles and queries per request as JSON. '
+        'Create the users first with seed_bank. Start the server of --driver http with the rate '
+        'limits off (WITHDRAW_RATE_ACCOUNT= TRANSFER_RATE_ACCOUNT= and the _IP ones), its 429s are '
+        'counted in statuses but left out of the timings.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--driver', choices=['client', 'http'], default='client')
+        parser.add_argument('--url', default='http://127.0.0.1:8000', help='server for --driver http')
+        parser.add_argument(
+            '--stack', choices=['sync', 'async'], default='sync',
+            help='async uses the transactions/async/ views, compare gunicorn (wsgi) with uvicorn (asgi) at the same --concurrency',
+        )
+        parser.add_argument('--concurrency', type=int, default=4)
+        parser.add_argument('--rounds', type=int, default=50, help='workload rounds per thread')
+        parser.add_argument('--prefix', default='bench_user')
+        parser.add_argument('--password', default='bench-password-1')
+        parser.add_argument('--output', help='also write the JSON report to this file')
+
+    def handle(self, *args, **options):
+        accounts = bench_accounts(options['prefix'])[:max(options['concurrency'], 2)]
+        if len(accounts) < 2:
+            raise CommandError('Need at least two benchmark users, run seed_bank first')
+        if options['driver'] == 'client':
+            setup_test_environment()  # lets the test client through ALLOWED_HOSTS
+
+        latencies = defaultdict(list)
+        queries = defaultdict(list)
+        statuses = defaultdict(lambda: defaultdict(int))
+        lock = threading.Lock()
+        errors = []
+
+        def worker(index):
+            rng = random.Random(index)
+            account = accounts[index % len(accounts)]
+            others = [other for other in accounts if other.pk != account.pk]
+            try:
+                if options['driver'] == 'client':
+                    session = ClientSession(account, options['password'])
+                else:
+                    session = HttpSession(account, options['password'], options['url'])
+                for _ in range(options['rounds']):
+                    for flow, method, url_name, data in flow_requests(rng, account, others):
+                        if options['stack'] == 'async':
+                            url_name = ASYNC_URLS.get(url_name, url_name)
+                        start = time.perf_counter()
+                        status, timing = session.request(method, reverse(url_name), data)
+                        elapsed = (time.perf_counter() - start) * 1000
+                        match = QUERIES.search(timing)
+                        with lock:
+                            statuses[flow][status] += 1
+                            if status == 429:
+                                continue  # turned away by a server's rate limit, nothing was measured
+                            latencies[flow].append(elapsed)
+                            if match:
+                                queries[flow].append(int(match.group(1)))
+            except Exception as e:
+                errors.append(repr(e))
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=worker, args=(i,)) for i in range(options['concurrency'])]
+        # a few users posting as fast as they can are over the rate limits and the daily caps
+        # within seconds. In process they're lifted, a server is started without its rate limits
+        limits = override_settings(RATE_LIMITS={}, DAILY_LIMITS={}) if options['driver'] == 'client' else nullcontext()
+        with limits:
+            start = time.perf_counter()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            wall = time.perf_counter() - start
+
+        total = sum(len(values) for values in latencies.values())
+        report = {
+            'driver': options['driver'],
+            'stack': options['stack'],
+            'concurrency': options['concurrency'],
+            'rounds': options['rounds'],
+            'seconds': round(wall, 2),
+            'throughput_rps': round(total / wall, 1) if wall else 0,
+            'flows': {
+                flow: {
+                    **summarize(values),
+                    'throughput_rps': round(len(values) / wall, 1) if wall else 0,
+                    'statuses': dict(statuses[flow]),
+                    'queries_per_request': round(sum(queries[flow]) / len(queries[flow]), 2) if queries[flow] else None,
+                }
+                for flow, values in latencies.items()
+            },
+            'errors': errors,
+        }
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output)
+        self.stdout.write(output)
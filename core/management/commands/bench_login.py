@@ -0,0 +1,111 @@
+import json
+import re
+import threading
+import time
+from decimal import Decimal
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.test import Client
+from django.test.utils import override_settings, setup_test_environment
+from django.urls import reverse
+
+from core.benchmark import bench_accounts, fund, seed_users, summarize
+from transactions.constants import DEPOSIT
+
+HASH_TIME = re.compile(r'hash;dur=([\d.]+)')
+
+
+class Command(BaseCommand):
+    help = (
+        'Log in through UserLoginView from many threads once per PASSWORD_HASH_WORKERS value, '
+        'while one more thread keeps depositing, and print login throughput, login and deposit '
+        'latency and hashing time per login as JSON'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, nargs='+', default=[0, 1, 2, 4])
+        parser.add_argument('--concurrency', type=int, default=8)
+        parser.add_argument('--logins', type=int, default=5, help='logins per thread')
+        parser.add_argument('--prefix', default='bench_login')
+        parser.add_argument('--password', default='bench-password-1')
+
+    def handle(self, *args, **options):
+        setup_test_environment()  # lets the test client through ALLOWED_HOSTS
+        accounts = bench_accounts(options['prefix'])
+        if len(accounts) < options['concurrency'] + 1:
+            created = seed_users(options['concurrency'] + 1 - len(accounts), options['password'], prefix=options['prefix'])
+            fund(created, Decimal(1_000_000))
+            accounts = bench_accounts(options['prefix'])
+        # hashed with the current profile up front, so no login in the run re-hashes
+        User.objects.filter(pk__in=[account.user_id for account in accounts]).update(password=make_password(options['password']))
+
+        report = {}
+        for workers in options['workers']:
+            with override_settings(PASSWORD_HASH_WORKERS=workers):
+                report[workers] = self.storm(accounts, options)
+        self.stdout.write(json.dumps({
+            'profile': settings.PASSWORD_HASH_PROFILE,
+            'concurrency': options['concurrency'],
+            'workers': report,
+        }, indent=2))
+
+    def storm(self, accounts, options):
+        logins, hashing, deposits, errors = [], [], [], []
+        lock = threading.Lock()
+        done = threading.Event()
+
+        def login(account):
+            try:
+                for _ in range(options['logins']):
+                    client = Client()
+                    start = time.perf_counter()
+                    response = client.post(reverse('login'), {'username': account.user.username, 'password': options['password']})
+                    elapsed = (time.perf_counter() - start) * 1000
+                    if response.status_code != 302:
+                        raise CommandError(f'login answered {response.status_code}')
+                    match = HASH_TIME.search(response.headers.get('Server-Timing', ''))
+                    with lock:
+                        logins.append(elapsed)
+                        if match:
+                            hashing.append(float(match.group(1)))
+            except Exception as e:
+                errors.append(repr(e))
+            finally:
+                connections.close_all()
+
+        def deposit(account):
+            # the money view that should keep its latency while the logins hash
+            client = Client()
+            client.force_login(account.user)
+            try:
+                while not done.is_set():
+                    start = time.perf_counter()
+                    client.post(reverse('deposit_money'), {'amount': 100, 'transaction_type': DEPOSIT})
+                    deposits.append((time.perf_counter() - start) * 1000)
+            except Exception as e:
+                errors.append(repr(e))
+            finally:
+                connections.close_all()
+
+        depositor = threading.Thread(target=deposit, args=(accounts[-1],))
+        threads = [threading.Thread(target=login, args=(account,)) for account in accounts[:options['concurrency']]]
+        depositor.start()
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        wall = time.perf_counter() - start
+        done.set()
+        depositor.join()
+        return {
+            'logins_per_second': round(len(logins) / wall, 2) if wall else 0,
+            'login': summarize(logins),
+            'hash_ms_per_login': round(sum(hashing) / len(hashing), 1) if hashing else None,
+            'deposit': summarize(deposits),
+            'errors': errors,
+        }
@@ -0,0 +1,91 @@
+import json
+import re
+from collections import defaultdict
+from datetime import timedelta
+
+from django.core.cache import caches
+from django.core.management.base import BaseCommand
+from django.template import engines
+from django.template.loaders import cached
+from django.test import Client
+from django.test.utils import override_settings, setup_test_environment
+from django.urls import reverse
+from django.utils import timezone
+
+from core.benchmark import bench_account, seed_transactions, summarize
+
+TIMINGS = re.compile(r'(db|tpl|total);dur=([\d.]+)(?:;desc="(\d+) queries")?')
+
+
+def pages(today):
+    """(name, logged in, url name, query) for every page measured."""
+    year_ago = today - timedelta(days=365)
+    return [
+        ('home_guest', False, 'home', {}),
+        ('home', True, 'home', {}),
+        ('transaction_report', True, 'transaction_report', {}),
+        ('transaction_report_range', True, 'transaction_report', {
+            'start_date': year_ago.isoformat(), 'end_date': today.isoformat(),
+        }),
+    ]
+
+
+def forget_templates():
+    # what a fresh process starts with: nothing compiled, no fragments
+    for loader in engines['django'].engine.template_loaders:
+        loader.reset()
+    caches['template_fragments'].clear()
+
+
+class Command(BaseCommand):
+    help = (
+        'Render the home and transaction report pages with the compiled templates and fragments '
+        'cached (warm) and with them thrown away before every request (cold), and print the '
+        'template, database and total time per page as JSON'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=50, help='requests per page and mode')
+        parser.add_argument('--transactions', type=int, default=500, help='history of the benchmark account')
+        parser.add_argument('--username', default='bench_render')
+
+    def handle(self, *args, **options):
+        setup_test_environment()  # lets the test client through ALLOWED_HOSTS
+        account = bench_account(options['username'])
+        if not account.transactions.exists():
+            seed_transactions(account, options['transactions'], days=730)
+
+        guest = Client()
+        user = Client()
+        user.force_login(account.user)
+        loaders = engines['django'].engine.template_loaders
+        report = {'template_cache': any(isinstance(loader, cached.Loader) for loader in loaders)}
+        # the report pages are the same request over and over, the rate limits are not measured here
+        with override_settings(RATE_LIMITS={}):
+            for mode in ('cold', 'warm'):
+                report[mode] = {
+                    name: self.measure(user if logged_in else guest, url_name, query, mode, options['requests'])
+                    for name, logged_in, url_name, query in pages(timezone.localdate())
+                }
+        self.stdout.write(json.dumps(report, indent=2))
+
+    def measure(self, client, url_name, query, mode, count):
+        timings = defaultdict(list)
+        queries = []
+        forget_templates()
+        client.get(reverse(url_name), query)  # the warm runs start from a filled cache
+        for _ in range(count):
+            if mode == 'cold':
+                forget_templates()
+            response = client.get(reverse(url_name), query)
+            for name, duration, query_count in TIMINGS.findall(response.headers.get('Server-Timing', '')):
+                timings[name].append(float(duration))
+                if query_count:
+                    queries.append(int(query_count))
+        return {
+            'status': response.status_code,
+            'template': summarize(timings['tpl']),
+            'db': summarize(timings['db']),
+            'total': summarize(timings['total']),
+            'queries_per_request': round(sum(queries) / len(queries), 2) if queries else None,
+        }
@@ -0,0 +1,89 @@
+import json
+from collections import defaultdict
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings, setup_test_environment
+from django.urls import reverse
+
+from core.benchmark import bench_accounts, fund, seed_users
+from transactions.constants import DEPOSIT, WITHDRAWAL
+
+WRITES = ('INSERT', 'UPDATE', 'DELETE')
+
+
+def steps():
+    """(name, method, url name, data) for one round, the GETs show the flash message of the POST before."""
+    return [
+        ('deposit', 'post', 'deposit_money', {'amount': 1000, 'transaction_type': DEPOSIT}),
+        ('report', 'get', 'transaction_report', {}),
+        ('withdraw', 'post', 'withdraw_money', {'amount': 500, 'transaction_type': WITHDRAWAL}),
+        ('report', 'get', 'transaction_report', {}),
+    ]
+
+
+class Command(BaseCommand):
+    help = (
+        'Log in through UserLoginView and run deposit / withdraw rounds under every SESSION_MODE, '
+        'and print the queries, DB writes and session table queries per request as JSON'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--modes', nargs='+', choices=list(settings.SESSION_ENGINES), default=list(settings.SESSION_ENGINES))
+        parser.add_argument('--message-mode', choices=list(settings.MESSAGE_STORAGES), default='cookie')
+        parser.add_argument('--rounds', type=int, default=5)
+        parser.add_argument('--prefix', default='bench_session')
+        parser.add_argument('--password', default='bench-password-1')
+
+    def handle(self, *args, **options):
+        setup_test_environment()  # lets the test client through ALLOWED_HOSTS
+        accounts = bench_accounts(options['prefix'])
+        if not accounts:
+            accounts = seed_users(1, options['password'], prefix=options['prefix'])
+            fund(accounts, Decimal(100_000))
+        account = accounts[0]
+
+        report = {}
+        # the rate limits would turn the later rounds into 429s, they are not what is measured here
+        with override_settings(RATE_LIMITS={}, MESSAGE_STORAGE=settings.MESSAGE_STORAGES[options['message_mode']]):
+            for mode in options['modes']:
+                with override_settings(SESSION_MODE=mode, SESSION_ENGINE=settings.SESSION_ENGINES[mode]):
+                    report[mode] = self.run_mode(account, options)
+        self.stdout.write(json.dumps({'message_mode': options['message_mode'], 'modes': report}, indent=2))
+
+    def request(self, client, method, url_name, data, totals, name):
+        with CaptureQueriesContext(connection) as queries:
+            response = getattr(client, method)(reverse(url_name), data)
+        sql = [query['sql'] for query in queries.captured_queries]
+        totals[name]['requests'] += 1
+        totals[name]['queries'] += len(sql)
+        totals[name]['writes'] += sum(statement.lstrip().upper().startswith(WRITES) for statement in sql)
+        totals[name]['session_queries'] += sum('django_session' in statement for statement in sql)
+        return response
+
+    def run_mode(self, account, options):
+        totals = defaultdict(lambda: defaultdict(int))
+        client = Client()  # a new client loads the middleware again with this mode's engine
+        self.request(client, 'get', 'login', {}, totals, 'login_page')
+        response = self.request(
+            client, 'post', 'login', {'username': account.user.username, 'password': options['password']}, totals, 'login',
+        )
+        if response.status_code != 302:
+            raise CommandError(f'Could not log in as {account.user.username} (status {response.status_code})')
+        for _ in range(options['rounds']):
+            for name, method, url_name, data in steps():
+                response = self.request(client, method, url_name, data, totals, name)
+                # the money forms redirect when the posting went through
+                if response.status_code != (302 if method == 'post' else 200):
+                    raise CommandError(f'{name} answered {response.status_code}')
+        return {
+            name: {
+                'queries_per_request': round(counts['queries'] / counts['requests'], 2),
+                'writes_per_request': round(counts['writes'] / counts['requests'], 2),
+                'session_queries_per_request': round(counts['session_queries'] / counts['requests'], 2),
+            }
+            for name, counts in totals.items()
+        }
@@ -0,0 +1,13 @@
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+
+from core import sharding
+
+
+class Command(BaseCommand):
+    help = 'Run migrate on every ledger shard (LEDGER_SHARDS), \'default\' first'
+
+    def handle(self, *args, **options):
+        for alias in sharding.shards():
+            self.stdout.write(self.style.MIGRATE_HEADING(f'Migrating {alias}'))
+            call_command('migrate', database=alias, interactive=False, verbosity=options['verbosity'])
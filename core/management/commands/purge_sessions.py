@@ -0,0 +1,28 @@
+from django.conf import settings
+from django.contrib.sessions.models import Session
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+
+class Command(BaseCommand):
+    help = 'Delete expired sessions in small batches (run it from cron instead of clearsessions)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        if settings.SESSION_MODE not in ('db', 'cached_db'):
+            # the cache expires its own keys, signed cookies expire in the browser
+            self.stdout.write(f'SESSION_MODE is {settings.SESSION_MODE}, there is no session table to purge')
+            return
+        now = timezone.now()
+        deleted = 0
+        while True:
+            # short deletes through the expire_date index, never one long lock on the table
+            keys = list(
+                Session.objects.filter(expire_date__lt=now).values_list('pk', flat=True)[:options['batch_size']]
+            )
+            if not keys:
+                break
+            deleted += Session.objects.filter(pk__in=keys).delete()[0]
+        self.stdout.write(self.style.SUCCESS(f'Deleted {deleted} expired sessions'))
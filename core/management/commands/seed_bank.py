@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from core.benchmark import seed_transactions, seed_users
+
+
+class Command(BaseCommand):
+    help = 'Create benchmark users (bench_user_N) with bulk inserts and give them transaction history'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--transactions', type=int, default=100_000, help='total, spread evenly over the new users')
+        parser.add_argument('--password', default='bench-password-1')
+        parser.add_argument('--prefix', default='bench_user')
+
+    def handle(self, *args, **options):
+        accounts = seed_users(options['users'], options['password'], options['prefix'])
+        per_account = options['transactions'] // max(len(accounts), 1)
+        for account in accounts:
+            seed_transactions(account, per_account, days=365)
+        self.stdout.write(self.style.SUCCESS(
+            f'Created {len(accounts)} users with {per_account} transactions each '
+            f"(password {options['password']!r}). Run backfill_daily_balances for correct period statements."
+        ))
@@ -0,0 +1,48 @@
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from core.mail import MAX_ATTEMPTS, drain
+
+
+class Command(BaseCommand):
+    help = 'Send the queued transaction emails using a pool of worker threads'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4)
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument('--max-attempts', type=int, default=MAX_ATTEMPTS)
+        parser.add_argument('--loop', action='store_true', help='keep polling instead of exiting once the queue is empty')
+        parser.add_argument('--interval', type=float, default=5, help='seconds to sleep between polls with --loop')
+
+    def handle(self, *args, **options):
+        totals = {'sent': 0, 'failed': 0}
+        lock = threading.Lock()
+
+        def worker():
+            try:
+                while True:
+                    sent, failed = drain(options['batch_size'], options['max_attempts'])
+                    with lock:
+                        totals['sent'] += sent
+                        totals['failed'] += failed
+                    if not options['loop']:
+                        return
+                    time.sleep(options['interval'])
+            finally:
+                connection.close()  # every thread gets its own db connection
+
+        threads = [threading.Thread(target=worker, daemon=True) for _ in range(options['workers'])]
+        for thread in threads:
+            thread.start()
+        try:
+            for thread in threads:
+                thread.join()
+        except KeyboardInterrupt:
+            pass
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Sent {totals['sent']} emails, {totals['failed']} failed attempts"
+        ))
@@ -0,0 +1,29 @@
+import sqlite3
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = (
+        'Copy the SQLite primary over the SQLite replica (LOCAL_SQLITE=1). This is the local '
+        'stand-in for replication: the replica shows what the primary had at the last copy'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--replica', default='replica')
+
+    def handle(self, *args, **options):
+        primary = settings.DATABASES['default']
+        replica = settings.DATABASES.get(options['replica'])
+        if replica is None or 'sqlite3' not in primary['ENGINE'] or 'sqlite3' not in replica['ENGINE']:
+            raise CommandError('Only for the two SQLite files of LOCAL_SQLITE=1')
+        # the backup API copies a consistent snapshot even while the primary is being written to
+        source = sqlite3.connect(primary['NAME'])
+        target = sqlite3.connect(replica['NAME'])
+        try:
+            source.backup(target)
+        finally:
+            target.close()
+            source.close()
+        self.stdout.write(self.style.SUCCESS(f"Copied {primary['NAME']} to {replica['NAME']}"))
@@ -0,0 +1,136 @@
+import json
+import logging
+import re
+import time
+from collections import Counter
+from contextlib import ExitStack
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import connections
+
+from accounts import hashers
+
+logger = logging.getLogger('swiss_bank.perf')
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+def fingerprint(sql):
+    # same statement with different literals -> same fingerprint, that's how N+1 loops show up
+    sql = re.sub(r"'(?:[^']|'')*'", '?', sql)
+    sql = re.sub(r'\b\d+(?:\.\d+)?\b', '?', sql)
+    sql = re.sub(r'\(\s*\?(?:\s*,\s*\?)*\s*\)', '(...)', sql)
+    return re.sub(r'\s+', ' ', sql).strip()
+
+
+class QueryRecorder:
+    """A connection.execute_wrapper that counts and times every query."""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.fingerprints = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - start
+            self.count += 1
+            self.fingerprints[fingerprint(sql)] += 1
+
+    def duplicates(self):
+        return {sql: count for sql, count in self.fingerprints.items() if count > 1}
+
+
+class QueryBudgetMiddleware:
+    """
+    Records query count, DB time, duplicate queries, template render time and password
+    hashing time for every request. They are sent back as a Server-Timing header and
+    logged as one JSON line on the swiss_bank.perf logger. QUERY_BUDGETS maps url names to the most queries a
+    request may run; going over logs a warning, or raises when QUERY_BUDGET_RAISE is on
+    (for test runs). Keep it first in MIDDLEWARE so session and auth queries count too.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        recorder = QueryRecorder()
+        request.perf = {'queries': recorder, 'template': 0.0, 'hash': 0.0}
+        start = time.perf_counter()
+        token = hashers.track(request.perf)
+        try:
+            with self.recording(recorder):
+                response = self.get_response(request)
+        finally:
+            hashers.untrack(token)
+        return self.report(request, response, recorder, time.perf_counter() - start)
+
+    async def __acall__(self, request):
+        # under ASGI the async views would otherwise each be pushed onto a thread
+        recorder = QueryRecorder()
+        request.perf = {'queries': recorder, 'template': 0.0, 'hash': 0.0}
+        start = time.perf_counter()
+        token = hashers.track(request.perf)
+        # connections are per thread: hook the one the request's sync_to_async calls run in
+        stack = await sync_to_async(self.recording)(recorder)
+        try:
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(stack.close)()
+            hashers.untrack(token)
+        return self.report(request, response, recorder, time.perf_counter() - start)
+
+    def recording(self, recorder):
+        stack = ExitStack()
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(recorder))
+        return stack
+
+    def report(self, request, response, recorder, total):
+        url_name = request.resolver_match.url_name if request.resolver_match else None
+        duplicates = recorder.duplicates()
+        response['Server-Timing'] = ', '.join([
+            f'db;dur={recorder.duration * 1000:.1f};desc="{recorder.count} queries"',
+            f'tpl;dur={request.perf["template"] * 1000:.1f}',
+            f'hash;dur={request.perf["hash"] * 1000:.1f}',
+            f'total;dur={total * 1000:.1f}',
+        ])
+        logger.info(json.dumps({
+            'url_name': url_name,
+            'method': request.method,
+            'status': response.status_code,
+            'queries': recorder.count,
+            'db_ms': round(recorder.duration * 1000, 2),
+            'template_ms': round(request.perf['template'] * 1000, 2),
+            'hash_ms': round(request.perf['hash'] * 1000, 2),
+            'total_ms': round(total * 1000, 2),
+            'duplicate_queries': duplicates,
+        }))
+
+        budget = getattr(settings, 'QUERY_BUDGETS', {}).get(url_name)
+        if budget is not None and recorder.count > budget:
+            message = f'{url_name} ran {recorder.count} queries, its budget is {budget}. Repeated: {duplicates}'
+            if getattr(settings, 'QUERY_BUDGET_RAISE', False):
+                raise QueryBudgetExceeded(message)
+            logger.warning(message)
+        return response
+
+    def process_template_response(self, request, response):
+        # rendering here (it's the last template hook to run) keeps it out of the view time
+        start = time.perf_counter()
+        response.render()
+        request.perf['template'] += time.perf_counter() - start
+        return response
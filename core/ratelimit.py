@@ -0,0 +1,175 @@
+"""
+Request rate limits and amount caps kept in the cache, never in the database.
+
+Both are sliding windows built from cache counters. add() creates a counter and
+incr() bumps it; both are atomic on redis and memcached, and on locmem within one
+process. A hit is counted first and the window checked afterwards, so two
+concurrent requests can't both slip under a limit. The one that takes it over is
+undone and rejected.
+
+The limits were asked for as token buckets. A bucket is a token count and a refill
+time that have to be read and written back together, and the cache API has no
+compare-and-set to do that atomically across workers (only a lock or a script for
+one backend would). A sliding window needs nothing but add() and incr(), and
+'10/m' allows the same as a bucket of 10 tokens refilled at 10 a minute, without
+the burst of a full bucket on top of a just-spent window.
+
+locmem counters are per process. With more than one worker, point CACHE_URL at
+redis so every worker shares the same counters.
+"""
+import math
+import time
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+
+PREFIX = 'rl'
+PERIODS = {'s': 1, 'm': 60, 'h': 60 * 60, 'd': 24 * 60 * 60}
+
+
+def parse_rate(rate):
+    """'10/m' -> (10, 60). An empty rate means no limit and gives None."""
+    if not rate:
+        return None
+    count, _, period = rate.partition('/')
+    return int(count), PERIODS[period or 's']
+
+
+def _incr(key, delta, timeout):
+    cache.add(key, 0, timeout)
+    try:
+        return cache.incr(key, delta)
+    except ValueError:
+        # expired between add() and incr()
+        cache.add(key, 0, timeout)
+        return cache.incr(key, delta)
+
+
+def _decr(key, delta):
+    try:
+        cache.decr(key, delta)
+    except ValueError:
+        pass  # already expired, nothing left to give back
+
+
+def hit(scope, ident, rate, now=None):
+    """
+    Count one request against rate ('10/m') for ident in scope. Returns
+    (allowed, retry_after_seconds).
+    """
+    key, retry_after = take(scope, ident, rate, now)
+    return key is not None, retry_after
+
+
+def take(scope, ident, rate, now=None):
+    """
+    hit() that returns (key, 0) when allowed, _decr(key, 1) gives the request back.
+    (None, retry_after_seconds) when it isn't.
+
+    The current window's count is added to the previous window's count, weighted by
+    how much of the previous window is still inside the sliding window.
+    """
+    limit, period = parse_rate(rate)
+    now = time.time() if now is None else now
+    window, offset = divmod(now, period)
+    key = f'{PREFIX}:{scope}:{ident}:{int(window)}'
+    count = _incr(key, 1, period * 2)
+    previous = cache.get(f'{PREFIX}:{scope}:{ident}:{int(window) - 1}', 0)
+    if previous * (1 - offset / period) + count <= limit:
+        return key, 0
+    _decr(key, 1)
+    return None, max(1, math.ceil(period - offset))
+
+
+class Quota:
+    """
+    A running total (e.g. amount withdrawn) capped over a sliding period, kept in
+    `buckets` counters so no single key has to hold every hit. consume() and
+    refund() take integers, callers pass cents.
+    """
+
+    def __init__(self, name, cap, period=24 * 60 * 60, buckets=24):
+        self.name = name
+        self.cap = cap
+        self.period = period
+        self.size = period // buckets
+        self.buckets = buckets
+
+    def _key(self, ident, slot):
+        return f'{PREFIX}:{self.name}:{ident}:{slot}'
+
+    def used(self, ident, now=None):
+        slot = int((time.time() if now is None else now) // self.size)
+        # one extra bucket, so a hit leaves the window between period and period + size later, never early
+        keys = [self._key(ident, s) for s in range(slot - self.buckets, slot + 1)]
+        return sum(cache.get_many(keys).values())
+
+    def consume(self, ident, amount, now=None):
+        """Returns (key, total) when it fits under the cap, (None, total before) when it doesn't."""
+        slot = int((time.time() if now is None else now) // self.size)
+        key = self._key(ident, slot)
+        _incr(key, amount, self.period + 2 * self.size)
+        total = self.used(ident, now)
+        if total <= self.cap:
+            return key, total
+        _decr(key, amount)
+        return None, total - amount
+
+    def refund(self, key, amount):
+        _decr(key, amount)
+
+
+def client_ip(request):
+    return request.META.get('REMOTE_ADDR') or 'unknown'
+
+
+def _limited(scope, retry_after):
+    response = HttpResponse(f'Too many {scope} requests, try again in {retry_after} seconds', status=429)
+    response['Retry-After'] = str(retry_after)
+    return response
+
+
+def check(scope, user_id, ip):
+    """Apply RATE_LIMITS[scope] per account and per IP. Returns a 429 response or None."""
+    rates = getattr(settings, 'RATE_LIMITS', {}).get(scope, {})
+    counted = []
+    for kind, ident in (('account', user_id), ('ip', ip)):
+        rate = rates.get(kind)
+        if not rate or ident is None:
+            continue
+        key, retry_after = take(f'{scope}:{kind}', ident, rate)
+        if key is None:
+            # a rejected request doesn't count against the account either
+            for key in counted:
+                _decr(key, 1)
+            return _limited(scope, retry_after)
+        counted.append(key)
+    return None
+
+
+def ratelimit(scope):
+    """Decorator for POST views (sync or async), use it inside login_required and outside idempotent."""
+    def decorator(view):
+        if iscoroutinefunction(view):
+            @wraps(view)
+            async def async_wrapper(request, *args, **kwargs):
+                if request.method == 'POST':
+                    user = await request.auser()
+                    limited = await sync_to_async(check)(scope, user.pk, client_ip(request))
+                    if limited is not None:
+                        return limited
+                return await view(request, *args, **kwargs)
+            return async_wrapper
+
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method == 'POST':
+                limited = check(scope, request.user.pk, client_ip(request))
+                if limited is not None:
+                    return limited
+            return view(request, *args, **kwargs)
+        return wrapper
+    return decorator
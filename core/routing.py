@@ -0,0 +1,170 @@
+"""
+Read replica routing.
+
+Writes always go to the primary ('default'). Reads go there too, except inside a
+view wrapped in reads_from_replica (or a `with replica():` block, for commands):
+those send their reads to one of DATABASE_REPLICAS. A user who wrote something is
+pinned to the primary for REPLICA_PIN_SECONDS afterwards (ReplicaPinMiddleware
+notes the write), so the report they land on after a deposit shows the deposit even
+if the replica is behind. Reads inside transaction.atomic stay on the primary too.
+
+A streamed response is read after the view has returned, outside the replica block:
+bind its queryset with .using(read_db(Model)) while still inside the view.
+"""
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connections, router
+
+_replica = ContextVar('replica_alias', default=None)
+# {'wrote': bool} for the current request, set by ReplicaPinMiddleware
+_writes = ContextVar('replica_writes', default=None)
+
+
+def replicas():
+    return getattr(settings, 'DATABASE_REPLICAS', [])
+
+
+def read_db(model=None):
+    """The alias reads go to right now, given a model the routers decide (a ledger model's shard)."""
+    if model is not None:
+        return router.db_for_read(model)
+    alias = _replica.get()
+    writes = _writes.get()
+    if alias is None or (writes and writes['wrote']) or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+        return DEFAULT_DB_ALIAS
+    return alias
+
+
+@contextmanager
+def replica(alias=None):
+    """Send reads to a replica (a random one unless alias is given) inside the block."""
+    choices = replicas()
+    token = _replica.set(alias or (random.choice(choices) if choices else None))
+    try:
+        yield
+    finally:
+        _replica.reset(token)
+
+
+@contextmanager
+def primary():
+    """Reads go to the primary inside the block, also within a replica view."""
+    token = _replica.set(None)
+    try:
+        yield
+    finally:
+        _replica.reset(token)
+
+
+def _pin_key(user_id):
+    return f'replica-pin:{user_id}'
+
+
+def pin(user_id):
+    cache.set(_pin_key(user_id), 1, settings.REPLICA_PIN_SECONDS)
+
+
+def pinned(user_id):
+    return user_id is not None and cache.get(_pin_key(user_id)) is not None
+
+
+def reads_from_replica(view):
+    """
+    Decorator for read-only views (sync or async): GET and HEAD requests read from a
+    replica unless the user is pinned to the primary. For class based views use
+    method_decorator(reads_from_replica, name='dispatch').
+    """
+    if iscoroutinefunction(view):
+        @wraps(view)
+        async def async_wrapper(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD') or not replicas():
+                return await view(request, *args, **kwargs)
+            user = await request.auser()
+            if user.pk is not None and await cache.aget(_pin_key(user.pk)) is not None:
+                return await view(request, *args, **kwargs)
+            with replica():
+                return await view(request, *args, **kwargs)
+        return async_wrapper
+
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        # the user is loaded here, before the replica block, so the session and user
+        # always come from the primary
+        if request.method not in ('GET', 'HEAD') or not replicas() or pinned(request.user.pk):
+            return view(request, *args, **kwargs)
+        with replica():
+            return view(request, *args, **kwargs)
+    return wrapper
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        alias = read_db()
+        return alias if alias != DEFAULT_DB_ALIAS else None
+
+    def db_for_write(self, model, **hints):
+        writes = _writes.get()
+        if writes is not None:
+            writes['wrote'] = True
+        # never the instance's own database: an object read from a replica is saved to the primary
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # the replicas hold the same rows as the primary
+        databases = {DEFAULT_DB_ALIAS, *replicas()}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # replicas get their schema from the primary
+        if db in replicas():
+            return False
+        return None
+
+
+class ReplicaPinMiddleware:
+    """
+    Notes whether the request wrote anything and pins the user to the primary if it
+    did. Put it after AuthenticationMiddleware.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        writes = {'wrote': False}
+        token = _writes.set(writes)
+        try:
+            response = self.get_response(request)
+        finally:
+            _writes.reset(token)
+        if writes['wrote'] and replicas() and request.user.is_authenticated:
+            pin(request.user.pk)
+        return response
+
+    async def __acall__(self, request):
+        writes = {'wrote': False}
+        token = _writes.set(writes)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _writes.reset(token)
+        if writes['wrote'] and replicas():
+            user = await request.auser()
+            if user.is_authenticated:
+                await cache.aset(_pin_key(user.pk), 1, settings.REPLICA_PIN_SECONDS)
+        return response
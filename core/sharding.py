@@ -0,0 +1,178 @@
+"""
+Ledger sharding.
+
+With more than one LEDGER_SHARDS alias the ledger tables (accounts, their
+transactions, daily balances and journal, with the standing orders and interest
+runs that post to them) are spread over those databases. Everything else (users,
+sessions, the outbox, transfer sagas...) stays on 'default', which is also the
+first shard. With a single shard, the default,
+nothing here changes any routing.
+
+A new account goes to the shard its number picks (place()), and
+accounts.directory records which shard that was, so accounts opened before
+sharding was switched on stay on 'default'. ShardRouter sends a ledger query to
+the shard of the instance it is about (an account, its loan, a user's account),
+otherwise to the current shard: the request user's, set by ShardMiddleware, or
+the one an `on(alias)` / `atomic(account)` block sets.
+
+transaction.atomic() only covers 'default', postings use atomic(account) so the
+transaction is on the account's shard. A transfer between two shards can't be
+one transaction, transactions/sagas.py runs it as a saga.
+"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, transaction
+
+_current = ContextVar('ledger_shard', default=None)
+# the shard of the innermost atomic() block
+_block = ContextVar('ledger_block', default=None)
+
+SHARDED_MODELS = {
+    'accounts.userbankaccount',
+    'transactions.transaction',
+    'transactions.dailybalance',
+    'transactions.journalentry',
+    'transactions.journalline',
+    'transactions.sagastep',
+    'transactions.standingorder',
+    'transactions.standingorderrun',
+    'transactions.interestrun',
+}
+
+
+def shards():
+    return getattr(settings, 'LEDGER_SHARDS', [DEFAULT_DB_ALIAS])
+
+
+def enabled():
+    return len(shards()) > 1
+
+
+def place(account_no):
+    """The shard a new account with this number is opened on."""
+    choices = shards()
+    return choices[account_no % len(choices)]
+
+
+def current():
+    return _current.get() or DEFAULT_DB_ALIAS
+
+
+@contextmanager
+def on(alias):
+    """Ledger queries without an instance to go by use alias inside the block."""
+    token = _current.set(alias)
+    try:
+        yield
+    finally:
+        _current.reset(token)
+
+
+def shard_of(account):
+    if not enabled():
+        return DEFAULT_DB_ALIAS
+    if account._state.adding:
+        # not saved yet, _state.db may only be what assigning its user set
+        return place(account.account_no)
+    return account._state.db
+
+
+def same_shard(account, other):
+    return shard_of(account) == shard_of(other)
+
+
+@contextmanager
+def atomic(account=None):
+    """
+    transaction.atomic on the account's shard (the current one without an account), which
+    is current inside. Nested in another of these blocks on the same shard it joins that
+    transaction without a savepoint: an error rolls back the enclosing block as well.
+    """
+    alias = shard_of(account) if account is not None else current()
+    enclosing = _block.get()
+    token = _block.set(alias)
+    try:
+        with on(alias), transaction.atomic(using=alias, savepoint=enclosing != alias):
+            yield
+    finally:
+        _block.reset(token)
+
+
+class ShardRouter:
+    def _shard(self, model, hints):
+        if not enabled() or model._meta.label_lower not in SHARDED_MODELS:
+            return None
+        instance = hints.get('instance')
+        if instance is None:
+            return current()
+        label = instance._meta.label_lower
+        if label == 'auth.user':
+            # user.account
+            from accounts.directory import user_shard
+            return user_shard(instance)
+        if label not in SHARDED_MODELS:
+            return current()
+        if label == 'accounts.userbankaccount' and instance._state.adding and instance.account_no is not None:
+            return shard_of(instance)
+        if instance._state.db is not None:
+            return instance._state.db
+        account = instance._state.fields_cache.get('account')
+        if account is not None:
+            return shard_of(account)
+        return current()
+
+    def db_for_read(self, model, **hints):
+        return self._shard(model, hints)
+
+    def db_for_write(self, model, **hints):
+        return self._shard(model, hints)
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # an account on a shard still belongs to its user on 'default'
+        if enabled() and obj1._state.db in shards() and obj2._state.db in shards():
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # every shard gets the whole schema, but the data migrations only run on
+        # 'default': the historical models would be routed there anyway
+        if db != DEFAULT_DB_ALIAS and db in shards() and model_name is None:
+            return False
+        return None
+
+
+class ShardMiddleware:
+    """Makes the request user's shard the current one. Put it after AuthenticationMiddleware."""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not enabled():
+            return self.get_response(request)
+        with on(_user_shard(request.user)):
+            return self.get_response(request)
+
+    async def __acall__(self, request):
+        if not enabled():
+            return await self.get_response(request)
+        with on(_user_shard(await request.auser())):
+            return await self.get_response(request)
+
+
+def _user_shard(user):
+    if not user.is_authenticated:
+        return DEFAULT_DB_ALIAS
+    from accounts.directory import user_shard
+    # AccountBackend loaded the directory entry with the user, no query here
+    return user_shard(user)
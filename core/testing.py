@@ -0,0 +1,26 @@
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+from django.urls import reverse
+
+from .middleware import QueryRecorder
+
+
+def assert_query_budget(client, url_name, *args, method='get', data=None, budget=None, **kwargs):
+    """
+    Request url_name with the test client and fail if it ran more queries, on all
+    databases together, than its QUERY_BUDGETS entry (or the budget passed in).
+    Returns the response.
+    """
+    budget = budget if budget is not None else settings.QUERY_BUDGETS[url_name]
+    recorder = QueryRecorder()
+    with ExitStack() as stack:
+        # a test mirror can share its connection with the database it mirrors, count it once
+        for connection in {id(connection): connection for connection in connections.all()}.values():
+            stack.enter_context(connection.execute_wrapper(recorder))
+        response = getattr(client, method)(reverse(url_name, args=args, kwargs=kwargs), data or {})
+    if recorder.count > budget:
+        statements = '\n'.join(f'{count} x {sql}' for sql, count in recorder.fingerprints.items())
+        raise AssertionError(f'{url_name} ran {recorder.count} queries, its budget is {budget}:\n{statements}')
+    return response
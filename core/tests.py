@@ -1,3 +1,223 @@
-from django.test import TestCase
+import io
+from datetime import timedelta
+from unittest import skipUnless
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.contrib.sessions.backends.db import SessionStore
+from django.contrib.sessions.models import Session
+from django.core import mail
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+
+from core import idempotency, ratelimit, routing
+from core.mail import claim_batch, deliver, queue_email
+from core.models import IdempotencyKey, QueuedEmail
+
+
+class MailOutboxTests(TestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        self.queued = queue_email('Deposit', '<p>hi</p>', 'someone@example.com')
+
+    def test_delivered_once(self):
+        batch = claim_batch(10)
+        self.assertEqual(deliver(batch), (1, 0))
+        self.assertIsNone(claim_batch(10))
+        self.assertEqual(len(mail.outbox), 1)
+        self.queued.refresh_from_db()
+        self.assertEqual(self.queued.status, QueuedEmail.SENT)
+
+    def test_expired_lease_is_not_sent(self):
+        slow = claim_batch(10)
+        # the lease runs out before the slow worker gets to the message and another worker claims it
+        QueuedEmail.objects.update(next_attempt_at=timezone.now() - timedelta(seconds=1))
+        slow[0].next_attempt_at = timezone.now() - timedelta(seconds=1)
+        fast = claim_batch(10)
+        self.assertEqual(deliver(slow), (0, 0))
+        self.assertEqual(deliver(fast), (1, 0))
+        self.assertEqual(len(mail.outbox), 1)
+
+    def test_lost_claim_is_not_recorded(self):
+        slow = claim_batch(10)
+        QueuedEmail.objects.update(claimed_by='other-worker')
+        self.assertEqual(deliver(slow), (0, 0))
+        self.queued.refresh_from_db()
+        self.assertEqual((self.queued.status, self.queued.claimed_by), (QueuedEmail.SENDING, 'other-worker'))
+
+    def test_failed_message_is_retried_later(self):
+        batch = claim_batch(10)
+        batch[0].to = 'not an address\n'
+        sent, failed = deliver(batch)
+        self.queued.refresh_from_db()
+        self.assertEqual((sent, failed), (0, 1))
+        self.assertEqual((self.queued.status, self.queued.attempts), (QueuedEmail.PENDING, 1))
+        self.assertGreater(self.queued.next_attempt_at, timezone.now())
+
+
+@override_settings(RATE_LIMITS={'transfer': {'account': '3/m', 'ip': '2/m'}})
+class RateLimitTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_ip_rejection_gives_the_account_hit_back(self):
+        self.assertIsNone(ratelimit.check('transfer', 1, '10.0.0.1'))
+        self.assertIsNone(ratelimit.check('transfer', 2, '10.0.0.1'))
+        # the IP is over its limit, account 2's hit is undone with the rejection
+        self.assertEqual(ratelimit.check('transfer', 2, '10.0.0.1').status_code, 429)
+        self.assertIsNone(ratelimit.check('transfer', 2, '10.0.0.2'))
+        self.assertIsNone(ratelimit.check('transfer', 2, '10.0.0.3'))
+        limited = ratelimit.check('transfer', 2, '10.0.0.4')
+        self.assertEqual(limited.status_code, 429)
+        self.assertIn('Retry-After', limited)
+
+    def test_previous_window_counts_by_its_overlap(self):
+        self.assertEqual(ratelimit.hit('slide', 1, '2/m', now=60 * 100 + 50), (True, 0))
+        self.assertEqual(ratelimit.hit('slide', 1, '2/m', now=60 * 100 + 55), (True, 0))
+        # a quarter of the next window in, 3/4 of the two earlier hits are still inside it
+        self.assertEqual(ratelimit.hit('slide', 1, '2/m', now=60 * 101 + 15), (False, 45))
+        self.assertEqual(ratelimit.hit('slide', 1, '2/m', now=60 * 101 + 45), (True, 0))
+
+
+class IdempotencyTests(TestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        self.user = User.objects.create_user('idempotent', password='secret')
+        self.calls = 0
+
+        @idempotency.idempotent
+        def view(request):
+            self.calls += 1
+            return HttpResponse(f'posted {self.calls}', status=201)
+        self.view = view
+
+    def post(self, key='key-1', **data):
+        request = RequestFactory().post('/transfer/', {'amount': '100', **data}, HTTP_IDEMPOTENCY_KEY=key)
+        request.user = self.user
+        return self.view(request)
+
+    def test_repeat_replays_the_stored_response(self):
+        first = self.post()
+        repeat = self.post()
+        self.assertEqual(self.calls, 1)
+        self.assertEqual((repeat.status_code, repeat.content), (201, first.content))
+        self.assertEqual(repeat['Idempotent-Replayed'], 'true')
+        self.assertEqual(self.post('key-2').content, b'posted 2')
+
+    def test_repeat_while_the_first_runs_is_a_conflict(self):
+        request = RequestFactory().post('/transfer/', {'amount': '100'})
+        record, response = idempotency.begin(self.user.pk, 'key-1', idempotency.fingerprint(request))
+        self.assertIsNone(response)
+        self.assertEqual(self.post().status_code, 409)
+        self.assertEqual(self.calls, 0)
+        idempotency.release(record)  # the first request failed, the key can be sent again
+        self.assertEqual(self.post().status_code, 201)
+
+    def test_same_key_with_other_data_is_rejected(self):
+        self.post()
+        self.assertEqual(self.post(amount='900').status_code, 422)
+        self.assertEqual(self.calls, 1)
+
+    def test_expired_keys_are_purged_and_can_be_used_again(self):
+        self.post('old')
+        self.post('live')
+        IdempotencyKey.objects.filter(key='old').update(expires_at=timezone.now() - timedelta(seconds=1))
+        call_command('purge_idempotency_keys', batch_size=1, stdout=io.StringIO())
+        self.assertEqual(list(IdempotencyKey.objects.values_list('key', flat=True)), ['live'])
+        self.assertEqual(self.post('old').content, b'posted 3')
+        # one that expired but wasn't purged yet is claimed again as well
+        IdempotencyKey.objects.filter(key='live').update(expires_at=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(self.post('live').content, b'posted 4')
+
+
+@override_settings(SESSION_MODE='db', SESSION_ENGINE='django.contrib.sessions.backends.db')
+class SessionPurgeTests(TestCase):
+    databases = '__all__'
+
+    def session(self, expiry):
+        session = SessionStore()
+        session['user'] = 'someone'
+        session.set_expiry(expiry)
+        session.create()
+        return session.session_key
+
+    def test_expired_sessions_are_deleted(self):
+        expired = [self.session(-60) for _ in range(3)]
+        live = self.session(3600)
+        out = io.StringIO()
+        call_command('purge_sessions', batch_size=2, stdout=out)
+        self.assertEqual(out.getvalue(), 'Deleted 3 expired sessions\n')
+        self.assertEqual(list(Session.objects.values_list('pk', flat=True)), [live])
+        self.assertFalse(any(SessionStore().exists(key) for key in expired))
+        self.assertEqual(SessionStore(live).load(), {'user': 'someone', '_session_expiry': 3600})
+
+    @override_settings(SESSION_MODE='signed_cookies')
+    def test_nothing_to_purge_without_a_table(self):
+        self.session(-60)
+        out = io.StringIO()
+        call_command('purge_sessions', stdout=out)
+        self.assertIn('there is no session table', out.getvalue())
+        self.assertEqual(Session.objects.count(), 1)
+
+
+@skipUnless('replica' in settings.DATABASES, 'needs the replica of LOCAL_SQLITE')
+@override_settings(DATABASE_REPLICAS=['replica'])
+class ReplicaRoutingTests(TransactionTestCase):
+    # not TestCase: its transaction would keep every read on the primary
+    databases = {'default', 'replica'}
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('reader')
+
+        @routing.reads_from_replica
+        def report(request):
+            # where this view's reads went, and the user it shows read there
+            return HttpResponse(f'{routing.read_db()} {User.objects.get(pk=request.user.pk)._state.db}')
+
+        def deposit(request):
+            request.user.save(update_fields=['last_login'])
+            return HttpResponse(status=302)
+
+        self.report = routing.ReplicaPinMiddleware(report)
+        self.deposit = routing.ReplicaPinMiddleware(deposit)
+
+    def request(self, view, method='get'):
+        request = getattr(RequestFactory(), method)('/')
+        request.user = self.user
+        return view(request).content.decode()
+
+    def test_reads_go_to_the_replica(self):
+        self.assertEqual(self.request(self.report), 'replica replica')
+        with routing.replica():
+            self.assertEqual(User.objects.all().db, 'replica')
+        self.assertEqual(User.objects.all().db, DEFAULT_DB_ALIAS)
+        # only GET and HEAD, a form posted back to the view reads the primary
+        self.assertEqual(self.request(self.report, 'post'), 'default default')
+
+    def test_reads_are_pinned_to_the_primary_after_a_write(self):
+        self.request(self.deposit, 'post')
+        self.assertTrue(routing.pinned(self.user.pk))
+        self.assertEqual(self.request(self.report), 'default default')
+        # other users still read from the replica
+        self.user = User.objects.create_user('other')
+        self.assertEqual(self.request(self.report), 'replica replica')
+
+    def test_writes_always_go_to_the_primary(self):
+        with routing.replica():
+            user = User.objects.get(pk=self.user.pk)
+            self.assertEqual(user._state.db, 'replica')
+            user.first_name = 'Written'
+            user.save()
+            self.assertEqual(user._state.db, DEFAULT_DB_ALIAS)
+            self.assertEqual(User.objects.create_user('new')._state.db, DEFAULT_DB_ALIAS)
+            with transaction.atomic():
+                # a transaction reads what it wrote
+                self.assertEqual(User.objects.all().db, DEFAULT_DB_ALIAS)
+        self.assertEqual(User.objects.using(DEFAULT_DB_ALIAS).get(pk=self.user.pk).first_name, 'Written')
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 
+from decimal import Decimal
 from pathlib import Path
 import environ
 env = environ.Env()
@@ -55,23 +56,36 @@ CRISPY_ALLOWED_TEMPLATE_PACKS = "bootstrap5"
 CRISPY_TEMPLATE_PACK = "bootstrap5"
 
 MIDDLEWARE = [
+    'core.middleware.QueryBudgetMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'core.routing.ReplicaPinMiddleware',
+    'core.sharding.ShardMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
 ROOT_URLCONF = 'swiss_bank.urls'
 
+# The cached loader compiles each template once per process instead of re-parsing
+# base.html, navbar.html and footer.html on every page. runserver's autoreloader
+# still resets it when a template changes, TEMPLATE_CACHE=False turns it off.
+TEMPLATE_LOADERS = [
+    'django.template.loaders.filesystem.Loader',
+    'django.template.loaders.app_directories.Loader',
+]
+if env.bool("TEMPLATE_CACHE", default=True):
+    TEMPLATE_LOADERS = [('django.template.loaders.cached.Loader', TEMPLATE_LOADERS)]
+
 TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
         'DIRS': ['templates'],
-        'APP_DIRS': True,
         'OPTIONS': {
+            'loaders': TEMPLATE_LOADERS,
             'context_processors': [
                 'django.template.context_processors.debug',
                 'django.template.context_processors.request',
@@ -95,21 +109,169 @@ WSGI_APPLICATION = 'swiss_bank.wsgi.application'
 #     }
 # }
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.postgresql_psycopg2',
-        'NAME': env("DB_NAME"),
-        'USER': env("DB_USER"),
-        'PASSWORD': env("DB_PASSWORD"),
-        'HOST': env("DB_HOST"),
-        'PORT': env("DB_PORT"),
+if env.bool("LOCAL_SQLITE", default=False):
+    # two SQLite files standing in for the primary and a replica, `manage.py sync_sqlite_replica`
+    # copies the primary over the replica (run it again to "replicate")
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': BASE_DIR / 'db.sqlite3',
+            # writers queue for the database lock up front instead of failing halfway through
+            'OPTIONS': {'transaction_mode': 'IMMEDIATE', 'timeout': 20},
+            # a file, the shared in-memory test database fails concurrent tests with "table is locked"
+            'TEST': {'NAME': BASE_DIR / 'db.test.sqlite3'},
+        },
+        'replica': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': BASE_DIR / 'db.replica.sqlite3',
+            'TEST': {'MIRROR': 'default'},
+        },
     }
-}
+    # more files standing in for ledger shards, `manage.py migrate_shards` sets them up
+    for number in range(1, env.int("LOCAL_SQLITE_SHARDS", default=0) + 1):
+        DATABASES[f'shard{number}'] = {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': BASE_DIR / f'db.shard{number}.sqlite3',
+            'TEST': {'NAME': BASE_DIR / f'db.shard{number}.test.sqlite3'},
+        }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql_psycopg2',
+            'NAME': env("DB_NAME"),
+            'USER': env("DB_USER"),
+            'PASSWORD': env("DB_PASSWORD"),
+            'HOST': env("DB_HOST"),
+            'PORT': env("DB_PORT"),
+        }
+    }
+    # streaming replicas of the primary, same database and credentials on another host
+    for number, host in enumerate(env.list("DB_REPLICA_HOSTS", default=[]), 1):
+        DATABASES[f'replica{number}'] = {**DATABASES['default'], 'HOST': host, 'TEST': {'MIRROR': 'default'}}
+    # ledger shards, primaries of their own holding part of the accounts
+    for number, host in enumerate(env.list("DB_SHARD_HOSTS", default=[]), 1):
+        DATABASES[f'shard{number}'] = {**DATABASES['default'], 'HOST': host}
+
+# Views wrapped in core.routing.reads_from_replica read from these, see core/routing.py
+DATABASE_REPLICAS = [alias for alias in DATABASES if alias.startswith('replica')]
+# accounts and their ledger rows are spread over these, 'default' first, see core/sharding.py.
+# The aliases are stored in accounts.AccountDirectory, don't rename them once accounts are on them
+LEDGER_SHARDS = ['default'] + [alias for alias in DATABASES if alias.startswith('shard')]
+DATABASE_ROUTERS = ['core.sharding.ShardRouter', 'core.routing.ReplicaRouter']
+# how long a user reads from the primary after writing, longer than the replicas usually lag.
+# Kept in the cache, so CACHE_URL has to be shared when running several workers
+REPLICA_PIN_SECONDS = env.int("REPLICA_PIN_SECONDS", default=5)
 
 # Database
 # https://docs.djangoproject.com/en/3.0/ref/settings/#databases
 
 
+# locmem by default, point CACHE_URL at redis (e.g. rediscache://127.0.0.1:6379/1) in production
+CACHES = {
+    'default': env.cache('CACHE_URL', default='locmemcache://'),
+    # a separate alias so sessions can live in a redis db that doesn't evict keys
+    'sessions': env.cache('SESSION_CACHE_URL', default=env.str('CACHE_URL', default='locmemcache://')),
+    # {% cache %} fragments and rendered report pages (transactions/report.py). Per process
+    # by default, so a deploy never serves fragments of the old templates
+    'template_fragments': env.cache(
+        'FRAGMENT_CACHE_URL', default='locmemcache://template_fragments?MAX_ENTRIES=5000'
+    ),
+}
+# How long a rendered report page is kept. A new transaction on the account changes
+# its key, so this only bounds how long unused pages take up room
+REPORT_CACHE_SECONDS = env.int("REPORT_CACHE_SECONDS", default=15 * 60)
+
+# Where sessions are kept. db reads the session table on every logged in request,
+# cached_db reads from the cache and only writes through to the table, cache keeps
+# them in the cache alone (lost on a flush or eviction) and signed_cookies keeps
+# them in the browser (no server side logout of stolen cookies). cached_db and cache
+# need a cache shared by every worker, not the locmem default.
+SESSION_ENGINES = {
+    'db': 'django.contrib.sessions.backends.db',
+    'cached_db': 'django.contrib.sessions.backends.cached_db',
+    'cache': 'django.contrib.sessions.backends.cache',
+    'signed_cookies': 'django.contrib.sessions.backends.signed_cookies',
+}
+SESSION_MODE = env.str("SESSION_MODE", default='db')
+SESSION_ENGINE = SESSION_ENGINES[SESSION_MODE]
+SESSION_CACHE_ALIAS = 'sessions'
+
+# cookie keeps flash messages out of the session entirely, fallback (Django's default)
+# only spills into the session when they don't fit in a cookie
+MESSAGE_STORAGES = {
+    'cookie': 'django.contrib.messages.storage.cookie.CookieStorage',
+    'session': 'django.contrib.messages.storage.session.SessionStorage',
+    'fallback': 'django.contrib.messages.storage.fallback.FallbackStorage',
+}
+MESSAGE_STORAGE = MESSAGE_STORAGES[env.str("MESSAGE_MODE", default='cookie')]
+
+# account numbers are reserved in blocks of this size per process, see accounts/numbers.py
+ACCOUNT_NUMBER_BLOCK_SIZE = env.int("ACCOUNT_NUMBER_BLOCK_SIZE", default=100)
+# append a Luhn check digit to new account numbers (can't be turned off again later)
+ACCOUNT_NUMBER_CHECK_DIGIT = env.bool("ACCOUNT_NUMBER_CHECK_DIGIT", default=False)
+
+# how long a money-moving POST's idempotency key (and its stored response) is kept, in seconds
+IDEMPOTENCY_KEY_TTL = env.int("IDEMPOTENCY_KEY_TTL", default=24 * 60 * 60)
+
+# POSTs allowed per account and per client IP, as "count/period" (s, m, h or d), empty turns one off.
+# Counted in the cache (core/ratelimit.py), so CACHE_URL has to be shared when running several workers
+RATE_LIMITS = {
+    'withdraw': {
+        'account': env("WITHDRAW_RATE_ACCOUNT", default="10/m"),
+        'ip': env("WITHDRAW_RATE_IP", default="30/m"),
+    },
+    'transfer': {
+        'account': env("TRANSFER_RATE_ACCOUNT", default="10/m"),
+        'ip': env("TRANSFER_RATE_IP", default="30/m"),
+    },
+}
+# most an account can withdraw / send over any 24 hours, in $ (see transactions/limits.py)
+DAILY_LIMITS = {
+    'withdraw': Decimal(env("DAILY_WITHDRAW_LIMIT", default="50000")),
+    'transfer': Decimal(env("DAILY_TRANSFER_LIMIT", default="100000")),
+    # payroll uploads (bulk_transfer) get their own, larger cap
+    'bulk_transfer': Decimal(env("DAILY_BULK_TRANSFER_LIMIT", default="1000000")),
+}
+
+# yearly interest rate per account type, paid monthly by `manage.py accrue_interest` (transactions/interest.py)
+INTEREST_RATES = {
+    'Savings': Decimal(env("SAVINGS_INTEREST_RATE", default="0.02")),
+}
+INTEREST_DAY_COUNT = 365
+
+AUTHENTICATION_BACKENDS = [
+    'accounts.backends.AccountBackend',
+    # sessions created before AccountBackend still name this one
+    'django.contrib.auth.backends.ModelBackend',
+]
+
+
+# Which hasher new passwords (and every login with an older hash) get, see accounts/hashers.py.
+# pbkdf2 and scrypt are built in, argon2 needs argon2-cffi installed
+PASSWORD_HASH_PROFILES = {
+    'pbkdf2': 'accounts.hashers.PBKDF2PasswordHasher',
+    'scrypt': 'accounts.hashers.ScryptPasswordHasher',
+    'argon2': 'accounts.hashers.Argon2PasswordHasher',
+}
+PASSWORD_HASH_PROFILE = env.str("PASSWORD_HASH_PROFILE", default='pbkdf2')
+PASSWORD_HASHERS = [PASSWORD_HASH_PROFILES[PASSWORD_HASH_PROFILE]] + [
+    hasher for profile, hasher in PASSWORD_HASH_PROFILES.items() if profile != PASSWORD_HASH_PROFILE
+] + [
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+    'django.contrib.auth.hashers.BCryptSHA256PasswordHasher',
+]
+# changing these re-hashes each password on its next login
+PASSWORD_HASH_PARAMS = {
+    'pbkdf2': {'iterations': env.int("PBKDF2_ITERATIONS", default=870_000)},
+    # about 16 MB and a few tens of ms per hash
+    'scrypt': {'work_factor': 2 ** 14, 'block_size': 8, 'parallelism': 1},
+    # the OWASP minimum: 19 MiB, 2 passes, 1 lane
+    'argon2': {'time_cost': 2, 'memory_cost': 19456, 'parallelism': 1},
+}
+# at most this many hashes run at once, the other logins wait for one to finish. 0 is no limit
+PASSWORD_HASH_WORKERS = env.int("PASSWORD_HASH_WORKERS", default=0)
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
 
@@ -157,4 +319,56 @@ EMAIL_HOST = 'smtp.gmail.com'
 EMAIL_USE_TLS = True
 EMAIL_PORT = 587
 EMAIL_HOST_USER = env("EMAIL")
-EMAIL_HOST_PASSWORD = env("EMAIL_PASSWORD")
\ No newline at end of file
+EMAIL_HOST_PASSWORD = env("EMAIL_PASSWORD")
+
+
+# Per request query/timing instrumentation, see core/middleware.py
+# most queries each url name may run, over budget is logged (or raised with QUERY_BUDGET_RAISE)
+# (measured with one ledger database, the sharded layout's are below)
+QUERY_BUDGETS = {
+    # the money forms include 2 queries for their idempotency key (core/idempotency.py)
+    # a report page not in the cache is the statement and the rows
+    'transaction_report': 4,
+    'deposit_money': 13,
+    'withdraw_money': 13,
+    'loan_request': 7,
+    'loan_list': 4,
+    'transfer_money': 17,
+    'async_transaction_report': 4,
+    'async_deposit_money': 13,
+    'async_withdraw_money': 13,
+    'async_transfer_money': 17,
+    'profile': 7,
+    'api_balance': 2,
+    'api_balances': 3,
+    'api_transactions': 3,
+    'api_deposit': 13,
+    'api_withdraw': 13,
+    'api_transfer': 17,
+    'api_loans': 7,
+    'api_repay_loan': 14,
+}
+if len(LEDGER_SHARDS) > 1:
+    # measured with two SQLite shards: the request user's account comes from the directory
+    # entry, the async views load the user and account again through request.auser() after
+    # ShardMiddleware, and a transfer to another shard is a saga (the saga row and its moves
+    # on 'default', a step row and the posting on each shard)
+    QUERY_BUDGETS = {name: budget + 1 for name, budget in QUERY_BUDGETS.items()}
+    for name in QUERY_BUDGETS:
+        if name.startswith('async_'):
+            QUERY_BUDGETS[name] += 2
+    QUERY_BUDGETS['api_balances'] += 1
+    for name in ('transfer_money', 'async_transfer_money', 'api_transfer'):
+        QUERY_BUDGETS[name] += 13
+QUERY_BUDGET_RAISE = env.bool("QUERY_BUDGET_RAISE", default=False)
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'swiss_bank.perf': {'handlers': ['console'], 'level': env("PERF_LOG_LEVEL", default='WARNING')},
+    },
+}
@@ -1,16 +1,82 @@
 from django.contrib import admin
-from .views import send_transaction_email
+from django.utils.decorators import method_decorator
+from core.routing import reads_from_replica
+from .views import approve_loans_and_notify, reject_loans_and_notify, send_transaction_email
+from . import ledger
+from .constants import LOAN
 # from transactions.models import Transaction
-from .models import Transaction
+from .models import InterestRun, StandingOrder, StandingOrderRun, Transaction, TransferSaga
 @admin.register(Transaction)
 class TransactionAdmin(admin.ModelAdmin):
-    list_display = ['account', 'amount', 'balance_after_transaction', 'transaction_type', 'loan_approve']
+    list_display = ['account', 'amount', 'balance_after_transaction', 'transaction_type', 'loan_approve', 'loan_rejected']
+    list_filter = ['transaction_type', 'loan_approve', 'loan_rejected']
+    list_select_related = ['account']
+    raw_id_fields = ['account']
+    # the table has millions of rows, skip the extra COUNT(*) of the whole table
+    show_full_result_count = False
+    actions = ['approve_loans', 'reject_loans']
+
+    @method_decorator(reads_from_replica)
+    def changelist_view(self, request, extra_context=None):
+        # browsing millions of rows is kept off the primary, the bulk actions POST and stay there
+        return super().changelist_view(request, extra_context)
+
+    def get_readonly_fields(self, request, obj=None):
+        if obj is not None and obj.loan_approve:
+            # the money is already out, un-approving here would not take it back
+            return ['account', 'amount', 'balance_after_transaction', 'transaction_type', 'loan_approve', 'loan_rejected']
+        return []
     
     def save_model(self, request, obj, form, change):
         if(obj.loan_approve == True):
+            obj.loan_rejected = False
+            # credits the account and saves obj, admin already runs this inside a transaction
+            ledger.disburse_loan(obj)
+            if 'loan_approve' in form.changed_data:
+                send_transaction_email(obj.account.user, obj.amount, "Loan Approval", "transactions/admin_email.html")
+        else:
+            super().save_model(request, obj, form, change)
+
+    def _pending(self, queryset):
+        return list(
+            queryset.filter(transaction_type=LOAN, loan_approve=False, loan_rejected=False).values_list('pk', flat=True)
+        )
+
+    @admin.action(description='Approve selected pending loans')
+    def approve_loans(self, request, queryset):
+        loans = approve_loans_and_notify(self._pending(queryset))
+        self.message_user(request, f'Approved {len(loans)} loans for {sum(loan.amount for loan in loans)} $')
+
+    @admin.action(description='Reject selected pending loans')
+    def reject_loans(self, request, queryset):
+        loans = reject_loans_and_notify(self._pending(queryset))
+        self.message_user(request, f'Rejected {len(loans)} loans')
+
+@admin.register(StandingOrder)
+class StandingOrderAdmin(admin.ModelAdmin):
+    list_display = ['account', 'receiver_account_no', 'amount', 'frequency', 'next_run_at', 'ends_on', 'active']
+    list_filter = ['frequency', 'active']
+    list_select_related = ['account']
+    raw_id_fields = ['account']
+
+
+@admin.register(StandingOrderRun)
+class StandingOrderRunAdmin(admin.ModelAdmin):
+    list_display = ['order', 'scheduled_for', 'executed_at', 'succeeded', 'error']
+    list_filter = ['succeeded']
+    list_select_related = ['order__account']
+    raw_id_fields = ['order']
+
+
+@admin.register(InterestRun)
+class InterestRunAdmin(admin.ModelAdmin):
+    list_display = ['period', 'accounts_credited', 'total_interest', 'last_account_id', 'started', 'finished']
+    readonly_fields = ['last_account_id', 'accounts_credited', 'total_interest', 'started', 'finished']
+
 
-            obj.account.balance += obj.amount
-            obj.balance_after_transaction = obj.account.balance
-            obj.account.save()
-            send_transaction_email(obj.account.user, obj.amount, "Loan Approval", "transactions/admin_email.html")
-            super().save_model(request, obj, form, change)
\ No newline at end of file
+@admin.register(TransferSaga)
+class TransferSagaAdmin(admin.ModelAdmin):
+    # cross-shard transfers, `manage.py resume_sagas` finishes the ones left pending or debited
+    list_display = ['sender_account_no', 'receiver_account_no', 'amount', 'state', 'error', 'created', 'updated']
+    list_filter = ['state']
+    readonly_fields = ['sender_account_no', 'receiver_account_no', 'amount', 'state', 'error', 'created', 'updated']
@@ -0,0 +1,254 @@
+"""
+JSON API for the same operations as the html views, for the mobile and partner clients.
+
+Authentication is the normal session (log in through /accounts/login/ and send the
+CSRF token as X-CSRFToken on POSTs). Bodies may be JSON or form encoded. Money-moving
+POSTs accept an Idempotency-Key header. Nothing here renders a template, and the
+transaction list is serialized straight from values() rows.
+"""
+import json
+from functools import wraps
+
+from django.core.exceptions import BadRequest
+from django.db.transaction import atomic
+from django.http import JsonResponse
+from django.views.decorators.http import require_GET, require_POST
+
+from accounts.directory import find_account, shards_of
+from accounts.models import UserBankAccount
+from core.idempotency import idempotent
+from core.ratelimit import ratelimit
+from core.routing import reads_from_replica
+from transactions import ledger
+from transactions.constants import DEPOSIT, WITHDRAWAL, LOAN, TRANSACTION_TYPE_NAMES
+from transactions.forms import DepositForm, WithdrawForm, LoanRequestForm, TransferForm
+from transactions.models import Transaction
+from transactions.pagination import date_range, keyset_page
+from transactions.views import (
+    deposit_and_notify, requested_dates, send_transaction_email, transfer_and_notify, withdraw_and_notify,
+)
+
+TRANSACTION_FIELDS = ['id', 'timestamp', 'transaction_type', 'amount', 'balance_after_transaction', 'loan_approve']
+MAX_PAGE_SIZE = 200
+MAX_BATCH = 1000
+
+
+def api_login_required(view):
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if not request.user.is_authenticated:
+            return JsonResponse({'error': 'Authentication required'}, status=401)
+        return view(request, *args, **kwargs)
+    return wrapper
+
+
+def payload(request):
+    if request.content_type == 'application/json':
+        try:
+            data = json.loads(request.body or b'{}')
+        except ValueError:
+            return None
+        return data if isinstance(data, dict) else None
+    return request.POST
+
+
+def bad_payload():
+    return JsonResponse({'error': 'The body must be a JSON object'}, status=400)
+
+
+def form_errors(form):
+    return JsonResponse({'errors': form.errors.get_json_data()}, status=400)
+
+
+def requested_page_size(request):
+    """?page_size= capped at MAX_PAGE_SIZE, raises BadRequest if it isn't a number."""
+    try:
+        return max(min(int(request.GET.get('page_size', 50)), MAX_PAGE_SIZE), 1)
+    except ValueError:
+        raise BadRequest('page_size must be a number')
+
+
+def balance_json(account, status=200, **extra):
+    return JsonResponse({
+        'account_no': account.account_no,
+        'balance': account.balance,
+        'active_loans': account.active_loans,
+        'outstanding_loan': account.outstanding_loan,
+        **extra,
+    }, status=status)
+
+
+@api_login_required
+@require_GET
+def balance(request):
+    return balance_json(request.user.account)
+
+
+def _money(request, form_class, transaction_type, post):
+    data = payload(request)
+    if data is None:
+        return bad_payload()
+    account = request.user.account
+    form = form_class(data, account=account, initial={'transaction_type': transaction_type})
+    if not form.is_valid():
+        return form_errors(form)
+    try:
+        post(account, form.cleaned_data['amount'])
+    except ledger.LedgerError as e:
+        return JsonResponse({'error': str(e)}, status=409)
+    return balance_json(account)
+
+
+@api_login_required
+@require_POST
+@idempotent
+def deposit(request):
+    return _money(request, DepositForm, DEPOSIT, deposit_and_notify)
+
+
+@api_login_required
+@require_POST
+@ratelimit('withdraw')
+@idempotent
+def withdraw(request):
+    return _money(request, WithdrawForm, WITHDRAWAL, withdraw_and_notify)
+
+
+@api_login_required
+@require_POST
+@ratelimit('transfer')
+@idempotent
+def transfer(request):
+    data = payload(request)
+    if data is None:
+        return bad_payload()
+    form = TransferForm(data)
+    if not form.is_valid():
+        return form_errors(form)
+    receiver = find_account(form.cleaned_data['receiver_account'])
+    if receiver is None:
+        return JsonResponse({'error': f"No account found with account no {form.cleaned_data['receiver_account']}"}, status=404)
+    account = request.user.account
+    try:
+        transfer_and_notify(account, receiver, form.cleaned_data['amount'])
+    except ledger.LedgerError as e:
+        return JsonResponse({'error': str(e)}, status=409)
+    return balance_json(account)
+
+
+def loan_json(loan):
+    return {
+        'id': loan['id'], 'amount': loan['amount'], 'timestamp': loan['timestamp'],
+        'loan_approve': loan['loan_approve'], 'loan_rejected': loan['loan_rejected'],
+    }
+
+
+@api_login_required
+@idempotent
+def loans(request):
+    """GET is cursor paginated like the transaction list, oldest first. POST requests a loan."""
+    account = request.user.account
+    if request.method == 'GET':
+        try:
+            page_size = requested_page_size(request)
+        except BadRequest as e:
+            return JsonResponse({'error': str(e)}, status=400)
+        rows = Transaction.objects.filter(account=account, transaction_type=LOAN)
+        rows, next_cursor = keyset_page(
+            rows.values('id', 'amount', 'timestamp', 'loan_approve', 'loan_rejected'), request.GET.get('cursor'), page_size,
+        )
+        return JsonResponse({'loans': [loan_json(row) for row in rows], 'next_cursor': next_cursor})
+    if request.method != 'POST':
+        return JsonResponse({'error': 'GET or POST'}, status=405)
+
+    data = payload(request)
+    if data is None:
+        return bad_payload()
+    if account.active_loans >= 3:
+        return JsonResponse({'error': 'You have crossed your loan limits'}, status=409)
+    form = LoanRequestForm(data, account=account, initial={'transaction_type': LOAN})
+    if not form.is_valid():
+        return form_errors(form)
+    with atomic():
+        loan = form.save()
+        send_transaction_email(request.user, loan.amount, 'Loan Request', 'transactions/loan_email.html')
+    row = {field: getattr(loan, field) for field in ['id', 'amount', 'timestamp', 'loan_approve', 'loan_rejected']}
+    return JsonResponse({'loan': loan_json(row)}, status=201)
+
+
+@api_login_required
+@require_POST
+@idempotent
+def repay_loan(request, loan_id):
+    account = request.user.account
+    loan = Transaction.objects.filter(id=loan_id, account=account).first()
+    if loan is None:
+        return JsonResponse({'error': 'No such loan'}, status=404)
+    loan.account = account  # so the ledger updates the instance the response is built from
+    try:
+        ledger.repay_loan(loan)
+    except ledger.LedgerError as e:
+        return JsonResponse({'error': str(e)}, status=409)
+    return balance_json(account)
+
+
+@api_login_required
+@require_GET
+@reads_from_replica
+def transactions(request):
+    """
+    Cursor paginated history. ?fields=id,amount picks the fields, ?cursor= comes from
+    the previous page's next_cursor, ?page_size= up to 200, start_date/end_date as on the report.
+    """
+    fields = [field for field in request.GET.get('fields', '').split(',') if field] or TRANSACTION_FIELDS
+    unknown = set(fields) - set(TRANSACTION_FIELDS)
+    if unknown:
+        return JsonResponse({'error': f'Unknown fields: {", ".join(sorted(unknown))}'}, status=400)
+    try:
+        page_size = requested_page_size(request)
+        start_date, end_date = requested_dates(request)
+    except BadRequest as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    queryset = Transaction.objects.filter(account=request.user.account)
+    if start_date and end_date:
+        start, end = date_range(start_date, end_date)
+        queryset = queryset.filter(timestamp__gte=start, timestamp__lt=end)
+    # the cursor needs timestamp and id, they are dropped again below if not asked for
+    selected = list(dict.fromkeys([*fields, 'timestamp', 'id']))
+    rows, next_cursor = keyset_page(queryset.values(*selected), request.GET.get('cursor'), page_size)
+
+    type_names = dict(TRANSACTION_TYPE_NAMES)
+    results = []
+    for row in rows:
+        item = {field: row[field] for field in fields}
+        if 'transaction_type' in item:
+            item['transaction_type'] = type_names.get(item['transaction_type'], item['transaction_type'])
+        results.append(item)
+    return JsonResponse({'results': results, 'next_cursor': next_cursor})
+
+
+@api_login_required
+@require_POST
+def balances(request):
+    """Staff only: {"account_nos": [...]} -> the balance of each, in one query per ledger shard."""
+    if not request.user.is_staff:
+        return JsonResponse({'error': 'Staff only'}, status=403)
+    data = payload(request)
+    if data is None:
+        return bad_payload()
+    account_nos = data.getlist('account_nos') if hasattr(data, 'getlist') else data.get('account_nos')
+    try:
+        account_nos = [int(account_no) for account_no in account_nos or []]
+    except (TypeError, ValueError):
+        return JsonResponse({'error': 'account_nos must be a list of account numbers'}, status=400)
+    if len(account_nos) > MAX_BATCH:
+        return JsonResponse({'error': f'At most {MAX_BATCH} account numbers per request'}, status=400)
+
+    found = {}
+    for shard, numbers in shards_of(account_nos).items():
+        accounts = UserBankAccount.objects.using(shard).filter(account_no__in=numbers)
+        found.update(accounts.values_list('account_no', 'balance'))
+    return JsonResponse({
+        'balances': {str(account_no): found[account_no] for account_no in account_nos if account_no in found},
+        'missing': [account_no for account_no in account_nos if account_no not in found],
+    })
@@ -0,0 +1,14 @@
+from django.urls import path
+from . import api
+
+
+urlpatterns = [
+    path("balance/", api.balance, name="api_balance"),
+    path("balances/", api.balances, name="api_balances"),
+    path("deposit/", api.deposit, name="api_deposit"),
+    path("withdraw/", api.withdraw, name="api_withdraw"),
+    path("transfer/", api.transfer, name="api_transfer"),
+    path("loans/", api.loans, name="api_loans"),
+    path("loans/<int:loan_id>/repay/", api.repay_loan, name="api_repay_loan"),
+    path("transactions/", api.transactions, name="api_transactions"),
+]
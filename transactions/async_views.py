@@ -0,0 +1,145 @@
+"""
+Async versions of the money views, for running under uvicorn (swiss_bank.asgi).
+
+Reads go through the async ORM. Ledger postings stay synchronous because Django
+transactions are, so each posting (with its queued mail) runs as one
+sync_to_async call. Mail is only queued either way, send_queued_mail does the SMTP
+work outside the request.
+"""
+import json
+
+from asgiref.sync import sync_to_async
+from django.contrib import messages
+from django.contrib.auth.decorators import login_required
+from django.contrib.auth.models import User
+from django.http import StreamingHttpResponse
+from django.shortcuts import redirect, render
+
+from accounts.directory import afind_account
+from accounts.models import UserBankAccount
+from core.idempotency import idempotent
+from core.ratelimit import ratelimit
+from core.routing import read_db, reads_from_replica
+from transactions import ledger, report
+from transactions.constants import DEPOSIT, WITHDRAWAL, TRANSACTION_TYPE_NAMES
+from transactions.forms import DepositForm, TransferForm, WithdrawForm
+from transactions.models import Transaction
+from transactions.pagination import date_range
+from transactions.views import (
+    EXPORT_FIELDS, deposit_and_notify, requested_dates, transfer_and_notify, withdraw_and_notify,
+)
+
+arender = sync_to_async(render)
+
+
+async def _account(request):
+    user = await request.auser()
+    request.user = user  # so rendering the templates doesn't load it again
+    if User.account.is_cached(user):
+        return user.account  # AccountBackend loads it together with the user
+    # on the user's shard (ShardMiddleware), where there is no auth_user to join
+    account = await UserBankAccount.objects.aget(user_id=user.pk)
+    account.user = user
+    return account
+
+
+async def _money_form(request, form_class, transaction_type, title, post, success_message):
+    account = await _account(request)
+    if request.method == 'POST':
+        form = form_class(request.POST, account=account, initial={'transaction_type': transaction_type})
+        if form.is_valid():
+            amount = form.cleaned_data['amount']
+            try:
+                await sync_to_async(post)(account, amount)
+            except ledger.LedgerError as e:
+                form.add_error('amount', str(e))
+            else:
+                messages.success(request, success_message.format(amount=float(amount)))
+                return redirect('async_transaction_report')
+    else:
+        form = form_class(account=account, initial={'transaction_type': transaction_type})
+    return await arender(request, 'transactions/transaction_form.html', {'form': form, 'title': title})
+
+
+@login_required
+@idempotent
+async def deposit_money(request):
+    return await _money_form(
+        request, DepositForm, DEPOSIT, 'Deposit', deposit_and_notify,
+        '${amount:,.2f} is deposited to your account successfully',
+    )
+
+
+@login_required
+@ratelimit('withdraw')
+@idempotent
+async def withdraw_money(request):
+    return await _money_form(
+        request, WithdrawForm, WITHDRAWAL, 'Withdraw Money', withdraw_and_notify,
+        'Successfully withdrawn {amount:,.2f}$ from your account',
+    )
+
+
+@login_required
+@ratelimit('transfer')
+@idempotent
+async def transfer_money(request):
+    if request.method == 'POST':
+        form = TransferForm(request.POST)
+        if form.is_valid():
+            receiver = form.cleaned_data['receiver_account']
+            amount = form.cleaned_data['amount']
+            sender_account = await _account(request)
+            receiver_account = await afind_account(receiver)
+            if receiver_account is None:
+                messages.error(request, f'No account found with account no {receiver}')
+            else:
+                try:
+                    await sync_to_async(transfer_and_notify)(sender_account, receiver_account, amount)
+                except ledger.LedgerError as e:
+                    messages.error(request, str(e))
+                else:
+                    return redirect('home')
+    else:
+        form = TransferForm()
+    return await arender(request, 'transactions/transfer_money.html', {'form': form})
+
+
+@login_required
+@reads_from_replica
+async def transaction_report(request):
+    account = await _account(request)
+    start_date, end_date = requested_dates(request)
+    return await arender(request, 'transactions/transaction_report.html', {
+        **await report.apage(account, request.GET, start_date, end_date),
+        'account': account,
+    })
+
+
+@login_required
+@reads_from_replica
+async def export_transactions(request):
+    # JSONL only, rows are streamed with aiterator so no thread is held while the client reads
+    account = await _account(request)
+    queryset = Transaction.objects.using(read_db(Transaction)).filter(account=account)
+    start_date, end_date = requested_dates(request)
+    if start_date and end_date:
+        start, end = date_range(start_date, end_date)
+        queryset = queryset.filter(timestamp__gte=start, timestamp__lt=end)
+    # values(), not values_list(): the latter runs its query when aiterator starts, in the event loop
+    rows = queryset.order_by('timestamp', 'id').values(*EXPORT_FIELDS).aiterator(chunk_size=2000)
+    type_names = dict(TRANSACTION_TYPE_NAMES)
+
+    async def lines():
+        async for row in rows:
+            yield json.dumps({
+                'id': row['id'],
+                'timestamp': row['timestamp'].isoformat(),
+                'transaction_type': type_names.get(row['transaction_type'], row['transaction_type']),
+                'amount': str(row['amount']),
+                'balance_after_transaction': str(row['balance_after_transaction']),
+            }) + '\n'
+
+    response = StreamingHttpResponse(lines(), content_type='application/x-ndjson')
+    response['Content-Disposition'] = f'attachment; filename="statement-{account.account_no}.jsonl"'
+    return response
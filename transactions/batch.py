@@ -0,0 +1,115 @@
+import csv
+import json
+from decimal import Decimal, InvalidOperation
+
+from django.db.transaction import atomic
+from django.template.loader import render_to_string
+
+from accounts.directory import find_accounts
+from core import sharding
+from core.mail import queue_emails
+from . import ledger, limits, sagas
+
+
+def parse_lines(stream, fmt='csv'):
+    """
+    Read (line_no, account_no, amount, error) tuples from a CSV or JSONL stream.
+
+    CSV rows are `account_no,amount` with an optional header row (a first line whose
+    first cell isn't a number), JSONL rows are {"account_no": ..., "amount": ...}.
+    """
+    if fmt == 'jsonl':
+        rows = ((line_no, line) for line_no, line in enumerate(stream, start=1) if line.strip())
+    else:
+        rows = enumerate(csv.reader(stream), start=1)
+
+    for line_no, row in rows:
+        try:
+            if fmt == 'jsonl':
+                data = json.loads(row)
+                account_no, amount = data['account_no'], data['amount']
+            else:
+                if not row:
+                    continue
+                account_no, amount = row[0], row[1]
+            account_no = int(account_no)
+            amount = Decimal(str(amount)).quantize(Decimal('0.01'))
+        except (ValueError, KeyError, IndexError, TypeError, InvalidOperation):
+            if line_no == 1 and fmt == 'csv' and not _is_number(row[0]):
+                continue  # header row, a first line with an account number in it is a payment
+            yield line_no, None, None, 'Could not read account_no and amount'
+        else:
+            yield line_no, account_no, amount, None
+
+
+def _is_number(cell):
+    try:
+        Decimal(cell.strip())
+    except InvalidOperation:
+        return False
+    return True
+
+
+def run_batch(sender, parsed):
+    """
+    Post a parsed batch from sender and return one result dict per line, in line order.
+    The lines paying accounts on the sender's ledger shard are posted together by
+    ledger.bulk_transfer, the ones paying another shard then go one by one as sagas.
+    """
+    parsed = list(parsed)
+    receivers = find_accounts({account_no for _, account_no, _, error in parsed if not error})
+
+    results = {}
+    lines, crossing = [], []
+    for line_no, account_no, amount, error in parsed:
+        results[line_no] = {'line': line_no, 'account_no': account_no, 'amount': str(amount) if amount is not None else None}
+        if not error and account_no not in receivers:
+            error = f'No account found with account no {account_no}'
+        if error:
+            results[line_no].update(status='rejected', error=error)
+        elif sharding.same_shard(sender, receivers[account_no]):
+            lines.append((line_no, receivers[account_no], amount))
+        else:
+            crossing.append((line_no, receivers[account_no], amount))
+
+    # the whole batch counts against the daily bulk cap, lines the ledger rejects are given back
+    requested = sum((amount for _, _, amount in lines + crossing if amount > 0), Decimal(0))
+    with limits.reserve('bulk_transfer', sender, requested) as reservation:
+        with atomic():
+            balance, accepted, rejected = ledger.bulk_transfer(sender, lines)
+            queue_emails(_mails(sender, accepted))
+        across = []
+        for line_no, receiver, amount in crossing:
+            try:
+                balance = sagas.transfer(sender, receiver, amount)
+            except ledger.LedgerError as e:
+                rejected.append((line_no, str(e)))
+            else:
+                across.append((line_no, receiver, amount))
+        queue_emails(_mails(sender, across))
+        accepted += across
+
+    reservation.refund(requested - sum((amount for _, _, amount in accepted), Decimal(0)))
+    for line_no, _, _ in accepted:
+        results[line_no]['status'] = 'ok'
+    for line_no, error in rejected:
+        results[line_no].update(status='rejected', error=error)
+    return balance, [results[line_no] for line_no in sorted(results)]
+
+
+def _mails(sender, accepted):
+    if not accepted:
+        return []
+    total = sum(amount for _, _, amount in accepted)
+    mails = [(
+        "Transfer money Mail",
+        render_to_string("transactions/sender_mail.html", {'user': sender.user, 'amount': total}),
+        sender.user.email,
+    )]
+    for _, receiver, amount in accepted:
+        mails.append((
+            "Receive money Mail",
+            render_to_string("transactions/receiver_mail.html", {'user': receiver.user, 'amount': amount}),
+            receiver.user.email,
+        ))
+    return mails
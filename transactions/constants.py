@@ -4,11 +4,85 @@ LOAN = 3
 LOAN_PAID = 4
 RECEIVE_MONEY = 5
 TRANSFER_MONEY=6
+INTEREST = 7
+TRANSFER_REVERSAL = 8
 
 TRANSACTION_TYPE = (
     (DEPOSIT, 'Deposit'),
     (WITHDRAWAL, 'Withdrawal'),
     (LOAN, 'Loan'),
     (LOAN_PAID, 'Loan Paid'),
-    
-)
\ No newline at end of file
+    (INTEREST, 'Interest'),
+)
+
+# display names for every type, including the transfer ones that aren't model choices
+TRANSACTION_TYPE_NAMES = TRANSACTION_TYPE + (
+    (RECEIVE_MONEY, 'Receive Money'),
+    (TRANSFER_MONEY, 'Transfer Money'),
+    (TRANSFER_REVERSAL, 'Transfer Reversal'),
+)
+
+# which types move money into / out of the account, pending loans move nothing
+CREDIT_TYPES = (DEPOSIT, LOAN, RECEIVE_MONEY, INTEREST, TRANSFER_REVERSAL)
+DEBIT_TYPES = (WITHDRAWAL, LOAN_PAID, TRANSFER_MONEY)
+
+# double-entry journal, see transactions/journal.py
+CASH = 'cash'
+LOANS = 'loans'
+CUSTOMER = 'customer'
+EQUITY = 'equity'
+INTEREST_EXPENSE = 'interest'
+TRANSIT = 'transit'
+
+BOOKS = (
+    (CASH, 'Cash'),
+    (LOANS, 'Loans'),
+    (CUSTOMER, 'Customer deposits'),
+    (EQUITY, 'Equity'),
+    (INTEREST_EXPENSE, 'Interest expense'),
+    (TRANSIT, 'In transit between shards'),
+)
+
+DEBIT = 'D'
+CREDIT = 'C'
+
+SIDES = (
+    (DEBIT, 'Debit'),
+    (CREDIT, 'Credit'),
+)
+
+# standing orders, see transactions/standing_orders.py
+DAILY = 'daily'
+WEEKLY = 'weekly'
+MONTHLY = 'monthly'
+
+FREQUENCIES = (
+    (DAILY, 'Daily'),
+    (WEEKLY, 'Weekly'),
+    (MONTHLY, 'Monthly'),
+)
+
+# transfers between ledger shards, see transactions/sagas.py
+SAGA_PENDING = 'pending'
+SAGA_DEBITED = 'debited'
+SAGA_COMPLETED = 'completed'
+SAGA_COMPENSATED = 'compensated'
+SAGA_FAILED = 'failed'
+
+SAGA_STATES = (
+    (SAGA_PENDING, 'Pending'),
+    (SAGA_DEBITED, 'Sender debited'),
+    (SAGA_COMPLETED, 'Completed'),
+    (SAGA_COMPENSATED, 'Refunded'),
+    (SAGA_FAILED, 'Failed'),
+)
+
+DEBIT_STEP = 'debit'
+CREDIT_STEP = 'credit'
+REFUND_STEP = 'refund'
+
+SAGA_STEPS = (
+    (DEBIT_STEP, 'Debit the sender'),
+    (CREDIT_STEP, 'Credit the receiver'),
+    (REFUND_STEP, 'Refund the sender'),
+)
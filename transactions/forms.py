@@ -1,5 +1,9 @@
 from django import forms 
-from .models import Transaction
+from accounts.directory import find_account
+from core import sharding
+from . import ledger
+from .constants import DEPOSIT, WITHDRAWAL
+from .models import StandingOrder, Transaction
 
 
 class TransactionForm(forms.ModelForm):
@@ -13,6 +17,16 @@ class TransactionForm(forms.ModelForm):
         self.fields['transaction_type'].widget = forms.HiddenInput()
     
     def save(self, commit=True):
+        # deposits and withdrawals are posted by the ledger, which writes their row with the
+        # balance after the posting; a loan request moves nothing until it's approved
+        transaction_type = self.cleaned_data['transaction_type']
+        if transaction_type in (DEPOSIT, WITHDRAWAL):
+            post = ledger.deposit if transaction_type == DEPOSIT else ledger.withdraw
+            with sharding.atomic(self.account):
+                post(self.account, self.cleaned_data['amount'])
+                # the account row stays locked until commit, its latest row is this posting's
+                self.instance = self.account.transactions.latest('id')
+            return self.instance
         self.instance.account = self.account
         self.instance.balance_after_transaction = self.account.balance
         return super().save()
@@ -66,10 +80,55 @@ class WithdrawForm(TransactionForm):
 class LoanRequestForm(TransactionForm):
     def clean_amount(self):
         amount = self.cleaned_data.get('amount')
-
+        if amount is not None and amount <= 0:
+            raise forms.ValidationError('Amount must be greater than zero')
         return amount
     
 
 class TransferForm(forms.Form):
     receiver_account = forms.IntegerField()
-    amount = forms.DecimalField()
\ No newline at end of file
+    amount = forms.DecimalField()
+
+
+class StandingOrderForm(forms.ModelForm):
+    receiver_account = forms.IntegerField()
+
+    class Meta:
+        model = StandingOrder
+        fields = ['receiver_account', 'amount', 'frequency', 'starts_at', 'ends_on']
+        widgets = {
+            'starts_at': forms.DateTimeInput(attrs={'type': 'datetime-local'}),
+            'ends_on': forms.DateInput(attrs={'type': 'date'}),
+        }
+
+    def __init__(self, *args, **kwargs):
+        self.account = kwargs.pop('account')
+        super().__init__(*args, **kwargs)
+
+    def clean_receiver_account(self):
+        account_no = self.cleaned_data.get('receiver_account')
+        receiver = find_account(account_no)  # on whichever shard it is
+        if receiver is None:
+            raise forms.ValidationError(f'No account found with account no {account_no}')
+        if receiver.pk == self.account.pk:
+            raise forms.ValidationError('You can not transfer money to your own account')
+        return receiver
+
+    def clean_amount(self):
+        amount = self.cleaned_data.get('amount')
+        if amount is not None and amount <= 0:
+            raise forms.ValidationError('Amount must be greater than zero')
+        return amount
+
+    def clean(self):
+        cleaned_data = super().clean()
+        starts_at, ends_on = cleaned_data.get('starts_at'), cleaned_data.get('ends_on')
+        if starts_at and ends_on and ends_on < starts_at.date():
+            self.add_error('ends_on', 'The last day can not be before the first payment')
+        return cleaned_data
+
+    def save(self, commit=True):
+        self.instance.account = self.account
+        self.instance.receiver_account_no = self.cleaned_data['receiver_account'].account_no
+        self.instance.next_run_at = self.instance.starts_at
+        return super().save(commit)
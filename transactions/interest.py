@@ -0,0 +1,144 @@
+"""
+Month-end interest on savings accounts, worked out from the daily balance snapshots.
+
+An account's balance on a day is the closing balance of its last snapshot on or
+before that day, so the month's balance-days come from the snapshots inside the
+month plus the last one before it, without reading any Transaction rows. Interest
+is balance-days * annual rate / INTEREST_DAY_COUNT, rounded to the cent.
+
+Accounts are taken in id order, a chunk at a time. A chunk's credits are posted
+with ledger.credit_many in the same transaction that moves the InterestRun
+checkpoint past the chunk. A crash therefore loses at most the chunk in flight,
+and running the command again carries on from the checkpoint without crediting
+anyone twice.
+
+With ledger sharding (core/sharding.py) every shard has its own InterestRun for the
+month, next to the accounts it credits, so the checkpoint still commits with them.
+"""
+from datetime import timedelta
+from decimal import ROUND_HALF_UP, Decimal
+from itertools import groupby
+
+from django.conf import settings
+from django.db.models import F, OuterRef, Subquery
+from django.utils import timezone
+
+from accounts.models import UserBankAccount
+from core import sharding
+from . import ledger
+from .constants import INTEREST
+from .models import DailyBalance, InterestRun
+
+CENT = Decimal('0.01')
+
+
+class InterestRunConflict(Exception):
+    pass
+
+
+def month_bounds(period):
+    """[first day, first day of the next month) for the month period falls in."""
+    start = period.replace(day=1)
+    end = (start + timedelta(days=32)).replace(day=1)
+    return start, end
+
+
+def previous_month(today=None):
+    today = today or timezone.localdate()
+    return (today.replace(day=1) - timedelta(days=1)).replace(day=1)
+
+
+def balance_days(prior, rows, start, end):
+    """
+    Sum of the end-of-day balance over every day in [start, end). prior is the closing
+    balance of the last snapshot before start (None if there is none), rows the
+    (date, opening_balance, closing_balance) snapshots inside the range in date order.
+    """
+    if prior is None:
+        prior = rows[0][1] if rows else Decimal(0)
+    total, balance, day = Decimal(0), prior, start
+    for snapshot_date, _, closing in rows:
+        total += balance * (snapshot_date - day).days
+        balance, day = closing, snapshot_date
+    return total + balance * (end - day).days
+
+
+def accrue(prior, rows, start, end, rate):
+    return (balance_days(prior, rows, start, end) * rate / settings.INTEREST_DAY_COUNT).quantize(CENT, ROUND_HALF_UP)
+
+
+def chunk_interest(after_id, start, end, rates, chunk_size):
+    """
+    {account_id: interest} for the next chunk_size interest bearing accounts after
+    after_id, and the last account id looked at (None when there are no more).
+    Two queries: the accounts with their balance before the month, then the month's snapshots.
+    """
+    prior = DailyBalance.objects.filter(account=OuterRef('pk'), date__lt=start).order_by('-date')
+    accounts = list(
+        UserBankAccount.objects.filter(pk__gt=after_id, account_type__in=rates)
+        .order_by('pk')
+        .annotate(prior=Subquery(prior.values('closing_balance')[:1]))
+        .values_list('pk', 'account_type', 'prior')[:chunk_size]
+    )
+    if not accounts:
+        return {}, None
+    rows = (
+        DailyBalance.objects.filter(account_id__in=[pk for pk, _, _ in accounts], date__gte=start, date__lt=end)
+        .order_by('account_id', 'date')
+        .values_list('account_id', 'date', 'opening_balance', 'closing_balance')
+    )
+    in_month = {
+        account_id: [row[1:] for row in group]
+        for account_id, group in groupby(rows.iterator(chunk_size=5000), key=lambda row: row[0])
+    }
+    credits = {}
+    for pk, account_type, balance_before in accounts:
+        month_rows = in_month.get(pk, [])
+        if balance_before is None and not month_rows:
+            continue  # no balance history at all (never used, or backfill_daily_balances hasn't run)
+        interest = accrue(balance_before, month_rows, start, end, rates[account_type])
+        if interest > 0:
+            credits[pk] = interest
+    return credits, accounts[-1][0]
+
+
+def start_run(period):
+    """The current shard's run for the month, created the first time."""
+    period = period.replace(day=1)
+    if month_bounds(period)[1] > timezone.localdate():
+        raise ValueError(f'{period:%B %Y} has not ended yet')
+    run, _ = InterestRun.objects.get_or_create(period=period)
+    return run
+
+
+def run_chunk(run, rates, chunk_size):
+    """
+    Post the next chunk of the run. Returns the number of accounts credited, or None
+    once the run has gone past the last account (it is marked finished then).
+    """
+    start, end = month_bounds(run.period)
+    with sharding.on(run._state.db), sharding.atomic():
+        # the run row lock keeps a second copy of the job from posting the same chunk
+        locked = InterestRun.objects.select_for_update().get(pk=run.pk)
+        if locked.last_account_id != run.last_account_id or locked.finished:
+            raise InterestRunConflict(f'{run} was moved on by another process')
+        credits, last_id = chunk_interest(run.last_account_id, start, end, rates, chunk_size)
+        if last_id is None:
+            run.finished = timezone.now()
+            InterestRun.objects.filter(pk=run.pk).update(finished=run.finished)
+            return None
+        ledger.credit_many(INTEREST, credits)
+        total = sum(credits.values(), Decimal(0))
+        InterestRun.objects.filter(pk=run.pk).update(
+            last_account_id=last_id,
+            accounts_credited=F('accounts_credited') + len(credits),
+            total_interest=F('total_interest') + total,
+        )
+    run.last_account_id = last_id
+    run.accounts_credited += len(credits)
+    run.total_interest += total
+    return len(credits)
+
+
+def interest_rates():
+    return {account_type: Decimal(rate) for account_type, rate in settings.INTEREST_RATES.items() if rate}
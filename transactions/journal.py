@@ -0,0 +1,121 @@
+"""
+Append-only double-entry journal.
+
+Every ledger posting writes one JournalEntry with a debit and a credit line, in the
+same transaction as the balance update. Customer balances are a liability of the
+bank, so a credit on the customer book adds to the account and a debit takes from
+it; the other leg goes to the cash book (deposits, withdrawals), the loans book
+(loans and repayments), the interest expense book (interest paid on savings) or
+the other customer (transfers). The two legs of a transfer between ledger shards
+(transactions/sagas.py) are posted on different databases, each against the
+in-transit book, which nets to zero across the shards once the saga is done.
+
+UserBankAccount.balance is the materialized projection of the customer book: the
+ledger applies each entry to it as it is posted, and journal_balances() recomputes
+it from scratch for verify_journal / rebuild_balances.
+"""
+from django.db.models import Case, F, Sum, When
+
+from .constants import (
+    CASH, CREDIT, CREDIT_TYPES, CUSTOMER, DEBIT, DEPOSIT, EQUITY, INTEREST, INTEREST_EXPENSE,
+    LOAN, LOAN_PAID, LOANS, RECEIVE_MONEY, TRANSFER_MONEY, TRANSFER_REVERSAL, TRANSIT, WITHDRAWAL,
+)
+from .models import JournalEntry, JournalLine
+
+CONTRA_BOOKS = {
+    DEPOSIT: CASH,
+    WITHDRAWAL: CASH,
+    LOAN: LOANS,
+    LOAN_PAID: LOANS,
+    INTEREST: INTEREST_EXPENSE,
+    # the halves of a transfer between shards, posted without a counterparty
+    TRANSFER_MONEY: TRANSIT,
+    RECEIVE_MONEY: TRANSIT,
+    TRANSFER_REVERSAL: TRANSIT,
+    None: EQUITY,  # opening balances
+}
+
+
+def legs(transaction_type, amount, account_id, counterparty_id=None):
+    """The customer line of a posting and its contra line. Transfers pass the receiver as counterparty."""
+    side = CREDIT if transaction_type in CREDIT_TYPES or transaction_type is None else DEBIT
+    other = DEBIT if side == CREDIT else CREDIT
+    lines = [JournalLine(book=CUSTOMER, account_id=account_id, side=side, amount=amount)]
+    if transaction_type in (TRANSFER_MONEY, RECEIVE_MONEY) and counterparty_id is not None:
+        lines.append(JournalLine(book=CUSTOMER, account_id=counterparty_id, side=other, amount=amount))
+    else:
+        lines.append(JournalLine(book=CONTRA_BOOKS[transaction_type], side=other, amount=amount))
+    return lines
+
+
+def post(postings):
+    """
+    postings is a list of (transaction_type, amount, account_id, counterparty_id),
+    written as one entry each with two bulk inserts. Call it inside the posting's
+    transaction.
+    """
+    entries = JournalEntry.objects.bulk_create(
+        [JournalEntry(transaction_type=transaction_type) for transaction_type, _, _, _ in postings], batch_size=1000
+    )
+    lines = []
+    for entry, posting in zip(entries, postings):
+        for line in legs(*posting):
+            line.entry = entry
+            lines.append(line)
+    JournalLine.objects.bulk_create(lines, batch_size=1000)
+    return entries
+
+
+def record(transaction_type, amount, account_id, counterparty_id=None):
+    return post([(transaction_type, amount, account_id, counterparty_id)])[0]
+
+
+def signed_amount():
+    # the customer book's point of view: credits add, debits subtract
+    return Sum(Case(When(side=CREDIT, then=F('amount')), default=-F('amount')))
+
+
+def journal_balances(chunk_size=5000):
+    """
+    (account_id, balance) for every account with customer lines, ordered by account id.
+    The database sums the lines in one scan and the rows are streamed, so memory doesn't
+    grow with the size of the journal.
+    """
+    return (
+        JournalLine.objects.filter(book=CUSTOMER)
+        .values('account_id')
+        .annotate(balance=signed_amount())
+        .order_by('account_id')
+        .values_list('account_id', 'balance')
+        .iterator(chunk_size=chunk_size)
+    )
+
+
+def unbalanced_entries():
+    """Entries whose debits and credits don't add up, there should never be any."""
+    return (
+        JournalLine.objects.values('entry_id')
+        .annotate(net=signed_amount())
+        .exclude(net=0)
+        .order_by('entry_id')
+        .values_list('entry_id', 'net')
+    )
+
+
+def compare(accounts, chunk_size=5000):
+    """
+    Merge the stored balances with the journal, both streamed in account id order.
+    Yields (account_id, stored, from_journal) for every account that disagrees.
+    """
+    journal = journal_balances(chunk_size)
+    pending = next(journal, None)
+    for account_id, stored in accounts.order_by('pk').values_list('pk', 'balance').iterator(chunk_size=chunk_size):
+        while pending is not None and pending[0] < account_id:
+            # the lines of a deleted account, the journal keeps them
+            pending = next(journal, None)
+        expected = 0
+        if pending is not None and pending[0] == account_id:
+            expected = pending[1]
+            pending = next(journal, None)
+        if stored != expected:
+            yield account_id, stored, expected
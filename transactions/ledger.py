@@ -0,0 +1,450 @@
+"""
+All balance changes go through here. Each posting is a conditional
+UPDATE ... SET balance = balance +/- amount inside transaction.atomic, so
+concurrent requests can't overwrite each other's balance. Transfers touch the
+lower account id first so two opposite transfers can't deadlock. Every posting is
+also appended to the double-entry journal (transactions/journal.py) in the same
+transaction.
+
+The transactions are opened on the account's ledger shard (core/sharding.py), the
+functions taking many accounts work on the current shard. transfer() needs both
+accounts on one shard, transactions/sagas.py moves money between shards.
+"""
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db.models import Case, F, Value, When
+
+from accounts.directory import attach_users
+from accounts.models import UserBankAccount
+from core import sharding
+from .constants import DEPOSIT, WITHDRAWAL, LOAN, LOAN_PAID, RECEIVE_MONEY, TRANSFER_MONEY
+from .models import Transaction
+from . import journal, report, snapshots
+
+
+class LedgerError(Exception):
+    pass
+
+
+class InsufficientFunds(LedgerError):
+    pass
+
+
+class InvalidPosting(LedgerError):
+    pass
+
+
+def _balance(account_id):
+    return UserBankAccount.objects.filter(pk=account_id).values_list('balance', flat=True).get()
+
+
+def _credit(account_id, amount, **also):
+    UserBankAccount.objects.filter(pk=account_id).update(balance=F('balance') + amount, **also)
+    return _balance(account_id)
+
+
+def _debit(account_id, amount, **also):
+    # the balance check is part of the UPDATE, so two withdrawals can't both pass it
+    updated = UserBankAccount.objects.filter(pk=account_id, balance__gte=amount).update(
+        balance=F('balance') - amount, **also
+    )
+    if not updated:
+        raise InsufficientFunds(
+            f'You have {_balance(account_id)} $ in your account. '
+            'You can not spend more than your account balance'
+        )
+    return _balance(account_id)
+
+
+def _check_amount(amount):
+    if amount is None or amount <= 0:
+        raise InvalidPosting('Amount must be greater than zero')
+
+
+def deposit(account, amount, transaction_type=DEPOSIT):
+    _check_amount(amount)
+    with sharding.atomic(account):
+        balance = _credit(account.pk, amount)
+        journal.record(transaction_type, amount, account.pk)
+        Transaction.objects.create(
+            account=account,
+            amount=amount,
+            balance_after_transaction=balance,
+            transaction_type=transaction_type,
+        )
+        snapshots.record(account.pk, transaction_type, amount, balance)
+    account.balance = balance
+    return balance
+
+
+def withdraw(account, amount, transaction_type=WITHDRAWAL):
+    _check_amount(amount)
+    with sharding.atomic(account):
+        balance = _debit(account.pk, amount)
+        journal.record(transaction_type, amount, account.pk)
+        Transaction.objects.create(
+            account=account,
+            amount=amount,
+            balance_after_transaction=balance,
+            transaction_type=transaction_type,
+        )
+        snapshots.record(account.pk, transaction_type, amount, balance)
+    account.balance = balance
+    return balance
+
+
+def transfer(sender, receiver, amount):
+    """Move amount from sender to receiver, returns the sender's new balance."""
+    _check_amount(amount)
+    if sender.pk == receiver.pk:
+        raise InvalidPosting('You can not transfer money to your own account')
+    if not sharding.same_shard(sender, receiver):
+        raise InvalidPosting('The accounts are on different ledger shards, see transactions/sagas.py')
+
+    with sharding.atomic(sender):
+        balances = {}
+        # lock both rows in id order
+        for account in sorted((sender, receiver), key=lambda a: a.pk):
+            if account is sender:
+                balances[account.pk] = _debit(account.pk, amount)
+            else:
+                balances[account.pk] = _credit(account.pk, amount)
+        journal.record(TRANSFER_MONEY, amount, sender.pk, receiver.pk)
+        Transaction.objects.bulk_create([
+            Transaction(
+                account=sender,
+                amount=amount,
+                balance_after_transaction=balances[sender.pk],
+                transaction_type=TRANSFER_MONEY,
+            ),
+            Transaction(
+                account=receiver,
+                amount=amount,
+                balance_after_transaction=balances[receiver.pk],
+                transaction_type=RECEIVE_MONEY,
+            ),
+        ])
+        snapshots.record_many([
+            (sender.pk, TRANSFER_MONEY, amount, balances[sender.pk]),
+            (receiver.pk, RECEIVE_MONEY, amount, balances[receiver.pk]),
+        ])
+    sender.balance = balances[sender.pk]
+    receiver.balance = balances[receiver.pk]
+    return sender.balance
+
+
+def _lock_many(ids, chunk_size):
+    """Lock the account rows in id order, returns {account_id: balance}."""
+    balances = {}
+    for start in range(0, len(ids), chunk_size):
+        balances.update(
+            UserBankAccount.objects.select_for_update().filter(pk__in=ids[start:start + chunk_size])
+            .order_by('pk').values_list('pk', 'balance')
+        )
+    return balances
+
+
+def _case(values, chunk, field):
+    return Case(
+        *[When(pk=pk, then=Value(values[pk])) for pk in chunk],
+        output_field=UserBankAccount._meta.get_field(field),
+    )
+
+
+def _credit_many(credits, chunk_size, **also):
+    """
+    credits is {account_id: amount}, applied as one CASE update per chunk. also
+    gives other fields to add to the same way, as {account_id: delta} per field.
+    """
+    ids = sorted(credits)
+    for start in range(0, len(ids), chunk_size):
+        chunk = ids[start:start + chunk_size]
+        UserBankAccount.objects.filter(pk__in=chunk).update(
+            balance=F('balance') + _case(credits, chunk, 'balance'),
+            **{field: F(field) + _case(deltas, chunk, field) for field, deltas in also.items()},
+        )
+
+
+def bulk_transfer(sender, lines, chunk_size=500):
+    """
+    Pay many receivers from one sender in a single transaction.
+
+    lines is a list of (line_no, receiver, amount). Lines are accepted in order
+    while the sender can cover them, the rest are returned as rejected.
+    Returns (sender_balance, accepted, rejected) where rejected holds
+    (line_no, reason) pairs. The receivers have to be on the sender's shard.
+    """
+    with sharding.atomic(sender):
+        available = _balance(sender.pk)
+        accepted, rejected = [], []
+        for line_no, receiver, amount in lines:
+            if amount is None or amount <= 0:
+                rejected.append((line_no, 'Amount must be greater than zero'))
+            elif receiver.pk == sender.pk:
+                rejected.append((line_no, 'You can not transfer money to your own account'))
+            elif amount > available:
+                rejected.append((line_no, 'Insufficient balance'))
+            else:
+                available -= amount
+                accepted.append((line_no, receiver, amount))
+        if not accepted:
+            return available, accepted, rejected
+
+        credits = defaultdict(Decimal)
+        for line_no, receiver, amount in accepted:
+            credits[receiver.pk] += amount
+        total = sum(credits.values())
+
+        # same id ordering as transfer(): rows below the sender, the sender, rows above it
+        _credit_many({pk: amount for pk, amount in credits.items() if pk < sender.pk}, chunk_size)
+        sender_balance = _debit(sender.pk, total)
+        _credit_many({pk: amount for pk, amount in credits.items() if pk > sender.pk}, chunk_size)
+
+        running = {}
+        ids = list(credits)
+        for start in range(0, len(ids), chunk_size):
+            balances = UserBankAccount.objects.filter(pk__in=ids[start:start + chunk_size]).values_list('pk', 'balance')
+            for pk, balance in balances:
+                running[pk] = balance - credits[pk]
+        sender_running = sender_balance + total
+
+        rows, postings = [], []
+        for line_no, receiver, amount in accepted:
+            sender_running -= amount
+            running[receiver.pk] += amount
+            receiver.balance = running[receiver.pk]
+            rows.append(Transaction(
+                account=sender,
+                amount=amount,
+                balance_after_transaction=sender_running,
+                transaction_type=TRANSFER_MONEY,
+            ))
+            rows.append(Transaction(
+                account=receiver,
+                amount=amount,
+                balance_after_transaction=running[receiver.pk],
+                transaction_type=RECEIVE_MONEY,
+            ))
+            postings.append((receiver.pk, RECEIVE_MONEY, amount, running[receiver.pk]))
+        postings.append((sender.pk, TRANSFER_MONEY, total, sender_balance))
+        Transaction.objects.bulk_create(rows, batch_size=1000)
+        journal.post([(TRANSFER_MONEY, amount, sender.pk, receiver.pk) for _, receiver, amount in accepted])
+        snapshots.record_many(postings)
+    sender.balance = sender_balance
+    return sender_balance, accepted, rejected
+
+
+def transfer_many(transfers, chunk_size=500):
+    """
+    Many independent transfers in a single transaction, for the standing orders.
+
+    transfers is a list of (key, sender, receiver, amount), applied in order the way
+    transfer() would apply them one by one: a transfer the sender can't cover at that
+    point is rejected. The rows of every account involved are locked in id order up
+    front, so the checks run against the locked balances and the balances are written
+    with one CASE update per chunk. Returns (accepted, rejected), accepted being the
+    (key, sender, receiver, amount) that were posted and rejected (key, reason) pairs.
+    The sender and receiver instances get the balance right after their transfer.
+
+    The transaction is on the first sender's shard, a transfer with an account on any
+    other shard is rejected (sagas.transfer() moves money between shards).
+    """
+    if not transfers:
+        return [], []
+    shard = sharding.shard_of(transfers[0][1])
+    accepted, rejected = [], []
+    local = []
+    for key, sender, receiver, amount in transfers:
+        if sharding.shard_of(sender) == sharding.shard_of(receiver) == shard:
+            local.append((key, sender, receiver, amount))
+        else:
+            rejected.append((key, 'The accounts are not on the ledger shard of this batch'))
+    with sharding.atomic(transfers[0][1]):
+        ids = sorted({account.pk for _, sender, receiver, _ in local for account in (sender, receiver)})
+        balances = _lock_many(ids, chunk_size)
+        opening = dict(balances)
+
+        rows, postings = [], []
+        for key, sender, receiver, amount in local:
+            if amount is None or amount <= 0:
+                rejected.append((key, 'Amount must be greater than zero'))
+                continue
+            if sender.pk == receiver.pk:
+                rejected.append((key, 'You can not transfer money to your own account'))
+                continue
+            if balances[sender.pk] < amount:
+                rejected.append((key, (
+                    f'You have {balances[sender.pk]} $ in your account. '
+                    'You can not spend more than your account balance'
+                )))
+                continue
+            balances[sender.pk] -= amount
+            balances[receiver.pk] += amount
+            sender.balance = balances[sender.pk]
+            receiver.balance = balances[receiver.pk]
+            accepted.append((key, sender, receiver, amount))
+            rows.append(Transaction(
+                account=sender, amount=amount, balance_after_transaction=sender.balance, transaction_type=TRANSFER_MONEY,
+            ))
+            rows.append(Transaction(
+                account=receiver, amount=amount, balance_after_transaction=receiver.balance, transaction_type=RECEIVE_MONEY,
+            ))
+            postings.append((sender.pk, TRANSFER_MONEY, amount, sender.balance))
+            postings.append((receiver.pk, RECEIVE_MONEY, amount, receiver.balance))
+        if not accepted:
+            return accepted, rejected
+
+        # deltas rather than the new values, same CASE update as bulk_transfer's credits
+        _credit_many({pk: balances[pk] - opening[pk] for pk in ids if balances[pk] != opening[pk]}, chunk_size)
+        if UserBankAccount.objects.filter(pk__in=ids, balance__lt=0).exists():
+            # only possible where select_for_update locks nothing, the whole batch is rolled back
+            raise InsufficientFunds('A balance changed while the transfers were being posted')
+        Transaction.objects.bulk_create(rows, batch_size=1000)
+        journal.post([(TRANSFER_MONEY, amount, sender.pk, receiver.pk) for _, sender, receiver, amount in accepted])
+        snapshots.record_many(postings)
+    return accepted, rejected
+
+
+def credit_many(transaction_type, credits, chunk_size=500):
+    """
+    Credit many accounts at once (interest). credits is {account_id: amount}; returns
+    {account_id: new balance}. One Transaction, journal entry and snapshot change per
+    account, all written in bulk. The accounts are those on the current shard, ids
+    that aren't there are left out like closed accounts (interest runs shard by shard).
+    """
+    with sharding.atomic():
+        ids = sorted(pk for pk, amount in credits.items() if amount > 0)
+        balances = _lock_many(ids, chunk_size)
+        ids = [pk for pk in ids if pk in balances]  # closed since the credits were worked out
+        if not ids:
+            return {}
+        _credit_many({pk: credits[pk] for pk in ids}, chunk_size)
+        balances = {pk: balances[pk] + credits[pk] for pk in ids}
+        Transaction.objects.bulk_create([
+            Transaction(
+                account_id=pk,
+                amount=credits[pk],
+                balance_after_transaction=balances[pk],
+                transaction_type=transaction_type,
+            )
+            for pk in ids
+        ], batch_size=1000)
+        journal.post([(transaction_type, credits[pk], pk, None) for pk in ids])
+        snapshots.record_many([(pk, transaction_type, credits[pk], balances[pk]) for pk in ids])
+    return balances
+
+
+def disburse_loan(loan):
+    """Credit an approved loan to its account, re-saving an already approved loan credits nothing."""
+    _check_amount(loan.amount)
+    account = loan.account
+    with sharding.atomic(account):
+        already_approved = loan.pk and Transaction.objects.select_for_update().filter(
+            pk=loan.pk
+        ).values_list('loan_approve', flat=True).first()
+        if already_approved:
+            balance = _balance(account.pk)
+        else:
+            balance = _credit(
+                account.pk,
+                loan.amount,
+                active_loans=F('active_loans') + 1,
+                outstanding_loan=F('outstanding_loan') + loan.amount,
+            )
+            account.active_loans += 1
+            account.outstanding_loan += loan.amount
+            loan.balance_after_transaction = balance
+            journal.record(LOAN, loan.amount, account.pk)
+            snapshots.record(account.pk, LOAN, loan.amount, balance)
+            report.expire([account.pk])  # the loan row's balance was in the report already
+        loan.loan_approve = True
+        loan.save()
+    account.balance = balance
+    return balance
+
+
+def _account_and_user():
+    # the users are on 'default', a shard's loans can only be joined with their accounts
+    return 'account' if sharding.enabled() else 'account__user'
+
+
+def approve_loans(loan_ids, chunk_size=500):
+    """
+    Approve many pending loans at once, crediting each the way disburse_loan does.
+    The accounts are locked in id order and written with one CASE update per chunk,
+    the loans with one bulk update. Ids that aren't pending loans any more (already
+    approved, rejected, or not a loan) are skipped. Returns the approved loans, their
+    account instances carry the new balance.
+    """
+    with sharding.atomic():
+        loans = list(
+            Transaction.objects.select_for_update(of=('self',))
+            .filter(pk__in=loan_ids, transaction_type=LOAN, loan_approve=False, loan_rejected=False, amount__gt=0)
+            .select_related(_account_and_user()).order_by('pk')
+        )
+        attach_users(loan.account for loan in loans)
+        if not loans:
+            return loans
+        amounts, counts = defaultdict(Decimal), defaultdict(int)
+        for loan in loans:
+            amounts[loan.account_id] += loan.amount
+            counts[loan.account_id] += 1
+        balances = _lock_many(sorted(amounts), chunk_size)
+        _credit_many(amounts, chunk_size, outstanding_loan=amounts, active_loans=counts)
+
+        for loan in loans:
+            balances[loan.account_id] += loan.amount
+            loan.balance_after_transaction = balances[loan.account_id]
+            loan.loan_approve = True
+        Transaction.objects.bulk_update(loans, ['loan_approve', 'balance_after_transaction'], batch_size=chunk_size)
+        journal.post([(LOAN, loan.amount, loan.account_id, None) for loan in loans])
+        snapshots.record_many([(loan.account_id, LOAN, loan.amount, loan.balance_after_transaction) for loan in loans])
+        report.expire(amounts)
+    for loan in loans:
+        # each loan has its own account instance, all of them get the final figures
+        loan.account.balance = balances[loan.account_id]
+        loan.account.active_loans += counts[loan.account_id]
+        loan.account.outstanding_loan += amounts[loan.account_id]
+    return loans
+
+
+def reject_loans(loan_ids):
+    """Mark pending loans as rejected, nothing is posted. Returns the rejected loans."""
+    with sharding.atomic():
+        loans = list(
+            Transaction.objects.select_for_update(of=('self',))
+            .filter(pk__in=loan_ids, transaction_type=LOAN, loan_approve=False, loan_rejected=False)
+            .select_related(_account_and_user()).order_by('pk')
+        )
+        attach_users(loan.account for loan in loans)
+        Transaction.objects.filter(pk__in=[loan.pk for loan in loans]).update(loan_rejected=True)
+        report.expire({loan.account_id for loan in loans})  # cached pages show these rows as pending
+    for loan in loans:
+        loan.loan_rejected = True
+    return loans
+
+
+def repay_loan(loan):
+    account = loan.account
+    with sharding.atomic(account):
+        # the loan row is locked so a double click can't pay it twice
+        loan = Transaction.objects.select_for_update().get(pk=loan.pk)
+        if loan.transaction_type != LOAN or not loan.loan_approve:
+            raise InvalidPosting('This loan is not approved or already paid')
+        balance = _debit(
+            account.pk,
+            loan.amount,
+            active_loans=F('active_loans') - 1,
+            outstanding_loan=F('outstanding_loan') - loan.amount,
+        )
+        account.active_loans -= 1
+        account.outstanding_loan -= loan.amount
+        journal.record(LOAN_PAID, loan.amount, account.pk)
+        snapshots.record(account.pk, LOAN_PAID, loan.amount, balance)
+        loan.balance_after_transaction = balance
+        loan.transaction_type = LOAN_PAID
+        loan.save(update_fields=['balance_after_transaction', 'transaction_type'])
+        report.expire([account.pk])
+    account.balance = balance
+    return balance
@@ -0,0 +1,64 @@
+"""
+Daily withdrawal and transfer caps (DAILY_LIMITS), counted in the cache by
+core.ratelimit.Quota, so checking one never sums the account's Transactions.
+"""
+from contextlib import contextmanager
+from decimal import Decimal
+
+from django.conf import settings
+
+from core.ratelimit import Quota
+from .ledger import LedgerError
+
+NAMES = {'withdraw': 'withdrawal', 'transfer': 'transfer', 'bulk_transfer': 'bulk transfer'}
+
+
+class DailyLimitExceeded(LedgerError):
+    pass
+
+
+def _cents(amount):
+    return int(Decimal(amount) * 100)
+
+
+def quota(kind):
+    cap = getattr(settings, 'DAILY_LIMITS', {}).get(kind)
+    if cap is None:
+        return None
+    return Quota(f'daily:{kind}', _cents(cap))
+
+
+class Reservation:
+    def __init__(self, daily, key):
+        self.daily = daily
+        self.key = key
+
+    def refund(self, amount):
+        if self.key is not None:
+            self.daily.refund(self.key, _cents(amount))
+
+
+def take(kind, account, amount):
+    """Take amount out of the account's daily allowance, raises DailyLimitExceeded when it doesn't fit."""
+    daily = quota(kind)
+    if daily is None:
+        return Reservation(None, None)
+    key, total = daily.consume(account.pk, _cents(amount))
+    if key is None:
+        left = Decimal(max(daily.cap - total, 0)) / 100
+        raise DailyLimitExceeded(
+            f'Your daily {NAMES[kind]} limit is {Decimal(daily.cap) / 100} $, '
+            f'{left} $ of it is left for now'
+        )
+    return Reservation(daily, key)
+
+
+@contextmanager
+def reserve(kind, account, amount):
+    """take() for the duration of a posting, the amount is given back if the block raises."""
+    reservation = take(kind, account, amount)
+    try:
+        yield reservation
+    except BaseException:
+        reservation.refund(amount)
+        raise
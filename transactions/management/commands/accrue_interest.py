@@ -0,0 +1,69 @@
+import time
+from datetime import datetime
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core import sharding
+from transactions import interest
+
+
+class Command(BaseCommand):
+    help = (
+        'Credit a month of interest to every savings account from its daily balances. '
+        'Safe to run again after a crash, it carries on after the last chunk it posted.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--month', help='YYYY-MM, defaults to last month')
+        parser.add_argument('--chunk-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        if options['month']:
+            try:
+                period = datetime.strptime(options['month'], '%Y-%m').date()
+            except ValueError:
+                raise CommandError('--month must look like 2026-09')
+        else:
+            period = interest.previous_month()
+        rates = interest.interest_rates()
+        if not rates:
+            raise CommandError('INTEREST_RATES has no account type with a rate')
+
+        started = time.perf_counter()
+        accounts, total = 0, Decimal(0)
+        for alias in sharding.shards():
+            with sharding.on(alias):
+                run = self.accrue(period, rates, options['chunk_size'], started)
+            accounts += run.accounts_credited
+            total += run.total_interest
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Interest for {period:%B %Y}: {accounts} accounts paid {total} $ '
+            f'in {time.perf_counter() - started:.1f}s'
+        ))
+
+    def accrue(self, period, rates, chunk_size, started):
+        # one shard's run, started or carried on
+        try:
+            run = interest.start_run(period)
+        except ValueError as e:
+            raise CommandError(str(e))
+        if run.finished:
+            return run
+        if run.last_account_id:
+            self.stderr.write(f'Resuming after account {run.last_account_id}')
+
+        chunks = 0
+        while True:
+            try:
+                credited = interest.run_chunk(run, rates, chunk_size)
+            except interest.InterestRunConflict as e:
+                raise CommandError(str(e))
+            if credited is None:
+                return run
+            chunks += 1
+            if chunks % 20 == 0:
+                self.stderr.write(
+                    f'{chunks} chunks, up to account {run.last_account_id}, {time.perf_counter() - started:.0f}s'
+                )
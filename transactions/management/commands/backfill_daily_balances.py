@@ -0,0 +1,80 @@
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from accounts.directory import find_account
+from core import sharding
+from transactions.constants import CREDIT_TYPES, DEBIT_TYPES, LOAN, LOAN_PAID
+from transactions.models import DailyBalance, Transaction
+from transactions.snapshots import TOTAL_FIELDS, signed
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the daily balance snapshots from the transaction history in one streaming pass'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--account-no', type=int, help='only rebuild this account')
+        parser.add_argument('--chunk-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        if options['account_no']:
+            account = find_account(options['account_no'])
+            if account is None:
+                raise CommandError(f"No account found with account no {options['account_no']}")
+            with sharding.on(sharding.shard_of(account)):
+                count = self.backfill(options['chunk_size'], account)
+        else:
+            count = 0
+            for alias in sharding.shards():
+                # the snapshots are kept on the shard of their account
+                with sharding.on(alias):
+                    count += self.backfill(options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(f'Wrote {count} daily balance rows'))
+
+    def backfill(self, chunk_size, account=None):
+        # the current shard's accounts, or only that one, returns how many rows were written
+        rows = Transaction.objects.filter(transaction_type__in=CREDIT_TYPES + DEBIT_TYPES)
+        snapshots = DailyBalance.objects.all()
+        if account is not None:
+            rows = rows.filter(account_id=account.pk)
+            snapshots = snapshots.filter(account_id=account.pk)
+        rows = rows.order_by('account_id', 'timestamp', 'id').values_list(
+            'account_id', 'timestamp', 'transaction_type', 'amount', 'loan_approve'
+        )
+
+        pending = []
+        count = 0
+
+        def flush():
+            nonlocal count
+            DailyBalance.objects.bulk_create(pending, batch_size=1000)
+            count += len(pending)
+            pending.clear()
+
+        with sharding.atomic():
+            snapshots.delete()
+            current, balance = None, Decimal(0)
+            for account_id, timestamp, transaction_type, amount, loan_approve in rows.iterator(chunk_size=chunk_size):
+                if transaction_type == LOAN and not loan_approve:
+                    continue  # a pending loan request never touched the balance
+                day = timezone.localdate(timestamp)
+                if current is None or current.account_id != account_id:
+                    balance = Decimal(0)
+                if current is None or current.account_id != account_id or current.date != day:
+                    current = DailyBalance(account_id=account_id, date=day, opening_balance=balance, closing_balance=balance)
+                    pending.append(current)
+                # repay_loan turns the loan's own row into LOAN_PAID, that row stands for
+                # the loan being credited and then paid back
+                for posted in ((LOAN, LOAN_PAID) if transaction_type == LOAN_PAID else (transaction_type,)):
+                    balance += signed(posted, amount)
+                    field = TOTAL_FIELDS[posted]
+                    setattr(current, field, getattr(current, field) + amount)
+                current.closing_balance = balance
+                if len(pending) > chunk_size:
+                    # keep the day still being filled for the next chunk
+                    pending.remove(current)
+                    flush()
+                    pending.append(current)
+            flush()
+        return count
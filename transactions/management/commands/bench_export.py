@@ -0,0 +1,61 @@
+import json
+import resource
+import time
+import tracemalloc
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test import RequestFactory
+
+from core import sharding
+from core.benchmark import bench_account, seed_transactions
+from transactions.models import Transaction
+from transactions.views import export_transactions
+
+
+class Command(BaseCommand):
+    help = 'Stream a full statement export of a large account and fail if memory use passes a ceiling'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1_000_000)
+        parser.add_argument('--format', choices=['csv', 'jsonl'], default='csv')
+        parser.add_argument('--max-mb', type=float, default=64, help='ceiling for the Python heap peak while exporting')
+
+    def handle(self, *args, **options):
+        account = bench_account('bench_report')
+        # its transactions are on its shard
+        with sharding.on(sharding.shard_of(account)):
+            self.bench(account, options)
+
+    def bench(self, account, options):
+        existing = Transaction.objects.filter(account=account).count()
+        if existing < options['rows']:
+            self.stderr.write(f"Seeding {options['rows'] - existing} transactions...")
+            seed_transactions(account, options['rows'] - existing)
+
+        request = RequestFactory().get('/transactions/report/export/', {'format': options['format']})
+        request.user = account.user
+
+        rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        tracemalloc.start()
+        start = time.perf_counter()
+        response = export_transactions(request)
+        lines = size = 0
+        for chunk in response.streaming_content:
+            lines += 1
+            size += len(chunk)
+        elapsed = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        peak_mb = peak / 1024 / 1024
+        self.stdout.write(json.dumps({
+            'format': options['format'],
+            'lines': lines,
+            'megabytes_streamed': round(size / 1024 / 1024, 1),
+            'seconds': round(elapsed, 2),
+            'heap_peak_mb': round(peak_mb, 1),
+            # ru_maxrss is KB on Linux and only ever grows, so this is the increase over seeding
+            'max_rss_growth_mb': round((resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss_before) / 1024, 1),
+        }, indent=2))
+        if peak_mb > options['max_mb']:
+            raise CommandError(f"Export peaked at {peak_mb:.1f} MB, over the {options['max_mb']} MB ceiling")
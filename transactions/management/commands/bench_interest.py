@@ -0,0 +1,106 @@
+import json
+import random
+import time
+from datetime import date, timedelta
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Count
+
+from accounts.models import UserBankAccount
+from core import sharding
+from core.benchmark import bench_accounts, by_shard, fund, seed_users
+from transactions import interest, journal
+from transactions.constants import INTEREST
+from transactions.models import DailyBalance, InterestRun, Transaction
+
+
+class Command(BaseCommand):
+    help = (
+        'Seed savings accounts with a month of daily balances, accrue interest for it, '
+        'stopping after the first chunk and resuming like after a crash, and check that '
+        'no account was paid twice and the journal still agrees'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--accounts', type=int, default=20_000)
+        parser.add_argument('--chunk-size', type=int, default=5000)
+        # a month long before any real activity, so only the seeded accounts have history in it
+        parser.add_argument('--month', default='2000-01')
+        parser.add_argument('--prefix', default='bench_interest')
+
+    def seed_history(self, accounts, start, end):
+        rng = random.Random(1)
+        rows = []
+        for account in accounts:
+            balance = Decimal(rng.randint(0, 100_000))
+            rows.append(DailyBalance(
+                account=account, date=start - timedelta(days=1), opening_balance=balance, closing_balance=balance,
+            ))
+            for day in sorted(rng.sample(range((end - start).days), 3)):
+                opening, balance = balance, balance + rng.randint(-500, 2000)
+                rows.append(DailyBalance(
+                    account=account, date=start + timedelta(days=day), opening_balance=opening, closing_balance=balance,
+                ))
+        DailyBalance.objects.bulk_create(rows, batch_size=5000)
+
+    def handle(self, *args, **options):
+        period = date.fromisoformat(options['month'] + '-01')
+        start, end = interest.month_bounds(period)
+        accounts = bench_accounts(options['prefix'])
+        if len(accounts) < options['accounts']:
+            self.stderr.write(f"Seeding {options['accounts'] - len(accounts)} accounts...")
+            created = seed_users(options['accounts'] - len(accounts), 'bench-password', prefix=options['prefix'])
+            fund(created, Decimal(1000))
+            for alias, group in by_shard(created).items():
+                with sharding.on(alias):
+                    self.seed_history(group, start, end)
+            accounts += created
+
+        rates = interest.interest_rates()
+        credited, total, problems = 0, Decimal(0), []
+        started = time.perf_counter()
+        for alias, group in by_shard(accounts).items():
+            # every shard has a run of its own
+            with sharding.on(alias):
+                run, shard_problems = self.accrue(period, rates, options['chunk_size'], [account.pk for account in group])
+            credited += run.accounts_credited
+            total += run.total_interest
+            problems += [f'{alias}: {problem}' for problem in shard_problems]
+        elapsed = time.perf_counter() - started
+
+        self.stdout.write(json.dumps({
+            'accounts': len(accounts),
+            'credited': credited,
+            'total_interest': str(total),
+            'seconds': round(elapsed, 2),
+            'accounts_per_second': round(credited / elapsed, 1) if elapsed else None,
+        }, indent=2))
+        if problems:
+            raise CommandError('; '.join(problems))
+        self.stdout.write(self.style.SUCCESS('Every account paid once across the resume, no balance drift'))
+
+    def accrue(self, period, rates, chunk_size, ids):
+        # the current shard's run, stopped after one chunk and resumed, with what went wrong
+        # the bench month is paid again on every run, the old run row is bench data
+        InterestRun.objects.filter(period=period).delete()
+        before = Transaction.objects.filter(transaction_type=INTEREST).order_by('-id').values_list('id', flat=True).first() or 0
+
+        run = interest.start_run(period)
+        interest.run_chunk(run, rates, chunk_size)
+        # what the command sees when it is started again after dying here
+        run = InterestRun.objects.get(pk=run.pk)
+        while interest.run_chunk(run, rates, chunk_size) is not None:
+            pass
+
+        paid = Transaction.objects.filter(transaction_type=INTEREST, id__gt=before)
+        twice = paid.values('account_id').annotate(n=Count('id')).filter(n__gt=1).count()
+        drifted = list(journal.compare(UserBankAccount.objects.filter(pk__in=ids)))
+        problems = []
+        if paid.count() != run.accounts_credited:
+            problems.append(f'{paid.count()} interest postings but the run counted {run.accounts_credited}')
+        if twice:
+            problems.append(f'{twice} accounts were paid more than once')
+        if drifted:
+            problems.append(f'balances disagree with the journal: {drifted[:10]}')
+        return run, problems
@@ -0,0 +1,63 @@
+import json
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from core import sharding
+from core.benchmark import bench_account, seed_transactions, summarize, timed
+from transactions.models import Transaction
+from transactions.pagination import date_range, encode_cursor, keyset_page
+
+
+class Command(BaseCommand):
+    help = (
+        'Seed one account with many transactions and compare the old report query with the '
+        'indexed keyset one. Run it once with `migrate transactions 0002` applied to see the '
+        'plans without the composite indexes.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1_000_000)
+        parser.add_argument('--days', type=int, default=3650, help='history length the rows are spread over')
+        parser.add_argument('--range-days', type=int, default=90, help='size of the filtered date range')
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+        account = bench_account('bench_report')
+        # its transactions are on its shard
+        with sharding.on(sharding.shard_of(account)):
+            self.bench(account, options)
+
+    def bench(self, account, options):
+        existing = Transaction.objects.filter(account=account).count()
+        if existing < options['rows']:
+            self.stderr.write(f"Seeding {options['rows'] - existing} transactions...")
+            seed_transactions(account, options['rows'] - existing, days=options['days'])
+
+        end_date = timezone.now().date()
+        start_date = end_date - timedelta(days=options['range_days'])
+        start, end = date_range(start_date, end_date)
+
+        before = Transaction.objects.filter(
+            account=account, timestamp__date__gte=start_date, timestamp__date__lte=end_date
+        ).distinct()
+        after = Transaction.objects.filter(account=account, timestamp__gte=start, timestamp__lt=end)
+
+        rows, before_ms = timed(lambda: list(before.all()), options['repeat'])
+        _, after_ms = timed(lambda: keyset_page(after), options['repeat'])
+        middle = rows[len(rows) // 2] if rows else None
+        deep_cursor = encode_cursor(middle.timestamp, middle.id) if middle else None
+        _, deep_ms = timed(lambda: keyset_page(after, deep_cursor), options['repeat'])
+
+        self.stdout.write('-- before: timestamp__date range, distinct, whole list')
+        self.stdout.write(before.explain())
+        self.stdout.write('-- after: half-open timestamp range, keyset page')
+        self.stdout.write(after.order_by('timestamp', 'id')[:51].explain())
+        self.stdout.write(json.dumps({
+            'rows_in_account': Transaction.objects.filter(account=account).count(),
+            'rows_in_range': len(rows),
+            'before': summarize(before_ms),
+            'after_first_page': summarize(after_ms),
+            'after_middle_page': summarize(deep_ms),
+        }, indent=2))
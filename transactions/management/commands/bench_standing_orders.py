@@ -0,0 +1,109 @@
+import json
+import random
+import threading
+import time
+from collections import defaultdict
+from datetime import timedelta
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.db.models import Count
+from django.utils import timezone
+
+from accounts.models import UserBankAccount
+from core import sharding
+from core.benchmark import bench_accounts, by_shard, fund, seed_users
+from transactions import journal
+from transactions.constants import MONTHLY
+from transactions.models import StandingOrder, StandingOrderRun
+from transactions.standing_orders import drain
+
+
+class Command(BaseCommand):
+    help = (
+        'Create many due standing orders between seeded accounts, drain them with several '
+        'workers and check that every order ran exactly once and the journal still agrees'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--orders', type=int, default=100_000)
+        parser.add_argument('--accounts', type=int, default=1000)
+        parser.add_argument('--workers', type=int, default=4)
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--prefix', default='bench_standing')
+
+    def handle(self, *args, **options):
+        accounts = bench_accounts(options['prefix'])
+        if len(accounts) < options['accounts']:
+            self.stderr.write(f"Seeding {options['accounts'] - len(accounts)} accounts...")
+            created = seed_users(options['accounts'] - len(accounts), 'bench-password', prefix=options['prefix'])
+            fund(created, Decimal(1_000_000))
+            accounts += created
+
+        now = timezone.now()
+        rng = random.Random(1)
+        orders = defaultdict(list)
+        for _ in range(options['orders']):
+            sender, receiver = rng.sample(accounts, 2)
+            # an order is kept on its payer's shard
+            orders[sharding.shard_of(sender)].append(StandingOrder(
+                account=sender, receiver_account_no=receiver.account_no, amount=Decimal(rng.randint(1, 50)),
+                frequency=MONTHLY, starts_at=now - timedelta(minutes=1), next_run_at=now - timedelta(minutes=1),
+            ))
+        ids = {}
+        for alias, group in orders.items():
+            with sharding.on(alias):
+                ids[alias] = [order.pk for order in StandingOrder.objects.bulk_create(group, batch_size=5000)]
+
+        totals = {'succeeded': 0, 'failed': 0}
+        lock = threading.Lock()
+
+        def worker():
+            try:
+                succeeded, failed = drain(options['batch_size'])
+                with lock:
+                    totals['succeeded'] += succeeded
+                    totals['failed'] += failed
+            finally:
+                connections.close_all()
+
+        started = time.perf_counter()
+        threads = [threading.Thread(target=worker) for _ in range(options['workers'])]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        ran = twice = 0
+        drifted = []
+        placed = by_shard(accounts)
+        for alias, order_ids in ids.items():
+            with sharding.on(alias):
+                runs = StandingOrderRun.objects.filter(order_id__in=order_ids)
+                twice += runs.values('order_id').annotate(n=Count('id')).filter(n__gt=1).count()
+                ran += runs.values('order_id').distinct().count()
+                drifted += journal.compare(UserBankAccount.objects.filter(pk__in=[account.pk for account in placed[alias]]))
+                # the runs and postings stay, like the rest of the bench data, only the orders are removed
+                StandingOrder.objects.filter(pk__in=order_ids).update(active=False)
+        count = sum(len(order_ids) for order_ids in ids.values())
+
+        self.stdout.write(json.dumps({
+            'orders': count,
+            'workers': options['workers'],
+            'succeeded': totals['succeeded'],
+            'failed': totals['failed'],
+            'seconds': round(elapsed, 2),
+            'orders_per_second': round(count / elapsed, 1) if elapsed else None,
+        }, indent=2))
+        problems = []
+        if ran != count:
+            problems.append(f'{count - ran} orders never ran')
+        if twice:
+            problems.append(f'{twice} orders ran more than once')
+        if drifted:
+            problems.append(f'balances disagree with the journal: {drifted[:10]}')
+        if problems:
+            raise CommandError('; '.join(problems))
+        self.stdout.write(self.style.SUCCESS('Every order ran exactly once, no balance drift'))
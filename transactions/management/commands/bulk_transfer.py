@@ -0,0 +1,43 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from accounts.directory import find_account
+from transactions import batch, ledger
+
+
+class Command(BaseCommand):
+    help = 'Pay every line of a CSV/JSONL file (account_no, amount) from one sender account'
+
+    def add_arguments(self, parser):
+        parser.add_argument('sender_account_no', type=int)
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=['csv', 'jsonl'], help='defaults to the file extension')
+        parser.add_argument('--report', help='write the per-line results to this JSONL file')
+
+    def handle(self, *args, **options):
+        # on whichever shard it was opened on
+        sender = find_account(options['sender_account_no'])
+        if sender is None:
+            raise CommandError(f"No account found with account no {options['sender_account_no']}")
+
+        fmt = options['format'] or ('jsonl' if options['path'].endswith(('.jsonl', '.ndjson')) else 'csv')
+        with open(options['path'], newline='', encoding='utf-8') as stream:
+            try:
+                balance, results = batch.run_batch(sender, batch.parse_lines(stream, fmt))
+            except ledger.LedgerError as e:
+                raise CommandError(str(e))
+
+        if options['report']:
+            with open(options['report'], 'w', encoding='utf-8') as report:
+                for result in results:
+                    report.write(json.dumps(result) + '\n')
+        else:
+            for result in results:
+                if result['status'] != 'ok':
+                    self.stdout.write(f"line {result['line']}: {result['error']}")
+
+        accepted = sum(1 for result in results if result['status'] == 'ok')
+        self.stdout.write(self.style.SUCCESS(
+            f'{accepted} transfers posted, {len(results) - accepted} rejected, sender balance is now {balance}'
+        ))
@@ -0,0 +1,61 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS
+
+from core import sharding
+from transactions.constants import LOAN
+from transactions.models import Transaction
+from transactions.views import approve_loans_and_notify, reject_loans_and_notify
+
+
+class Command(BaseCommand):
+    help = (
+        'Approve or reject pending loans, the given ids or every pending one. '
+        'Each batch is credited and its mails queued in one transaction'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('loan_ids', nargs='*', type=int)
+        parser.add_argument('--all-pending', action='store_true')
+        parser.add_argument('--reject', action='store_true')
+        parser.add_argument('--batch-size', type=int, default=500)
+        # loan ids are only unique within a ledger shard
+        parser.add_argument('--shard', default=DEFAULT_DB_ALIAS, help='the ledger shard the loan ids are on')
+
+    def handle(self, *args, **options):
+        if bool(options['loan_ids']) == options['all_pending']:
+            raise CommandError('Give either loan ids or --all-pending')
+        if options['shard'] not in sharding.shards():
+            raise CommandError(f"{options['shard']} is not a ledger shard")
+        decide = reject_loans_and_notify if options['reject'] else approve_loans_and_notify
+        if options['loan_ids']:
+            ids = sorted(set(options['loan_ids']))
+            # the ids given are decided all together or not at all
+            with sharding.on(options['shard']):
+                decided, total = self.decide(decide, ids, len(ids))
+        else:
+            ids, decided, total = [], 0, 0
+            for alias in sharding.shards():
+                with sharding.on(alias):
+                    # served by the pending_loan partial index
+                    pending = list(
+                        Transaction.objects.filter(transaction_type=LOAN, loan_approve=False, loan_rejected=False)
+                        .order_by('timestamp').values_list('pk', flat=True)
+                    )
+                    shard_decided, shard_total = self.decide(decide, pending, options['batch_size'])
+                ids += pending
+                decided += shard_decided
+                total += shard_total
+        skipped = len(ids) - decided
+        verb = 'Rejected' if options['reject'] else 'Approved'
+        self.stdout.write(self.style.SUCCESS(
+            f'{verb} {decided} loans for {total} $' + (f', {skipped} were not pending' if skipped else '')
+        ))
+
+    def decide(self, decide, ids, batch_size):
+        # the loans of the current shard, (how many were decided, their total)
+        decided, total = 0, 0
+        for start in range(0, len(ids), batch_size):
+            loans = decide(ids[start:start + batch_size])
+            decided += len(loans)
+            total += sum(loan.amount for loan in loans)
+        return decided, total
@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand
+
+from accounts.models import UserBankAccount
+from core import sharding
+from transactions import journal
+
+
+class Command(BaseCommand):
+    help = 'Reset every balance that disagrees with the journal to the journal\'s value'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=5000)
+        parser.add_argument('--dry-run', action='store_true')
+
+    def handle(self, *args, **options):
+        fixed = 0
+        for alias in sharding.shards():
+            with sharding.on(alias):
+                fixed += self.rebuild(options)
+        verb = 'Would reset' if options['dry_run'] else 'Reset'
+        self.stdout.write(self.style.SUCCESS(f'{verb} {fixed} balances'))
+
+    def rebuild(self, options):
+        fixes = []
+        fixed = 0
+        # the comparison holds no lock, only write accounts nobody is posting to (maintenance window)
+        for account_id, stored, expected in journal.compare(UserBankAccount.objects.all(), options['chunk_size']):
+            self.stdout.write(f'account {account_id}: {stored} -> {expected}')
+            fixes.append(UserBankAccount(pk=account_id, balance=expected))
+            if len(fixes) == 1000:
+                fixed += self.save(fixes, options['dry_run'])
+                fixes = []
+        return fixed + self.save(fixes, options['dry_run'])
+
+    def save(self, fixes, dry_run):
+        if fixes and not dry_run:
+            with sharding.atomic():
+                UserBankAccount.objects.bulk_update(fixes, ['balance'])
+        return len(fixes)
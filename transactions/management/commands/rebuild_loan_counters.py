@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Count, DecimalField, IntegerField, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+from accounts.models import UserBankAccount
+from core import sharding
+from transactions.constants import LOAN
+from transactions.models import Transaction
+
+
+class Command(BaseCommand):
+    help = 'Recompute every account\'s active_loans/outstanding_loan counters from the loan transactions'
+
+    def handle(self, *args, **options):
+        updated = 0
+        for alias in sharding.shards():
+            # an account's loans are on its own shard
+            with sharding.on(alias):
+                updated += self.rebuild()
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt loan counters for {updated} accounts'))
+
+    def rebuild(self):
+        loans = Transaction.objects.filter(
+            account=OuterRef('pk'), transaction_type=LOAN, loan_approve=True
+        ).values('account')
+        # one set-based UPDATE with correlated subqueries, no rows pulled into Python
+        return UserBankAccount.objects.update(
+            active_loans=Coalesce(
+                Subquery(loans.annotate(n=Count('id')).values('n')), Value(0), output_field=IntegerField()
+            ),
+            outstanding_loan=Coalesce(
+                Subquery(loans.annotate(total=Sum('amount')).values('total')), Value(0), output_field=DecimalField()
+            ),
+        )
@@ -0,0 +1,37 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import DatabaseError
+from django.utils import timezone
+
+from transactions import sagas
+from transactions.constants import SAGA_DEBITED, SAGA_PENDING
+from transactions.models import TransferSaga
+
+
+class Command(BaseCommand):
+    help = (
+        'Finish the cross-shard transfers a crash or an unreachable shard left half done: '
+        'credit the receiver, or refund the sender when the credit can\'t be made'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--older-than', type=int, default=300,
+            help='seconds since the saga last moved, leaves the ones still running alone',
+        )
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(seconds=options['older_than'])
+        stuck = TransferSaga.objects.filter(state__in=[SAGA_PENDING, SAGA_DEBITED], updated__lt=cutoff).order_by('pk')
+        outcomes = {}
+        for saga in stuck.iterator():
+            try:
+                state = sagas.resume(saga)
+            except (sagas.TransferDelayed, DatabaseError) as e:
+                # a shard is still down, the next run tries again
+                self.stderr.write(f'{saga.pk}: {e}')
+                state = saga.state
+            outcomes[state] = outcomes.get(state, 0) + 1
+        summary = ', '.join(f'{count} {state}' for state, count in sorted(outcomes.items())) or 'nothing to do'
+        self.stdout.write(self.style.SUCCESS(f'Sagas: {summary}'))
@@ -0,0 +1,49 @@
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from transactions.standing_orders import drain
+
+
+class Command(BaseCommand):
+    help = 'Run the due standing orders using a pool of worker threads (start it on several hosts to go wider)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4)
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--loop', action='store_true', help='keep polling instead of exiting once nothing is due')
+        parser.add_argument('--interval', type=float, default=60, help='seconds to sleep between polls with --loop')
+
+    def handle(self, *args, **options):
+        totals = {'succeeded': 0, 'failed': 0}
+        lock = threading.Lock()
+
+        def worker():
+            try:
+                while True:
+                    succeeded, failed = drain(options['batch_size'])
+                    with lock:
+                        totals['succeeded'] += succeeded
+                        totals['failed'] += failed
+                    if not options['loop']:
+                        return
+                    time.sleep(options['interval'])
+            finally:
+                connections.close_all()  # every thread gets its own db connections, one per shard it drained
+
+        started = time.perf_counter()
+        threads = [threading.Thread(target=worker, daemon=True) for _ in range(options['workers'])]
+        for thread in threads:
+            thread.start()
+        try:
+            for thread in threads:
+                thread.join()
+        except KeyboardInterrupt:
+            pass
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Ran {totals['succeeded']} standing orders, {totals['failed']} failed "
+            f"in {time.perf_counter() - started:.1f}s"
+        ))
@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from accounts.models import UserBankAccount
+from core import sharding
+from transactions import journal
+
+
+class Command(BaseCommand):
+    help = (
+        'Recompute every balance from the journal in one streaming pass and report accounts '
+        'whose stored balance disagrees, and entries whose lines don\'t balance'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=5000)
+        parser.add_argument('--limit', type=int, default=100, help='mismatches to print')
+
+    def handle(self, *args, **options):
+        unbalanced, mismatches = [], 0
+        # every ledger shard has a journal of its own
+        for alias in sharding.shards():
+            with sharding.on(alias):
+                shard_unbalanced = list(journal.unbalanced_entries()[:options['limit']])
+                for entry_id, net in shard_unbalanced:
+                    self.stdout.write(f'{alias} entry {entry_id}: debits and credits differ by {net}')
+                unbalanced += shard_unbalanced
+
+                accounts = UserBankAccount.objects.all()
+                for account_id, stored, expected in journal.compare(accounts, options['chunk_size']):
+                    mismatches += 1
+                    if mismatches <= options['limit']:
+                        self.stdout.write(f'account {account_id}: balance is {stored}, journal says {expected}')
+
+        if unbalanced or mismatches:
+            raise CommandError(
+                f'{mismatches} balances disagree with the journal, {len(unbalanced)} unbalanced entries. '
+                'rebuild_balances resets the balances from the journal.'
+            )
+        self.stdout.write(self.style.SUCCESS('Every balance matches the journal'))
@@ -0,0 +1,22 @@
+# Generated by Django 5.1 on 2026-10-18 05:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0003_userbankaccount_is_bankrupt'),
+        ('transactions', '0002_alter_transaction_transaction_type'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['account', 'timestamp'], name='transaction_account_9b28bc_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['account', 'transaction_type'], name='transaction_account_6aecfc_idx'),
+        ),
+    ]
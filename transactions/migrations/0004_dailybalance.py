@@ -0,0 +1,35 @@
+# Generated by Django 5.1 on 2026-10-18 06:10
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0003_userbankaccount_is_bankrupt'),
+        ('transactions', '0003_transaction_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyBalance',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('opening_balance', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('closing_balance', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('deposits', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('withdrawals', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('loans', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('loan_payments', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('transfers_in', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('transfers_out', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('account', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_balances', to='accounts.userbankaccount')),
+            ],
+            options={
+                'ordering': ['date'],
+                'constraints': [models.UniqueConstraint(fields=('account', 'date'), name='unique_daily_balance')],
+            },
+        ),
+    ]
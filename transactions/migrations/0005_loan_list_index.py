@@ -0,0 +1,37 @@
+# Generated by Django 5.1 on 2026-10-18 05:51
+
+from django.db import migrations, models
+from django.db.models import Count, DecimalField, IntegerField, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+def fill_loan_counters(apps, schema_editor):
+    Transaction = apps.get_model('transactions', 'Transaction')
+    UserBankAccount = apps.get_model('accounts', 'UserBankAccount')
+    loans = Transaction.objects.filter(account=OuterRef('pk'), transaction_type=3, loan_approve=True).values('account')
+    UserBankAccount.objects.update(
+        active_loans=Coalesce(Subquery(loans.annotate(n=Count('id')).values('n')), Value(0), output_field=IntegerField()),
+        outstanding_loan=Coalesce(
+            Subquery(loans.annotate(total=Sum('amount')).values('total')), Value(0), output_field=DecimalField()
+        ),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0004_userbankaccount_loan_counters'),
+        ('transactions', '0004_dailybalance'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='transaction',
+            name='transaction_account_6aecfc_idx',
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['account', 'transaction_type', 'timestamp'], name='transaction_account_cd0ec7_idx'),
+        ),
+        migrations.RunPython(fill_loan_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.1 on 2026-10-18 08:30
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0005_account_number_sequence'),
+        ('transactions', '0005_loan_list_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='JournalEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('transaction_type', models.IntegerField(blank=True, choices=[(1, 'Deposit'), (2, 'Withdrawal'), (3, 'Loan'), (4, 'Loan Paid'), (5, 'Receive Money'), (6, 'Transfer Money')], null=True)),
+                ('timestamp', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='JournalLine',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('book', models.CharField(choices=[('cash', 'Cash'), ('loans', 'Loans'), ('customer', 'Customer deposits'), ('equity', 'Equity')], max_length=10)),
+                ('side', models.CharField(choices=[('D', 'Debit'), ('C', 'Credit')], max_length=1)),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('account', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='journal_lines', to='accounts.userbankaccount')),
+                ('entry', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='lines', to='transactions.journalentry')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['account', 'id'], name='transaction_account_33ba4c_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 5.1 on 2026-10-18 08:31
+
+from django.db import migrations
+
+
+def open_balances(apps, schema_editor):
+    # one opening entry per funded account (customer credit, equity debit) so the
+    # journal adds up to the balances that existed before it
+    UserBankAccount = apps.get_model('accounts', 'UserBankAccount')
+    JournalEntry = apps.get_model('transactions', 'JournalEntry')
+    JournalLine = apps.get_model('transactions', 'JournalLine')
+    accounts = UserBankAccount.objects.exclude(balance=0).order_by('pk').values_list('pk', 'balance')
+    batch = []
+    for row in accounts.iterator(chunk_size=1000):
+        batch.append(row)
+        if len(batch) == 1000:
+            _open(JournalEntry, JournalLine, batch)
+            batch = []
+    if batch:
+        _open(JournalEntry, JournalLine, batch)
+
+
+def _open(JournalEntry, JournalLine, batch):
+    entries = JournalEntry.objects.bulk_create([JournalEntry(transaction_type=None) for _ in batch])
+    lines = []
+    for entry, (account_id, balance) in zip(entries, batch):
+        customer, equity = ('C', 'D') if balance > 0 else ('D', 'C')
+        lines.append(JournalLine(entry=entry, book='customer', account_id=account_id, side=customer, amount=abs(balance)))
+        lines.append(JournalLine(entry=entry, book='equity', side=equity, amount=abs(balance)))
+    JournalLine.objects.bulk_create(lines)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transactions', '0006_journal'),
+    ]
+
+    operations = [
+        migrations.RunPython(open_balances, migrations.RunPython.noop),
+    ]
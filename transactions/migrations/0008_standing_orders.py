@@ -0,0 +1,53 @@
+# Generated by Django 5.1 on 2026-10-18 09:10
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0005_account_number_sequence'),
+        ('transactions', '0007_journal_opening_balances'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StandingOrder',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('frequency', models.CharField(choices=[('daily', 'Daily'), ('weekly', 'Weekly'), ('monthly', 'Monthly')], max_length=10)),
+                ('starts_at', models.DateTimeField()),
+                ('ends_on', models.DateField(blank=True, null=True)),
+                ('next_run_at', models.DateTimeField()),
+                ('active', models.BooleanField(default=True)),
+                ('claimed_by', models.CharField(blank=True, max_length=32)),
+                ('claimed_until', models.DateTimeField(blank=True, null=True)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('account', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='standing_orders', to='accounts.userbankaccount')),
+                ('receiver', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='incoming_standing_orders', to='accounts.userbankaccount')),
+            ],
+            options={
+                'ordering': ['next_run_at'],
+            },
+        ),
+        migrations.CreateModel(
+            name='StandingOrderRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('scheduled_for', models.DateTimeField()),
+                ('executed_at', models.DateTimeField(auto_now_add=True)),
+                ('succeeded', models.BooleanField()),
+                ('error', models.CharField(blank=True, max_length=255)),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='runs', to='transactions.standingorder')),
+            ],
+            options={
+                'ordering': ['-executed_at'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='standingorder',
+            index=models.Index(condition=models.Q(('active', True)), fields=['next_run_at'], name='standing_order_due'),
+        ),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 5.1 on 2026-10-18 10:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transactions', '0008_standing_orders'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InterestRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.DateField(unique=True)),
+                ('last_account_id', models.BigIntegerField(default=0)),
+                ('accounts_credited', models.PositiveIntegerField(default=0)),
+                ('total_interest', models.DecimalField(decimal_places=2, default=0, max_digits=16)),
+                ('started', models.DateTimeField(auto_now_add=True)),
+                ('finished', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'ordering': ['-period'],
+            },
+        ),
+        migrations.AddField(
+            model_name='dailybalance',
+            name='interest',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=12),
+        ),
+        migrations.AlterField(
+            model_name='journalentry',
+            name='transaction_type',
+            field=models.IntegerField(blank=True, choices=[(1, 'Deposit'), (2, 'Withdrawal'), (3, 'Loan'), (4, 'Loan Paid'), (7, 'Interest'), (5, 'Receive Money'), (6, 'Transfer Money')], null=True),
+        ),
+        migrations.AlterField(
+            model_name='journalline',
+            name='book',
+            field=models.CharField(choices=[('cash', 'Cash'), ('loans', 'Loans'), ('customer', 'Customer deposits'), ('equity', 'Equity'), ('interest', 'Interest expense')], max_length=10),
+        ),
+        migrations.AlterField(
+            model_name='transaction',
+            name='transaction_type',
+            field=models.IntegerField(choices=[(1, 'Deposit'), (2, 'Withdrawal'), (3, 'Loan'), (4, 'Loan Paid'), (7, 'Interest')], null=True),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.1 on 2026-10-18 09:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0005_account_number_sequence'),
+        ('transactions', '0009_interest'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='transaction',
+            name='loan_rejected',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['transaction_type', 'timestamp'], name='transaction_transac_048ad1_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(condition=models.Q(('loan_approve', False), ('loan_rejected', False), ('transaction_type', 3)), fields=['timestamp'], name='pending_loan'),
+        ),
+    ]
@@ -0,0 +1,52 @@
+# Generated by Django 5.1 on 2026-10-18 16:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transactions', '0010_loan_rejected'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='journalentry',
+            name='transaction_type',
+            field=models.IntegerField(blank=True, choices=[(1, 'Deposit'), (2, 'Withdrawal'), (3, 'Loan'), (4, 'Loan Paid'), (7, 'Interest'), (5, 'Receive Money'), (6, 'Transfer Money'), (8, 'Transfer Reversal')], null=True),
+        ),
+        migrations.AlterField(
+            model_name='journalline',
+            name='book',
+            field=models.CharField(choices=[('cash', 'Cash'), ('loans', 'Loans'), ('customer', 'Customer deposits'), ('equity', 'Equity'), ('interest', 'Interest expense'), ('transit', 'In transit between shards')], max_length=10),
+        ),
+        migrations.CreateModel(
+            name='SagaStep',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('saga_id', models.BigIntegerField()),
+                ('step', models.CharField(choices=[('debit', 'Debit the sender'), ('credit', 'Credit the receiver'), ('refund', 'Refund the sender')], max_length=10)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('saga_id', 'step'), name='unique_saga_step')],
+            },
+        ),
+        migrations.CreateModel(
+            name='TransferSaga',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sender_account_no', models.IntegerField()),
+                ('receiver_account_no', models.IntegerField()),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('state', models.CharField(choices=[('pending', 'Pending'), ('debited', 'Sender debited'), ('completed', 'Completed'), ('compensated', 'Refunded'), ('failed', 'Failed')], default='pending', max_length=12)),
+                ('error', models.CharField(blank=True, max_length=255)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('updated', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'ordering': ['-created'],
+                'indexes': [models.Index(condition=models.Q(('state__in', ['pending', 'debited'])), fields=['updated'], name='saga_unfinished')],
+            },
+        ),
+    ]
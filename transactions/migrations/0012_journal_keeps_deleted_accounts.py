@@ -0,0 +1,20 @@
+# Generated by Django 5.1 on 2026-10-18 17:05
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0006_account_directory'),
+        ('transactions', '0011_transfer_sagas'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='journalline',
+            name='account',
+            field=models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='journal_lines', to='accounts.userbankaccount'),
+        ),
+    ]
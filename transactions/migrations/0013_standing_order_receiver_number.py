@@ -0,0 +1,39 @@
+# Generated by Django 5.1 on 2026-10-18 18:20
+
+from django.db import migrations, models
+from django.db.models import F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def receiver_numbers(apps, schema_editor):
+    StandingOrder = apps.get_model('transactions', 'StandingOrder')
+    UserBankAccount = apps.get_model('accounts', 'UserBankAccount')
+    numbers = UserBankAccount.objects.filter(pk=OuterRef('receiver_id')).values('account_no')[:1]
+    # a receiver on another shard isn't found here, but a sharded account's id is its number
+    StandingOrder.objects.update(receiver_account_no=Coalesce(Subquery(numbers), F('receiver_id')))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0006_account_directory'),
+        ('transactions', '0012_journal_keeps_deleted_accounts'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='standingorder',
+            name='receiver_account_no',
+            field=models.IntegerField(null=True),
+        ),
+        migrations.RunPython(receiver_numbers, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='standingorder',
+            name='receiver_account_no',
+            field=models.IntegerField(),
+        ),
+        migrations.RemoveField(
+            model_name='standingorder',
+            name='receiver',
+        ),
+    ]
@@ -1,7 +1,7 @@
 from django.db import models
 from accounts.models import UserBankAccount
 # Create your models here.
-from .constants import TRANSACTION_TYPE
+from .constants import TRANSACTION_TYPE, TRANSACTION_TYPE_NAMES, DEPOSIT, WITHDRAWAL, LOAN, LOAN_PAID, RECEIVE_MONEY, TRANSFER_MONEY, INTEREST, TRANSFER_REVERSAL, BOOKS, SIDES, FREQUENCIES, SAGA_STATES, SAGA_PENDING, SAGA_DEBITED, SAGA_STEPS
 
 class Transaction(models.Model):
     account = models.ForeignKey(UserBankAccount, related_name = 'transactions', on_delete = models.CASCADE) 
@@ -11,6 +11,178 @@ class Transaction(models.Model):
     transaction_type = models.IntegerField(choices=TRANSACTION_TYPE, null = True)
     timestamp = models.DateTimeField(auto_now_add=True)
     loan_approve = models.BooleanField(default=False) 
+    loan_rejected = models.BooleanField(default=False)
     
     class Meta:
-        ordering = ['timestamp'] 
\ No newline at end of file
+        ordering = ['timestamp'] 
+        indexes = [
+            models.Index(fields=['account', 'timestamp']),
+            models.Index(fields=['account', 'transaction_type', 'timestamp']),
+            # the admin changelist filtered by type, and the loans still waiting for a decision
+            models.Index(fields=['transaction_type', 'timestamp']),
+            models.Index(
+                fields=['timestamp'],
+                name='pending_loan',
+                condition=models.Q(transaction_type=LOAN, loan_approve=False, loan_rejected=False),
+            ),
+        ]
+
+
+class DailyBalance(models.Model):
+    # one row per account per day with activity, kept up to date by transactions.snapshots
+    account = models.ForeignKey(UserBankAccount, related_name='daily_balances', on_delete=models.CASCADE)
+    date = models.DateField()
+    opening_balance = models.DecimalField(decimal_places=2, max_digits=12)
+    closing_balance = models.DecimalField(decimal_places=2, max_digits=12)
+    deposits = models.DecimalField(decimal_places=2, max_digits=12, default=0)
+    withdrawals = models.DecimalField(decimal_places=2, max_digits=12, default=0)
+    loans = models.DecimalField(decimal_places=2, max_digits=12, default=0)
+    loan_payments = models.DecimalField(decimal_places=2, max_digits=12, default=0)
+    transfers_in = models.DecimalField(decimal_places=2, max_digits=12, default=0)
+    transfers_out = models.DecimalField(decimal_places=2, max_digits=12, default=0)
+    interest = models.DecimalField(decimal_places=2, max_digits=12, default=0)
+
+    TOTAL_FIELDS = {
+        DEPOSIT: 'deposits',
+        WITHDRAWAL: 'withdrawals',
+        LOAN: 'loans',
+        LOAN_PAID: 'loan_payments',
+        RECEIVE_MONEY: 'transfers_in',
+        TRANSFER_MONEY: 'transfers_out',
+        INTEREST: 'interest',
+        TRANSFER_REVERSAL: 'transfers_in',  # a transfer to another shard that was refunded
+    }
+
+    class Meta:
+        ordering = ['date']
+        constraints = [
+            models.UniqueConstraint(fields=['account', 'date'], name='unique_daily_balance'),
+        ]
+
+    def __str__(self):
+        return f"{self.account} on {self.date}: {self.closing_balance}"
+
+
+class JournalEntry(models.Model):
+    # one posting, its lines always balance (debits == credits). Rows are never updated or deleted.
+    transaction_type = models.IntegerField(choices=TRANSACTION_TYPE_NAMES, null=True, blank=True)  # null for opening balances
+    timestamp = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Entry {self.pk} ({self.get_transaction_type_display() or 'Opening balance'})"
+
+
+class JournalLine(models.Model):
+    entry = models.ForeignKey(JournalEntry, related_name='lines', on_delete=models.PROTECT)
+    book = models.CharField(max_length=10, choices=BOOKS)
+    # set on customer book lines only. The journal outlives the accounts: deleting one leaves
+    # its lines (and their account id) as they are, there is no constraint to stop it
+    account = models.ForeignKey(
+        UserBankAccount, related_name='journal_lines', on_delete=models.DO_NOTHING, db_constraint=False,
+        null=True, blank=True,
+    )
+    side = models.CharField(max_length=1, choices=SIDES)
+    amount = models.DecimalField(decimal_places=2, max_digits=12)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['account', 'id']),
+        ]
+
+    def __str__(self):
+        return f"{self.get_side_display()} {self.book} {self.amount}"
+
+
+class StandingOrder(models.Model):
+    # a recurring transfer, run by `manage.py run_standing_orders` (transactions/standing_orders.py).
+    # Kept on the payer's ledger shard, the receiver can be on another one so it is only a number
+    account = models.ForeignKey(UserBankAccount, related_name='standing_orders', on_delete=models.CASCADE)
+    receiver_account_no = models.IntegerField()
+    amount = models.DecimalField(decimal_places=2, max_digits=12)
+    frequency = models.CharField(max_length=10, choices=FREQUENCIES)
+    starts_at = models.DateTimeField()  # monthly orders keep this day of the month
+    ends_on = models.DateField(null=True, blank=True)
+    next_run_at = models.DateTimeField()
+    active = models.BooleanField(default=True)
+    # set while a worker holds the order, a crashed worker's claim runs out at claimed_until
+    claimed_by = models.CharField(max_length=32, blank=True)
+    claimed_until = models.DateTimeField(null=True, blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['next_run_at']
+        indexes = [
+            # only the active orders are ever scanned for due ones
+            models.Index(fields=['next_run_at'], condition=models.Q(active=True), name='standing_order_due'),
+        ]
+
+    def __str__(self):
+        return f"{self.get_frequency_display()} {self.amount} from {self.account} to {self.receiver_account_no}"
+
+
+class StandingOrderRun(models.Model):
+    order = models.ForeignKey(StandingOrder, related_name='runs', on_delete=models.CASCADE)
+    scheduled_for = models.DateTimeField()
+    executed_at = models.DateTimeField(auto_now_add=True)
+    succeeded = models.BooleanField()
+    error = models.CharField(max_length=255, blank=True)
+
+    class Meta:
+        ordering = ['-executed_at']
+
+    def __str__(self):
+        return f"{self.order_id} at {self.scheduled_for}: {'ok' if self.succeeded else self.error}"
+
+
+class InterestRun(models.Model):
+    # one month's interest accrual (transactions/interest.py). Every chunk of accounts commits
+    # together with last_account_id, so a run that died carries on after the last chunk it posted
+    period = models.DateField(unique=True)  # first day of the month
+    last_account_id = models.BigIntegerField(default=0)
+    accounts_credited = models.PositiveIntegerField(default=0)
+    total_interest = models.DecimalField(decimal_places=2, max_digits=16, default=0)
+    started = models.DateTimeField(auto_now_add=True)
+    finished = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['-period']
+
+    def __str__(self):
+        return f"Interest for {self.period:%B %Y}: {'done' if self.finished else f'after account {self.last_account_id}'}"
+
+
+class TransferSaga(models.Model):
+    # a transfer between accounts on different ledger shards, kept on 'default' (transactions/sagas.py)
+    sender_account_no = models.IntegerField()
+    receiver_account_no = models.IntegerField()
+    amount = models.DecimalField(decimal_places=2, max_digits=12)
+    state = models.CharField(max_length=12, choices=SAGA_STATES, default=SAGA_PENDING)
+    error = models.CharField(max_length=255, blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+    updated = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['-created']
+        indexes = [
+            # resume_sagas only looks at the unfinished ones
+            models.Index(fields=['updated'], condition=models.Q(state__in=[SAGA_PENDING, SAGA_DEBITED]), name='saga_unfinished'),
+        ]
+
+    def __str__(self):
+        return f"{self.amount} from {self.sender_account_no} to {self.receiver_account_no}: {self.get_state_display()}"
+
+
+class SagaStep(models.Model):
+    # written on the account's shard in the same transaction as the step's posting, so a
+    # step that already happened is never posted twice
+    saga_id = models.BigIntegerField()
+    step = models.CharField(max_length=10, choices=SAGA_STEPS)
+    created = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['saga_id', 'step'], name='unique_saga_step'),
+        ]
+
+    def __str__(self):
+        return f"Saga {self.saga_id}: {self.step}"
@@ -0,0 +1,68 @@
+import base64
+from datetime import datetime, time, timedelta
+
+from django.db.models import Q
+from django.utils import timezone
+
+
+def date_range(start_date, end_date):
+    """
+    Turn an inclusive date range into a half-open [start, end) datetime range, so the
+    filter is timestamp >= start AND timestamp < end and can use the (account, timestamp)
+    index instead of applying a date cast to every row.
+    """
+    start = timezone.make_aware(datetime.combine(start_date, time.min))
+    end = timezone.make_aware(datetime.combine(end_date + timedelta(days=1), time.min))
+    return start, end
+
+
+def encode_cursor(timestamp, pk):
+    return base64.urlsafe_b64encode(f'{timestamp.isoformat()}|{pk}'.encode()).decode()
+
+
+def decode_cursor(cursor):
+    try:
+        timestamp, pk = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+        return datetime.fromisoformat(timestamp), int(pk)
+    except (ValueError, UnicodeError):
+        return None
+
+
+def _key(row):
+    if isinstance(row, dict):
+        return row['timestamp'], row['id']
+    return row.timestamp, row.pk
+
+
+def _seek(queryset, cursor):
+    queryset = queryset.order_by('timestamp', 'id')
+    position = decode_cursor(cursor) if cursor else None
+    if position:
+        timestamp, pk = position
+        queryset = queryset.filter(Q(timestamp__gt=timestamp) | Q(timestamp=timestamp, id__gt=pk))
+    return queryset
+
+
+def _split(rows, page_size):
+    # one extra row was fetched to find out whether there is a next page
+    next_cursor = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        next_cursor = encode_cursor(*_key(rows[-1]))
+    return rows, next_cursor
+
+
+def keyset_page(queryset, cursor=None, page_size=50):
+    """
+    Return (rows, next_cursor) for the page after cursor, ordered by (timestamp, id).
+
+    Seeking past the last seen key keeps every page as cheap as the first one, unlike
+    OFFSET which has to walk all the skipped rows. For values() querysets timestamp and
+    id have to be among the selected fields.
+    """
+    return _split(list(_seek(queryset, cursor)[:page_size + 1]), page_size)
+
+
+async def akeyset_page(queryset, cursor=None, page_size=50):
+    """keyset_page for async views."""
+    return _split([row async for row in _seek(queryset, cursor)[:page_size + 1]], page_size)
@@ -0,0 +1,124 @@
+"""
+One page of the transaction report, for TransactionReportView and the async report.
+
+Formatting the rows (date, floatformat and intcomma on every amount) is most of the
+page's render time, so a page's statement and rendered rows are kept in the
+template_fragments cache, but only once the page is final: a full page (pages go
+oldest first, new transactions land on the last one) or a date range that ended
+before today. Nothing is added to those any more. Only the loan postings change
+rows in place (approving and repaying), and they call expire(), which drops the
+account's version marker so its cached pages are no longer found.
+"""
+import uuid
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.utils import make_template_fragment_key
+from django.db import transaction
+from django.template.loader import render_to_string
+from django.utils import timezone
+
+from core import sharding
+from . import snapshots
+from .models import Transaction
+from .pagination import akeyset_page, date_range, keyset_page
+
+PAGE_SIZE = 50
+
+
+def _cache():
+    return caches['template_fragments']
+
+
+def _version_key(account_id):
+    return f'transaction_report_version:{account_id}'
+
+
+def _new_version():
+    # a new marker every time one is missing, so an evicted marker can't bring old pages back
+    return uuid.uuid4().hex
+
+
+def _key(account, version, params, start_date, end_date, page_size):
+    return make_template_fragment_key(
+        'transaction_report', [account.pk, version, start_date, end_date, params.get('cursor'), page_size],
+    )
+
+
+def _cacheable(start_date, end_date):
+    # a range that includes today is still open, its statement changes with every posting
+    return not (start_date and end_date) or end_date < timezone.localdate()
+
+
+def _final(start_date, end_date, next_cursor):
+    return bool(start_date and end_date) or next_cursor is not None
+
+
+def expire(account_ids):
+    """
+    Forget the cached report pages of these accounts once the current ledger
+    transaction commits, for postings that change existing rows.
+    """
+    keys = [_version_key(pk) for pk in account_ids]
+    transaction.on_commit(lambda: _cache().delete_many(keys), using=sharding.current())
+
+
+def _queryset(account, start_date, end_date):
+    queryset = Transaction.objects.filter(account=account)
+    if start_date and end_date:
+        start, end = date_range(start_date, end_date)
+        queryset = queryset.filter(timestamp__gte=start, timestamp__lt=end)
+    return queryset
+
+
+def _render(params, rows, next_cursor, statement):
+    next_page_query = None
+    if next_cursor:
+        params = params.copy()
+        params['cursor'] = next_cursor
+        next_page_query = params.urlencode()
+    return {
+        'statement': statement,
+        'rows': render_to_string('transactions/report_rows.html', {'object_list': rows}),
+        'next_page_query': next_page_query,
+    }
+
+
+def page(account, params, start_date=None, end_date=None, page_size=PAGE_SIZE):
+    """
+    Context for transaction_report.html: the statement of the date range (if any), the
+    rendered rows of the page params['cursor'] points at and next_page_query.
+    """
+    key = None
+    if _cacheable(start_date, end_date):
+        version = _cache().get_or_set(_version_key(account.pk), _new_version, None)
+        key = _key(account, version, params, start_date, end_date, page_size)
+        context = _cache().get(key)
+        if context is not None:
+            return context
+    statement = snapshots.statement(account, start_date, end_date) if start_date and end_date else None
+    rows, next_cursor = keyset_page(_queryset(account, start_date, end_date), params.get('cursor'), page_size)
+    context = _render(params, rows, next_cursor, statement)
+    if key and _final(start_date, end_date, next_cursor):
+        _cache().set(key, context, settings.REPORT_CACHE_SECONDS)
+    return context
+
+
+async def apage(account, params, start_date=None, end_date=None, page_size=PAGE_SIZE):
+    """page() for async views."""
+    key = None
+    if _cacheable(start_date, end_date):
+        version = await _cache().aget_or_set(_version_key(account.pk), _new_version, None)
+        key = _key(account, version, params, start_date, end_date, page_size)
+        context = await _cache().aget(key)
+        if context is not None:
+            return context
+    statement = None
+    if start_date and end_date:
+        statement = await sync_to_async(snapshots.statement)(account, start_date, end_date)
+    rows, next_cursor = await akeyset_page(_queryset(account, start_date, end_date), params.get('cursor'), page_size)
+    context = _render(params, rows, next_cursor, statement)
+    if key and _final(start_date, end_date, next_cursor):
+        await _cache().aset(key, context, settings.REPORT_CACHE_SECONDS)
+    return context
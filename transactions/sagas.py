@@ -0,0 +1,112 @@
+"""
+Transfers between accounts on different ledger shards (core/sharding.py).
+
+They can't be one database transaction, so they run as a saga, recorded in a
+TransferSaga row on 'default':
+
+1. debit the sender on its shard (TRANSFER_MONEY, against the in-transit book)
+2. credit the receiver on its shard (RECEIVE_MONEY, out of the in-transit book)
+3. only if step 2 failed: refund the sender with a compensating TRANSFER_REVERSAL
+
+Each step writes a SagaStep row on its shard in the same transaction as its
+posting, so no step is ever posted twice and a crashed saga can be finished by
+`manage.py resume_sagas`: a saga is only refunded once the receiver's shard says
+the credit never happened. If that shard can't be asked, the saga is left debited
+for resume_sagas to finish later.
+"""
+from django.db import DatabaseError, IntegrityError
+
+from accounts.directory import find_account
+from core import sharding
+from . import ledger
+from .constants import (
+    CREDIT_STEP, DEBIT_STEP, RECEIVE_MONEY, REFUND_STEP, SAGA_COMPENSATED, SAGA_COMPLETED, SAGA_DEBITED,
+    SAGA_FAILED, SAGA_PENDING, TRANSFER_MONEY, TRANSFER_REVERSAL,
+)
+from .models import SagaStep, TransferSaga
+
+
+class TransferFailed(ledger.LedgerError):
+    pass
+
+
+class TransferDelayed(ledger.LedgerError):
+    pass
+
+
+def _step(saga, step, account, post):
+    """Run post() on the account's shard unless the step already happened there."""
+    try:
+        with sharding.atomic(account):
+            SagaStep.objects.create(saga_id=saga.pk, step=step)
+            post()
+    except IntegrityError:
+        # normally nothing to look up, only a resumed saga finds its step done
+        if not _done(saga, step, account):
+            raise
+
+
+def _done(saga, step, account):
+    return SagaStep.objects.using(sharding.shard_of(account)).filter(saga_id=saga.pk, step=step).exists()
+
+
+def _move(saga, state, error=''):
+    saga.state = state
+    saga.error = str(error)[:255]
+    saga.save(update_fields=['state', 'error', 'updated'])
+
+
+def transfer(sender, receiver, amount):
+    """Move amount from sender to receiver on another shard, returns the sender's new balance."""
+    saga = TransferSaga.objects.create(
+        sender_account_no=sender.account_no, receiver_account_no=receiver.account_no, amount=amount,
+    )
+    try:
+        _step(saga, DEBIT_STEP, sender, lambda: ledger.withdraw(sender, amount, TRANSFER_MONEY))
+    except ledger.LedgerError as e:
+        _move(saga, SAGA_FAILED, e)
+        raise
+    _move(saga, SAGA_DEBITED)
+    _finish(saga, sender, receiver)
+    return sender.balance
+
+
+def _finish(saga, sender, receiver):
+    """Credit the receiver of a debited saga, or refund the sender if that fails."""
+    try:
+        _step(saga, CREDIT_STEP, receiver, lambda: ledger.deposit(receiver, saga.amount, RECEIVE_MONEY))
+    except (ledger.LedgerError, DatabaseError) as e:
+        try:
+            credited = _done(saga, CREDIT_STEP, receiver)
+            if not credited:
+                _step(saga, REFUND_STEP, sender, lambda: ledger.deposit(sender, saga.amount, TRANSFER_REVERSAL))
+        except DatabaseError:
+            raise TransferDelayed('The transfer is taking longer than usual, it will be completed or refunded shortly') from e
+        if not credited:
+            _move(saga, SAGA_COMPENSATED, e)
+            raise TransferFailed('The transfer could not be completed, the amount was returned to your account') from e
+    _move(saga, SAGA_COMPLETED)
+
+
+def resume(saga):
+    """
+    Finish a saga a crash or an unreachable shard left behind. A saga that never got
+    as far as debiting the sender is marked failed rather than debited late.
+    Returns the saga's new state.
+    """
+    sender = find_account(saga.sender_account_no)
+    receiver = find_account(saga.receiver_account_no)
+    if saga.state == SAGA_PENDING:
+        if not _done(saga, DEBIT_STEP, sender):
+            _move(saga, SAGA_FAILED, 'Interrupted before the sender was debited')
+            return saga.state
+        _move(saga, SAGA_DEBITED)
+    if receiver is None:
+        _step(saga, REFUND_STEP, sender, lambda: ledger.deposit(sender, saga.amount, TRANSFER_REVERSAL))
+        _move(saga, SAGA_COMPENSATED, 'The receiving account no longer exists')
+        return saga.state
+    try:
+        _finish(saga, sender, receiver)
+    except TransferFailed:
+        pass
+    return saga.state
@@ -0,0 +1,102 @@
+"""
+Per account daily balance snapshots.
+
+The ledger calls record()/record_many() inside the posting transaction, while it
+still holds the account row lock, so the snapshot never disagrees with the balance.
+A statement for any date range is then answered from snapshot rows instead of
+summing raw transactions.
+"""
+from decimal import Decimal
+
+from django.db.models import Max, Subquery, Sum
+from django.utils import timezone
+
+from .constants import CREDIT_TYPES
+from .models import DailyBalance
+
+TOTAL_FIELDS = DailyBalance.TOTAL_FIELDS
+# each column once, two types can add to the same one
+TOTALS = list(dict.fromkeys(TOTAL_FIELDS.values()))
+
+
+def signed(transaction_type, amount):
+    return amount if transaction_type in CREDIT_TYPES else -amount
+
+
+def record(account_id, transaction_type, amount, balance_after, day=None):
+    record_many([(account_id, transaction_type, amount, balance_after)], day)
+
+
+def record_many(postings, day=None):
+    """
+    postings is a list of (account_id, transaction_type, amount, balance_after) in
+    posting order. New and existing rows are written with one upsert per 1000 rows.
+    """
+    day = day or timezone.localdate()
+    account_ids = sorted({account_id for account_id, _, _, _ in postings})
+    existing = {}
+    for start in range(0, len(account_ids), 1000):
+        for snapshot in DailyBalance.objects.filter(account_id__in=account_ids[start:start + 1000], date=day):
+            existing[snapshot.account_id] = snapshot
+    created = {}
+    for account_id, transaction_type, amount, balance_after in postings:
+        snapshot = existing.get(account_id) or created.get(account_id)
+        if snapshot is None:
+            snapshot = created[account_id] = DailyBalance(
+                account_id=account_id,
+                date=day,
+                opening_balance=balance_after - signed(transaction_type, amount),
+                closing_balance=balance_after,
+            )
+        field = TOTAL_FIELDS[transaction_type]
+        setattr(snapshot, field, getattr(snapshot, field) + amount)
+        snapshot.closing_balance = balance_after
+
+    # written back as one upsert on (account, date), much cheaper to build than a
+    # bulk_update CASE per field and row. Existing rows are copied to fresh instances,
+    # so the insert carries no id and only the (account, date) constraint can conflict
+    rows = list(created.values()) + [
+        DailyBalance(**{
+            field: getattr(snapshot, field)
+            for field in ['account_id', 'date', 'opening_balance', 'closing_balance', *TOTALS]
+        })
+        for snapshot in existing.values()
+    ]
+    DailyBalance.objects.bulk_create(
+        rows, batch_size=1000, update_conflicts=True, unique_fields=['account', 'date'],
+        update_fields=['closing_balance', *TOTALS],
+    )
+
+
+def statement(account, start_date, end_date):
+    """
+    Opening/closing balance and per type totals for [start_date, end_date]. One query,
+    and a second one only when the range has no snapshots.
+    """
+    snapshots = DailyBalance.objects.filter(account=account)
+    in_range = snapshots.filter(date__gte=start_date, date__lte=end_date)
+    before = snapshots.filter(date__lt=start_date).order_by('-date').values('closing_balance')[:1]
+
+    def edge(queryset, field):
+        # the same value on every row, Max() is only there to take it through the aggregate
+        return Max(Subquery(queryset.values(field)[:1]))
+
+    row = in_range.aggregate(
+        before=edge(before, 'closing_balance'),
+        first=edge(in_range.order_by('date'), 'opening_balance'),
+        last=edge(in_range.order_by('-date'), 'closing_balance'),
+        **{field: Sum(field) for field in TOTALS},
+    )
+    if row['last'] is None:
+        # no snapshots in the range, the balance didn't move since the one before it
+        opening = before.values_list('closing_balance', flat=True).first()
+        opening = opening if opening is not None else Decimal(0)
+        return {'opening_balance': opening, 'closing_balance': opening, **{field: Decimal(0) for field in TOTALS}}
+
+    # nothing before the range, the account was opened inside it (or never backfilled)
+    opening = row['before'] if row['before'] is not None else row['first']
+    return {
+        'opening_balance': opening,
+        'closing_balance': row['last'],
+        **{field: row[field] or Decimal(0) for field in TOTALS},
+    }
@@ -0,0 +1,286 @@
+"""
+Runs due standing orders. Same shape as the mail queue (core/mail.py): a worker
+claims a batch of due orders, skipping rows another worker has locked, then posts
+the batch in one transaction with ledger.transfer_many. The orders are moved to
+their next date in that same transaction, and only the ones the worker still holds
+the claim on, so an order can't run twice for one date however many workers are
+draining. A batch the ledger refuses as a whole runs again order by order, so only
+the orders it can't post are recorded as failed.
+
+Orders are kept on the payer's ledger shard (core/sharding.py) and drain() works
+through the shards one after the other. An order paying an account on another
+shard can't be posted in that transaction: it is moved to its next date with the
+rest of the batch and paid with a saga (transactions/sagas.py) once the batch has
+committed, so a crash in between loses that date's payment rather than paying twice.
+
+A run that was missed (no worker for a few days) happens once and the order moves
+to its next date after now, payments are not caught up.
+"""
+import calendar
+import random
+import time
+import uuid
+from collections import defaultdict
+from datetime import timedelta
+
+from django.db import DatabaseError, OperationalError, connections
+from django.db.models import Q
+from django.template.loader import render_to_string
+from django.utils import timezone
+
+from accounts.directory import attach_users, find_accounts
+from core import sharding
+from core.mail import queue_emails
+from . import ledger, limits, sagas
+from .constants import DAILY, WEEKLY
+from .models import StandingOrder, StandingOrderRun
+
+CLAIM_LEASE = timedelta(minutes=5)
+
+
+def add_month(moment, day):
+    year, month = divmod(moment.month, 12)  # moment.month is 1-12, so this is the next month 0-based
+    year, month = moment.year + year, month + 1
+    return moment.replace(year=year, month=month, day=min(day, calendar.monthrange(year, month)[1]))
+
+
+def step(order, moment):
+    if order.frequency == DAILY:
+        return moment + timedelta(days=1)
+    if order.frequency == WEEKLY:
+        return moment + timedelta(weeks=1)
+    return add_month(moment, order.starts_at.day)
+
+
+def following(order, now):
+    """The first run date after now, and whether the order is still active then."""
+    moment = step(order, order.next_run_at)
+    while moment <= now:
+        moment = step(order, moment)
+    return moment, order.ends_on is None or moment.date() <= order.ends_on
+
+
+def _due(now):
+    return Q(active=True, next_run_at__lte=now) & (Q(claimed_until__isnull=True) | Q(claimed_until__lte=now))
+
+
+def _claim(ids, token, now):
+    # re-checking the due condition keeps two workers from claiming the same rows
+    StandingOrder.objects.filter(_due(now), id__in=ids).update(claimed_by=token, claimed_until=now + CLAIM_LEASE)
+
+
+def claim_batch(batch_size):
+    """
+    Claim up to batch_size due orders on the current shard, returns None once nothing
+    is due. The orders come with their account and user, and with the receiving
+    account (None once it is closed) as order.receiver.
+    """
+    token = uuid.uuid4().hex
+    now = timezone.now()
+    due = StandingOrder.objects.filter(_due(now)).order_by('next_run_at', 'id')
+    if connections[sharding.current()].features.has_select_for_update_skip_locked:
+        # workers skip each other's locked rows instead of queueing behind them
+        with sharding.atomic():
+            ids = list(due.select_for_update(skip_locked=True).values_list('id', flat=True)[:batch_size])
+            if ids:
+                _claim(ids, token, now)
+    else:
+        # SQLite has no row locks, the conditional update alone decides who wins
+        ids = list(due.values_list('id', flat=True)[:batch_size])
+        if ids:
+            _claim(ids, token, now)
+    if not ids:
+        return None
+    orders = list(StandingOrder.objects.filter(claimed_by=token).select_related('account').order_by('id'))
+    # the users are on 'default' and a receiver can be on any shard, neither can be joined
+    attach_users([order.account for order in orders])
+    receivers = find_accounts({order.receiver_account_no for order in orders})
+    for order in orders:
+        order.receiver = receivers.get(order.receiver_account_no)
+    return orders
+
+
+def _mails(accepted):
+    mails = []
+    for _, sender, receiver, amount in accepted:
+        mails.append((
+            "Transfer money Mail",
+            render_to_string("transactions/sender_mail.html", {'user': sender.user, 'amount': amount}),
+            sender.user.email,
+        ))
+        mails.append((
+            "Receive money Mail",
+            render_to_string("transactions/receiver_mail.html", {'user': receiver.user, 'amount': amount}),
+            receiver.user.email,
+        ))
+    return mails
+
+
+def run_batch(orders):
+    """
+    Run a claimed batch in one transaction on the current shard, then the orders paying
+    another shard. Returns (succeeded, failed); orders whose claim was lost (cancelled,
+    or the lease ran out and another worker has them) count as neither.
+    """
+    token = orders[0].claimed_by
+    reservations = {}
+    try:
+        with sharding.atomic():
+            held = set(
+                StandingOrder.objects.select_for_update()
+                .filter(pk__in=[order.pk for order in orders], claimed_by=token, active=True)
+                .values_list('pk', flat=True)
+            )
+            orders = [order for order in orders if order.pk in held]
+            errors, transfers, crossing = {}, [], []
+            amounts = {order.pk: order.amount for order in orders}
+            for order in orders:
+                if order.receiver is None:
+                    errors[order.pk] = f'No account found with account no {order.receiver_account_no}'
+                    continue
+                try:
+                    reservations[order.pk] = limits.take('transfer', order.account, order.amount)
+                except limits.DailyLimitExceeded as e:
+                    errors[order.pk] = str(e)
+                else:
+                    if sharding.same_shard(order.account, order.receiver):
+                        transfers.append((order.pk, order.account, order.receiver, order.amount))
+                    else:
+                        crossing.append(order)
+
+            # the same checks and postings as transfer_money, for the whole batch at once
+            accepted, rejected = ledger.transfer_many(transfers)
+            for pk, error in rejected:
+                errors[pk] = error
+                reservations.pop(pk).refund(amounts[pk])
+            queue_emails(_mails(accepted))
+
+            now = timezone.now()
+            runs = []
+            moves = defaultdict(list)
+            paid_later = {order.pk for order in crossing}
+            for order in orders:
+                if order.pk not in paid_later:
+                    error = errors.get(order.pk, '')
+                    runs.append(StandingOrderRun(
+                        order=order, scheduled_for=order.next_run_at, succeeded=not error, error=error[:255],
+                    ))
+                next_run_at, active = following(order, now)
+                # an order whose receiving account was closed stops
+                moves[next_run_at, active and order.receiver is not None].append(order.pk)
+            StandingOrderRun.objects.bulk_create(runs, batch_size=1000)
+            # orders due together mostly share their next date, one plain UPDATE per date
+            # is far cheaper than a bulk_update CASE over the whole batch
+            for (next_run_at, active), pks in moves.items():
+                StandingOrder.objects.filter(pk__in=pks).update(
+                    next_run_at=next_run_at, active=active, claimed_by='', claimed_until=None,
+                )
+    except BaseException:
+        for order in orders:
+            if order.pk in reservations:
+                reservations[order.pk].refund(order.amount)
+        raise
+    failed = len(errors) + len(crossing) - _pay_across(crossing, reservations)
+    return len(orders) - failed, failed
+
+
+def _pay_across(orders, reservations):
+    """
+    Pay orders whose receiver is on another shard, one saga each, and record their runs.
+    Called once the orders were moved to their next date. Returns how many were paid.
+    """
+    runs, mails = [], []
+    for order in orders:
+        try:
+            sagas.transfer(order.account, order.receiver, order.amount)
+        except (ledger.LedgerError, DatabaseError) as e:
+            # a saga that fails part way is refunded or finished by resume_sagas
+            reservations[order.pk].refund(order.amount)
+            error = str(e)
+        else:
+            mails += _mails([(order.pk, order.account, order.receiver, order.amount)])
+            error = ''
+        runs.append(StandingOrderRun(
+            order=order, scheduled_for=order.next_run_at, succeeded=not error, error=error[:255],
+        ))
+    StandingOrderRun.objects.bulk_create(runs, batch_size=1000)
+    queue_emails(mails)
+    return sum(run.succeeded for run in runs)
+
+
+def release(orders):
+    StandingOrder.objects.filter(
+        pk__in=[order.pk for order in orders], claimed_by=orders[0].claimed_by,
+    ).update(claimed_by='', claimed_until=None)
+
+
+def fail(order, error):
+    """
+    Record a failed run of a claimed order and move it to its next date, as run_batch
+    does for a transfer it rejects. Returns 1, or 0 when the claim was lost.
+    """
+    with sharding.atomic():
+        held = StandingOrder.objects.select_for_update().filter(pk=order.pk, claimed_by=order.claimed_by, active=True)
+        if not held.exists():
+            return 0
+        StandingOrderRun.objects.create(
+            order=order, scheduled_for=order.next_run_at, succeeded=False, error=error[:255],
+        )
+        next_run_at, active = following(order, timezone.now())
+        held.update(next_run_at=next_run_at, active=active, claimed_by='', claimed_until=None)
+    return 1
+
+
+def run_each(orders):
+    """run_batch() for every order on its own, an order the ledger refuses fails alone."""
+    succeeded = failed = 0
+    for order in orders:
+        try:
+            ok, not_ok = run_batch([order])
+        except ledger.LedgerError as e:
+            ok, not_ok = 0, fail(order, str(e))
+        except OperationalError:
+            release([order])  # claimed again by the next round of drain()
+            continue
+        succeeded += ok
+        failed += not_ok
+    return succeeded, failed
+
+
+def drain(batch_size=500, max_retries=5):
+    """Keep running batches until nothing is due on any shard, returns (succeeded, failed) totals."""
+    succeeded = failed = 0
+    for alias in sharding.shards():
+        with sharding.on(alias):
+            ok, not_ok = _drain(batch_size, max_retries)
+        succeeded += ok
+        failed += not_ok
+    return succeeded, failed
+
+
+def _drain(batch_size, max_retries):
+    succeeded = failed = retries = 0
+    while True:
+        batch = claim_batch(batch_size)
+        if batch is None:
+            return succeeded, failed
+        if not batch:
+            continue  # another worker claimed these first
+        try:
+            ok, not_ok = run_batch(batch)
+        except OperationalError:
+            # deadlock or lock timeout, the batch was rolled back. Give it back so it
+            # runs again now rather than when the claim runs out
+            retries += 1
+            if retries > max_retries:
+                raise
+            release(batch)
+            time.sleep(random.uniform(0, 0.05 * 2 ** retries))
+            continue
+        except ledger.LedgerError:
+            # transfer_many refused the batch as a whole (a balance moved while it was posted)
+            # and rolled it back, the orders go one by one so only the ones it refuses fail
+            ok, not_ok = run_each(batch)
+        retries = 0
+        succeeded += ok
+        failed += not_ok
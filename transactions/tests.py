@@ -1,3 +1,873 @@
-from django.test import TestCase
+import importlib
+import io
+import json
+import random
+import threading
+import uuid
+from datetime import date, timedelta
+from decimal import Decimal
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from django.apps import apps
+from django.contrib.auth.models import User
+from django.core.cache import cache, caches
+from django.core.management import call_command
+from django.db import DEFAULT_DB_ALIAS, OperationalError, connection
+from django.db.models.sql.compiler import SQLCompiler
+from django.http import QueryDict
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from accounts.directory import find_account, find_accounts, open_account
+from accounts.models import UserBankAccount
+from core import ratelimit, sharding
+from core.models import QueuedEmail
+from core.testing import assert_query_budget
+from transactions import batch, interest, journal, ledger, limits, report, sagas, snapshots, standing_orders
+from transactions.constants import (
+    CREDIT_TYPES, DEBIT, DEBIT_TYPES, DEPOSIT, INTEREST, LOAN, LOAN_PAID, MONTHLY, RECEIVE_MONEY,
+    SAGA_COMPENSATED, SAGA_COMPLETED, TRANSIT, WITHDRAWAL,
+)
+from transactions.forms import DepositForm, LoanRequestForm, StandingOrderForm
+from transactions.models import DailyBalance, InterestRun, JournalLine, StandingOrder, Transaction, TransferSaga
+from transactions.views import approve_loans_and_notify, reject_loans_and_notify, transfer_and_notify, withdraw_and_notify
+
+_numbers = iter(range(10_000_000, 20_000_000))
+
+
+def make_account(username, balance=0, shard=DEFAULT_DB_ALIAS):
+    """An account on the given ledger shard, 'default' unless a test is about sharding."""
+    account_no = next(_numbers)
+    while sharding.enabled() and sharding.place(account_no) != shard:
+        account_no = next(_numbers)
+    user = User.objects.create_user(username=username, email=f'{username}@example.com', password='pass-1234')
+    account = open_account(user, account_type='Savings', account_no=account_no)
+    if balance:
+        ledger.deposit(account, Decimal(balance))
+    return account
+
+
+def history_balance(account):
+    """The balance the account's Transaction rows add up to."""
+    balance = Decimal(0)
+    for transaction_type, amount, loan_approve in Transaction.objects.filter(account=account).values_list(
+        'transaction_type', 'amount', 'loan_approve'
+    ):
+        if transaction_type == LOAN_PAID:
+            continue  # the loan's own row, credited when approved and debited again when repaid
+        if transaction_type == LOAN and not loan_approve:
+            continue
+        if transaction_type in CREDIT_TYPES:
+            balance += amount
+        elif transaction_type in DEBIT_TYPES:
+            balance -= amount
+    return balance
+
+
+def request_loan(account, amount):
+    return Transaction.objects.using(sharding.shard_of(account)).create(
+        account=account, amount=Decimal(amount), balance_after_transaction=account.balance, transaction_type=LOAN,
+    )
+
+
+class LedgerAssertions:
+    def assertLedgerConsistent(self, accounts):
+        """Balances agree with the history, the journal and today's snapshot, and none is negative."""
+        placed = {}
+        for account in accounts:
+            placed.setdefault(sharding.shard_of(account), []).append(account.pk)
+        for alias, ids in placed.items():
+            with sharding.on(alias):
+                self.assertShardConsistent(UserBankAccount.objects.filter(pk__in=ids))
+
+    def assertShardConsistent(self, accounts):
+        self.assertEqual(list(journal.compare(accounts)), [])
+        self.assertEqual(list(journal.unbalanced_entries()), [])
+        for account in accounts:
+            self.assertGreaterEqual(account.balance, 0)
+            self.assertEqual(account.balance, history_balance(account), account)
+            snapshot = DailyBalance.objects.filter(account=account).order_by('-date').first()
+            self.assertEqual(snapshot.closing_balance if snapshot else 0, account.balance, account)
+            previous = None
+            for day in DailyBalance.objects.filter(account=account).order_by('date'):
+                if previous is not None:
+                    self.assertEqual(day.opening_balance, previous.closing_balance, day)
+                previous = day
+
+
+class LedgerTests(LedgerAssertions, TestCase):
+    databases = '__all__'
+
+    def test_postings(self):
+        alice, bob = make_account('alice', 1000), make_account('bob')
+        ledger.withdraw(alice, Decimal(300))
+        ledger.transfer(alice, bob, Decimal(200))
+        self.assertEqual((alice.balance, bob.balance), (500, 200))
+        self.assertLedgerConsistent([alice, bob])
+
+    def test_overdraft_is_rejected(self):
+        alice = make_account('alice', 100)
+        with self.assertRaises(ledger.InsufficientFunds):
+            ledger.withdraw(alice, Decimal(101))
+        with self.assertRaises(ledger.InvalidPosting):
+            ledger.deposit(alice, Decimal(0))
+        alice.refresh_from_db()
+        self.assertEqual(alice.balance, 100)
+        self.assertLedgerConsistent([alice])
+
+    def test_deleting_an_account_keeps_its_journal(self):
+        alice, bob = make_account('alice', 1000), make_account('bob')
+        ledger.transfer(alice, bob, Decimal(200))
+        lines = JournalLine.objects.count()
+        alice_id = alice.pk
+
+        alice.user.delete()
+
+        self.assertFalse(UserBankAccount.objects.filter(pk=alice_id).exists())
+        self.assertEqual(JournalLine.objects.count(), lines)
+        self.assertTrue(JournalLine.objects.filter(account_id=alice_id).exists())
+        self.assertLedgerConsistent([bob])
+        call_command('verify_journal', stdout=io.StringIO())
+
+    def test_form_posts_through_the_ledger(self):
+        alice = make_account('alice', 1000)
+        form = DepositForm({'amount': 500}, account=alice, initial={'transaction_type': DEPOSIT})
+        self.assertTrue(form.is_valid(), form.errors)
+        row = form.save()
+        self.assertEqual((row.transaction_type, row.balance_after_transaction), (DEPOSIT, 1500))
+
+        form = LoanRequestForm({'amount': 300}, account=alice, initial={'transaction_type': LOAN})
+        self.assertTrue(form.is_valid(), form.errors)
+        row = form.save()
+        self.assertEqual((row.transaction_type, row.balance_after_transaction), (LOAN, 1500))
+        self.assertLedgerConsistent([alice])
+
+    def test_statement(self):
+        alice = make_account('alice')
+        day = date(2026, 3, 1)
+        DailyBalance.objects.create(
+            account=alice, date=day, opening_balance=0, closing_balance=100, deposits=100,
+        )
+        DailyBalance.objects.create(
+            account=alice, date=day + timedelta(days=2), opening_balance=100, closing_balance=70, withdrawals=30,
+        )
+
+        whole = snapshots.statement(alice, day, day + timedelta(days=2))
+        self.assertEqual((whole['opening_balance'], whole['closing_balance']), (0, 70))
+        self.assertEqual((whole['deposits'], whole['withdrawals']), (100, 30))
+        quiet = snapshots.statement(alice, day + timedelta(days=1), day + timedelta(days=1))
+        self.assertEqual((quiet['opening_balance'], quiet['closing_balance'], quiet['deposits']), (100, 100, 0))
+        later = snapshots.statement(alice, day + timedelta(days=1), day + timedelta(days=9))
+        self.assertEqual((later['opening_balance'], later['closing_balance'], later['withdrawals']), (100, 70, 30))
+
+
+class LedgerConcurrencyTests(LedgerAssertions, TransactionTestCase):
+    databases = '__all__'
+
+    threads = 8
+    operations = 40
+
+    def test_concurrent_postings_keep_the_books(self):
+        accounts = [make_account(f'stress_{i}', 500) for i in range(4)]
+        errors = []
+
+        def worker(seed):
+            rng = random.Random(seed)
+            try:
+                for _ in range(self.operations):
+                    account, other = [
+                        UserBankAccount.objects.get(pk=account.pk) for account in rng.sample(accounts, 2)
+                    ]
+                    amount = Decimal(rng.randint(1, 300))
+                    try:
+                        operation = rng.choice((ledger.deposit, ledger.withdraw, ledger.transfer))
+                        if operation is ledger.transfer:
+                            ledger.transfer(account, other, amount)
+                        else:
+                            operation(account, amount)
+                    except (ledger.InsufficientFunds, OperationalError):
+                        pass  # rejected for funds, or SQLite was busy; either way rolled back
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker, args=(seed,)) for seed in range(self.threads)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertGreater(Transaction.objects.count(), len(accounts))
+        self.assertLedgerConsistent(accounts)
+
+
+@override_settings(DAILY_LIMITS={'withdraw': Decimal(2000)})
+class DailyLimitConcurrencyTests(LedgerAssertions, TransactionTestCase):
+    databases = '__all__'
+
+    threads = 8
+    operations = 10
+    rate = '25/h'
+
+    def setUp(self):
+        cache.clear()
+
+    def test_concurrent_withdrawals_stay_under_the_cap(self):
+        account = make_account('limits', 20000)
+        outcomes = {'ok': 0, 'capped': 0, 'busy': 0, 'allowed': 0}
+        lock = threading.Lock()
+        start = threading.Barrier(self.threads)
+        errors = []
+
+        def worker():
+            start.wait()
+            try:
+                for _ in range(self.operations):
+                    allowed, _ = ratelimit.hit('stress', account.pk, self.rate)
+                    outcome = 'ok'
+                    try:
+                        withdraw_and_notify(UserBankAccount.objects.get(pk=account.pk), Decimal(300))
+                    except limits.DailyLimitExceeded:
+                        outcome = 'capped'
+                    except OperationalError:
+                        outcome = 'busy'  # SQLite was busy, the posting and its reservation were undone
+                    with lock:
+                        outcomes[outcome] += 1
+                        outcomes['allowed'] += allowed
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker) for _ in range(self.threads)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        # summed here rather than by the database, SQLite adds decimals as floats
+        withdrawn = sum(
+            Transaction.objects.filter(account=account, transaction_type=WITHDRAWAL).values_list('amount', flat=True),
+            Decimal(0),
+        )
+        self.assertEqual(withdrawn, 300 * outcomes['ok'])
+        self.assertGreater(outcomes['ok'], 0)
+        self.assertLessEqual(withdrawn, 2000)
+        self.assertEqual(Decimal(limits.quota('withdraw').used(account.pk)) / 100, withdrawn)
+        self.assertLessEqual(outcomes['allowed'], ratelimit.parse_rate(self.rate)[0])
+        self.assertLedgerConsistent([account])
+
+
+class BackfillDailyBalancesTests(LedgerAssertions, TestCase):
+    databases = '__all__'
+
+    def test_backfill_agrees_with_the_journal(self):
+        alice, bob = make_account('alice', 10000), make_account('bob', 50)
+        ledger.transfer(alice, bob, Decimal(25))
+        repaid = request_loan(alice, 1000)
+        ledger.disburse_loan(repaid)
+        ledger.repay_loan(repaid)
+        ledger.disburse_loan(request_loan(alice, 300))
+        request_loan(alice, 700)  # still pending, moves nothing
+        expected = {
+            snapshot.account_id: snapshot.closing_balance for snapshot in DailyBalance.objects.all()
+        }
+
+        DailyBalance.objects.all().delete()
+        call_command('backfill_daily_balances', stdout=io.StringIO())
+
+        self.assertEqual({
+            snapshot.account_id: snapshot.closing_balance for snapshot in DailyBalance.objects.all()
+        }, expected)
+        today = DailyBalance.objects.get(account=alice)
+        self.assertEqual((today.loans, today.loan_payments), (1300, 1000))
+        self.assertLedgerConsistent([alice, bob])
+        call_command('verify_journal', stdout=io.StringIO())
+
+
+class QueryBudgetTests(TransactionTestCase):
+    # a TransactionTestCase so the postings BEGIN and COMMIT as they do outside tests,
+    # instead of running in savepoints of the test's transaction
+    databases = '__all__'
+
+    def setUp(self):
+        caches['template_fragments'].clear()
+        self.alice, self.bob = make_account('alice', 5000), make_account('bob')
+        self.client.force_login(self.alice.user)
+
+    def post(self, url_name, data, *args, status=302):
+        # with an idempotency key, as the forms and well behaved API clients send them
+        response = assert_query_budget(
+            self.client, url_name, *args, method='post', data={**data, 'idempotency_key': uuid.uuid4().hex},
+        )
+        self.assertEqual(response.status_code, status, url_name)
+
+    def test_pages(self):
+        dates = {'start_date': '2000-01-01', 'end_date': '2100-01-01'}
+        for url_name in ('transaction_report', 'async_transaction_report'):
+            for query in ({}, dates):
+                caches['template_fragments'].clear()
+                self.assertEqual(assert_query_budget(self.client, url_name, data=query).status_code, 200)
+        for url_name in ('loan_list', 'api_balance', 'api_transactions', 'api_loans'):
+            self.assertEqual(assert_query_budget(self.client, url_name).status_code, 200, url_name)
+
+    def test_forms(self):
+        self.post('deposit_money', {'amount': 500})
+        self.post('withdraw_money', {'amount': 500})
+        self.post('transfer_money', {'receiver_account': self.bob.account_no, 'amount': 10})
+        self.post('loan_request', {'amount': 100})
+        self.post('async_deposit_money', {'amount': 500})
+        self.post('async_withdraw_money', {'amount': 500})
+        self.post('async_transfer_money', {'receiver_account': self.bob.account_no, 'amount': 10})
+
+    @skipUnless(sharding.enabled(), 'needs more than one ledger shard')
+    def test_transfer_to_another_shard(self):
+        carol = make_account('carol', shard=sharding.shards()[1])
+        self.post('transfer_money', {'receiver_account': carol.account_no, 'amount': 10})
+        self.post('async_transfer_money', {'receiver_account': carol.account_no, 'amount': 10})
+        self.post('api_transfer', {'receiver_account': carol.account_no, 'amount': 10}, status=200)
+        self.assertEqual(TransferSaga.objects.filter(state=SAGA_COMPLETED).count(), 3)
+
+    def test_api(self):
+        loan = request_loan(self.alice, 100)
+        ledger.disburse_loan(loan)
+        self.post('api_deposit', {'amount': 500}, status=200)
+        self.post('api_withdraw', {'amount': 500}, status=200)
+        self.post('api_transfer', {'receiver_account': self.bob.account_no, 'amount': 10}, status=200)
+        self.post('api_loans', {'amount': 100}, status=201)
+        self.post('api_repay_loan', {}, loan.pk, status=200)
+        User.objects.filter(pk=self.alice.user_id).update(is_staff=True)
+        self.assertEqual(assert_query_budget(
+            self.client, 'api_balances', method='post', data={'account_nos': [self.alice.account_no, self.bob.account_no]},
+        ).status_code, 200)
+
+
+class RequestValidationTests(TestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        self.alice = make_account('alice', 1000)
+        self.client.force_login(self.alice.user)
+
+    def test_unreadable_dates_are_a_bad_request(self):
+        dates = {'start_date': '2026-02-30', 'end_date': 'today'}
+        for url_name in (
+            'transaction_report', 'transaction_export', 'async_transaction_report', 'async_transaction_export',
+        ):
+            self.assertEqual(self.client.get(reverse(url_name), dates).status_code, 400, url_name)
+        response = self.client.get(reverse('api_transactions'), dates)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('YYYY-MM-DD', response.json()['error'])
+
+    def test_loan_amount_must_be_positive(self):
+        for amount in (0, -100):
+            form = LoanRequestForm({'amount': amount}, account=self.alice, initial={'transaction_type': LOAN})
+            self.assertFalse(form.is_valid())
+            self.assertEqual(self.client.post(reverse('api_loans'), {'amount': amount}).status_code, 400)
+        self.assertFalse(Transaction.objects.filter(transaction_type=LOAN).exists())
+
+
+class ReportCacheTests(TestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        caches['template_fragments'].clear()
+        self.alice = make_account('alice', 1000)
+
+    def rows(self, query='', start_date=None, end_date=None):
+        return report.page(self.alice, QueryDict(query), start_date, end_date, page_size=2)['rows']
+
+    def test_loans_refresh_the_cached_pages(self):
+        loan = request_loan(self.alice, 500)
+        ledger.deposit(self.alice, Decimal(5))
+        self.assertNotIn('1,505.00', self.rows())
+        with self.assertNumQueries(0):
+            self.rows()  # a full page, kept
+
+        with self.captureOnCommitCallbacks(execute=True):
+            ledger.disburse_loan(loan)
+        self.assertIn('1,505.00', self.rows())
+        with self.captureOnCommitCallbacks(execute=True):
+            ledger.repay_loan(loan)
+        self.assertIn('Loan Paid', self.rows())
+
+    def test_only_final_pages_are_cached(self):
+        today = timezone.localdate()
+        self.rows()
+        self.rows(start_date=today - timedelta(days=1), end_date=today)
+        ledger.deposit(self.alice, Decimal(5))
+        self.assertIn('1,005.00', self.rows())  # the last page, still open
+        self.assertIn('1,005.00', self.rows(start_date=today - timedelta(days=1), end_date=today))
+
+        self.rows(start_date=today - timedelta(days=7), end_date=today - timedelta(days=1))
+        with self.assertNumQueries(0):
+            self.rows(start_date=today - timedelta(days=7), end_date=today - timedelta(days=1))
+
+
+# the async view doesn't see the test's transaction on its connection and would read the empty replica
+@override_settings(DATABASE_REPLICAS=[])
+class ExportTests(TestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        self.alice = make_account('alice', 1000)
+        ledger.withdraw(self.alice, Decimal(250))
+        make_account('bob', 70)
+        now = timezone.now()
+        self.rows = list(Transaction.objects.filter(account=self.alice).order_by('id'))
+        for days, row in zip((10, 1), self.rows):
+            row.timestamp = now - timedelta(days=days)
+        Transaction.objects.bulk_update(self.rows, ['timestamp'])
+        self.client.force_login(self.alice.user)
+
+    def export(self, url_name='transaction_export', **params):
+        response = self.client.get(reverse(url_name), params)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        if response.is_async:
+            return ''.join(async_to_sync(self.read)(response.streaming_content))
+        return b''.join(response.streaming_content).decode()
+
+    async def read(self, content):
+        return [chunk.decode() async for chunk in content]
+
+    def test_csv(self):
+        deposit, withdrawal = self.rows
+        self.assertEqual(self.export().splitlines(), [
+            'id,timestamp,transaction_type,amount,balance_after_transaction',
+            f'{deposit.pk},{deposit.timestamp.isoformat()},Deposit,1000.00,1000.00',
+            f'{withdrawal.pk},{withdrawal.timestamp.isoformat()},Withdrawal,250.00,750.00',
+        ])
+
+    def test_date_range(self):
+        today = timezone.localdate()
+        dates = {'start_date': str(today - timedelta(days=3)), 'end_date': str(today)}
+        lines = self.export(format='jsonl', **dates).splitlines()
+        self.assertEqual([json.loads(line)['id'] for line in lines], [self.rows[1].pk])
+        lines = self.export('async_transaction_export', **dates).splitlines()
+        self.assertEqual([json.loads(line) for line in lines], [{
+            'id': self.rows[1].pk, 'timestamp': self.rows[1].timestamp.isoformat(), 'transaction_type': 'Withdrawal',
+            'amount': '250.00', 'balance_after_transaction': '750.00',
+        }])
+        dates['end_date'] = str(today - timedelta(days=30))
+        self.assertEqual(self.export(**dates).splitlines()[1:], [])
+
+    def test_rows_are_fetched_in_chunks(self):
+        execute_sql = SQLCompiler.execute_sql
+        with mock.patch.object(SQLCompiler, 'execute_sql', autospec=True, side_effect=execute_sql) as spy:
+            response = self.client.get(reverse('transaction_export'))
+            queries = spy.call_count
+            self.assertEqual(len(b''.join(response.streaming_content).splitlines()), 3)
+        # the history is only read once the body streams, through a chunked cursor
+        self.assertEqual(spy.call_count, queries + 1)
+        self.assertEqual(spy.call_args.kwargs, {'chunked_fetch': True, 'chunk_size': 2000})
+
+    def test_unknown_format(self):
+        self.assertEqual(self.client.get(reverse('transaction_export'), {'format': 'xml'}).status_code, 400)
+
+
+class StandingOrderTests(LedgerAssertions, TestCase):
+    databases = '__all__'
+
+    def order(self, account, receiver, amount):
+        due = timezone.now() - timedelta(minutes=1)
+        return StandingOrder.objects.create(
+            account=account, receiver_account_no=receiver.account_no, amount=Decimal(amount), frequency=MONTHLY,
+            starts_at=due, next_run_at=due,
+        )
+
+    def test_an_order_the_ledger_refuses_fails_alone(self):
+        alice, bob, carol = make_account('alice', 1000), make_account('bob'), make_account('carol', 1000)
+        paid, refused = self.order(alice, bob, 50), self.order(carol, bob, 70)
+        transfer_many = ledger.transfer_many
+
+        def refuse_carol(transfers, *args, **kwargs):
+            # what transfer_many does when a balance moved under the batch
+            if any(sender.pk == carol.pk for _, sender, _, _ in transfers):
+                raise ledger.InsufficientFunds('A balance changed while the transfers were being posted')
+            return transfer_many(transfers, *args, **kwargs)
+
+        with mock.patch.object(ledger, 'transfer_many', refuse_carol):
+            self.assertEqual(standing_orders.drain(), (1, 1))
+
+        for order in (paid, refused):
+            order.refresh_from_db()
+            self.assertGreater(order.next_run_at, timezone.now())
+            self.assertEqual(order.claimed_by, '')
+        self.assertEqual([run.succeeded for run in paid.runs.all()], [True])
+        self.assertEqual([run.succeeded for run in refused.runs.all()], [False])
+        bob.refresh_from_db()
+        self.assertEqual(bob.balance, 50)
+        self.assertLedgerConsistent([alice, bob, carol])
+
+    def test_form_finds_the_receiver_in_the_directory(self):
+        alice, bob = make_account('alice'), make_account('bob')
+        start = timezone.now().strftime('%Y-%m-%dT%H:%M')
+        form = StandingOrderForm(
+            {'receiver_account': bob.account_no, 'amount': 25, 'frequency': MONTHLY, 'starts_at': start}, account=alice,
+        )
+        self.assertTrue(form.is_valid(), form.errors)
+        order = form.save()
+        self.assertEqual((order.account_id, order.receiver_account_no), (alice.pk, bob.account_no))
+        form = StandingOrderForm(
+            {'receiver_account': 1, 'amount': 25, 'frequency': MONTHLY, 'starts_at': start}, account=alice,
+        )
+        self.assertEqual(form.errors['receiver_account'], ['No account found with account no 1'])
+
+    def test_an_order_to_another_shard_is_paid_with_a_saga(self):
+        alice, bob = make_account('alice', 1000), make_account('bob')
+        order = self.order(alice, bob, 50)
+        with mock.patch.object(standing_orders.sharding, 'same_shard', return_value=False):
+            self.assertEqual(standing_orders.drain(), (1, 0))
+
+        self.assertEqual(list(TransferSaga.objects.values_list('receiver_account_no', 'state')), [(bob.account_no, SAGA_COMPLETED)])
+        self.assertEqual([run.succeeded for run in order.runs.all()], [True])
+        order.refresh_from_db()
+        self.assertGreater(order.next_run_at, timezone.now())
+        bob.refresh_from_db()
+        self.assertEqual(bob.balance, 50)
+        self.assertLedgerConsistent([alice, bob])
+
+    def test_an_order_to_a_closed_account_stops(self):
+        alice, bob = make_account('alice', 1000), make_account('bob')
+        order = self.order(alice, bob, 50)
+        bob.delete()
+        self.assertEqual(standing_orders.drain(), (0, 1))
+
+        order.refresh_from_db()
+        self.assertFalse(order.active)
+        self.assertEqual(
+            list(order.runs.values_list('succeeded', 'error')), [(False, f'No account found with account no {bob.account_no}')],
+        )
+        alice.refresh_from_db()
+        self.assertEqual(alice.balance, 1000)
+
+
+class BulkTransferTests(LedgerAssertions, TestCase):
+    databases = '__all__'
+
+    def parse(self, text, fmt='csv'):
+        return list(batch.parse_lines(io.StringIO(text), fmt))
+
+    def test_parse_csv(self):
+        unreadable = 'Could not read account_no and amount'
+        self.assertEqual(self.parse('account_no,amount\n123,10\n\nabc,5\n456\n789, 7.5\n'), [
+            (2, 123, Decimal('10.00'), None),
+            (4, None, None, unreadable),
+            (5, None, None, unreadable),
+            (6, 789, Decimal('7.50'), None),
+        ])
+        # only a first line without an account number is a header
+        self.assertEqual(self.parse('123,10\n'), [(1, 123, Decimal('10.00'), None)])
+        self.assertEqual(self.parse('123,ten\n456,5\n'), [(1, None, None, unreadable), (2, 456, Decimal('5.00'), None)])
+
+    def test_parse_jsonl(self):
+        self.assertEqual(self.parse('{"account_no": 1, "amount": "2.5"}\n\n{"account_no": 2}\nnot json\n', 'jsonl'), [
+            (1, 1, Decimal('2.50'), None),
+            (3, None, None, 'Could not read account_no and amount'),
+            (4, None, None, 'Could not read account_no and amount'),
+        ])
+
+    def test_batch_runs_out_of_money_partway(self):
+        cache.clear()
+        alice, bob, carol = make_account('alice', 1000), make_account('bob'), make_account('carol')
+        csv_lines = '\n'.join([
+            'account_no,amount',
+            f'{bob.account_no},400',
+            '1,50',  # no such account
+            f'{carol.account_no},700',  # more than the 600 left
+            f'{carol.account_no},oops',
+            f'{alice.account_no},10',
+            f'{bob.account_no},0',
+            f'{carol.account_no},100',  # still covered
+        ])
+        balance, results = batch.run_batch(alice, batch.parse_lines(io.StringIO(csv_lines)))
+
+        self.assertEqual(balance, 500)
+        self.assertEqual([(result['line'], result['status'], result.get('error')) for result in results], [
+            (2, 'ok', None),
+            (3, 'rejected', 'No account found with account no 1'),
+            (4, 'rejected', 'Insufficient balance'),
+            (5, 'rejected', 'Could not read account_no and amount'),
+            (6, 'rejected', 'You can not transfer money to your own account'),
+            (7, 'rejected', 'Amount must be greater than zero'),
+            (8, 'ok', None),
+        ])
+        for account in (alice, bob, carol):
+            account.refresh_from_db()
+        self.assertEqual((alice.balance, bob.balance, carol.balance), (500, 400, 100))
+        # the rejected lines are given back to the daily bulk cap
+        self.assertEqual(limits.quota('bulk_transfer').used(alice.pk), 500 * 100)
+        self.assertEqual(QueuedEmail.objects.count(), 3)  # alice's summary, bob's and carol's
+        self.assertLedgerConsistent([alice, bob, carol])
+
+
+class LoanDecisionTests(LedgerAssertions, TestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        self.alice, self.bob = make_account('alice', 100), make_account('bob')
+        self.loans = [request_loan(self.alice, 200), request_loan(self.alice, 300), request_loan(self.bob, 500)]
+        self.ids = [loan.pk for loan in self.loans]
+
+    def assertLoans(self, account, balance, active_loans, outstanding_loan):
+        account.refresh_from_db()
+        self.assertEqual(
+            (account.balance, account.active_loans, account.outstanding_loan), (balance, active_loans, outstanding_loan),
+        )
+
+    def test_approve_credits_every_account_once(self):
+        rejected = request_loan(self.bob, 50)
+        ledger.reject_loans([rejected.pk])
+        deposit = Transaction.objects.filter(account=self.alice, transaction_type=DEPOSIT).get()
+        with self.captureOnCommitCallbacks(execute=True):
+            loans = approve_loans_and_notify(self.ids + [rejected.pk, deposit.pk])
+
+        self.assertEqual([loan.pk for loan in loans], self.ids)
+        self.assertEqual([loan.balance_after_transaction for loan in loans], [300, 600, 500])
+        self.assertLoans(self.alice, 600, 2, 500)
+        self.assertLoans(self.bob, 500, 1, 500)
+        self.assertEqual(list(Transaction.objects.filter(pk__in=self.ids).values_list('loan_approve', flat=True)), [True] * 3)
+        self.assertEqual(QueuedEmail.objects.filter(subject='Loan Approval').count(), 3)
+        self.assertLedgerConsistent([self.alice, self.bob])
+        # a second approval of the same loans credits nothing
+        self.assertEqual(approve_loans_and_notify(self.ids), [])
+        self.assertLoans(self.alice, 600, 2, 500)
+
+    def test_reject_moves_no_money(self):
+        lines = JournalLine.objects.count()
+        with mock.patch.object(report, 'expire') as expire:
+            loans = reject_loans_and_notify(self.ids[:2])
+        expire.assert_called_once_with({self.alice.pk})
+        self.assertEqual([loan.loan_rejected for loan in loans], [True, True])
+        self.assertEqual(JournalLine.objects.count(), lines)
+        self.assertLoans(self.alice, 100, 0, 0)
+        self.assertEqual(QueuedEmail.objects.filter(subject='Loan Rejected').count(), 2)
+        # rejected loans can't be approved afterwards
+        self.assertEqual([loan.pk for loan in ledger.approve_loans(self.ids)], self.ids[2:])
+        self.assertLoans(self.alice, 100, 0, 0)
+        self.assertLoans(self.bob, 500, 1, 500)
+        self.assertLedgerConsistent([self.alice, self.bob])
+
+    def test_admin_actions(self):
+        staff = User.objects.create_superuser('staff', 'staff@example.com', 'pass-1234')
+        self.client.force_login(staff)
+        url = reverse('admin:transactions_transaction_changelist')
+        response = self.client.post(url, {'action': 'reject_loans', '_selected_action': self.ids[2:]}, follow=True)
+        self.assertContains(response, 'Rejected 1 loans')
+        response = self.client.post(url, {'action': 'approve_loans', '_selected_action': self.ids}, follow=True)
+        self.assertContains(response, 'Approved 2 loans for 500.00 $')
+        self.assertLoans(self.alice, 600, 2, 500)
+        self.assertLoans(self.bob, 0, 0, 0)
+        self.assertLedgerConsistent([self.alice, self.bob])
+
+    def test_decide_loans_command(self):
+        out = io.StringIO()
+        call_command('decide_loans', self.ids[0], '--reject', stdout=out)
+        call_command('decide_loans', '--all-pending', '--batch-size', '1', stdout=out)
+        call_command('decide_loans', *self.ids, stdout=out)
+        self.assertEqual(out.getvalue().splitlines(), [
+            'Rejected 1 loans for 200.00 $',
+            'Approved 2 loans for 800.00 $',
+            'Approved 0 loans for 0 $, 3 were not pending',
+        ])
+        self.assertLoans(self.alice, 400, 1, 300)
+        self.assertLoans(self.bob, 500, 1, 500)
+        self.assertLedgerConsistent([self.alice, self.bob])
+
+    def test_loan_list_is_paged(self):
+        third = request_loan(self.alice, 400)
+        self.client.force_login(self.alice.user)
+        url = reverse('api_loans')
+        first = self.client.get(url, {'page_size': 2}).json()
+        self.assertEqual([loan['id'] for loan in first['loans']], self.ids[:2])
+        rest = self.client.get(url, {'page_size': 2, 'cursor': first['next_cursor']}).json()
+        self.assertEqual(rest, {'loans': [{
+            'id': third.pk, 'amount': '400.00', 'timestamp': rest['loans'][0]['timestamp'],
+            'loan_approve': False, 'loan_rejected': False,
+        }], 'next_cursor': None})
+        self.assertEqual(self.client.get(url, {'page_size': 'all'}).status_code, 400)
+
+
+class LoanCounterTests(TestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        self.alice, self.bob = make_account('alice', 100), make_account('bob')
+        loans = [request_loan(self.alice, 200), request_loan(self.alice, 300), request_loan(self.alice, 400)]
+        request_loan(self.bob, 500)  # pending, not counted
+        ledger.approve_loans([loan.pk for loan in loans])
+        ledger.repay_loan(Transaction.objects.get(pk=loans[0].pk))
+        UserBankAccount.objects.update(active_loans=9, outstanding_loan=9)
+
+    def assertCounters(self):
+        self.assertEqual(
+            list(UserBankAccount.objects.order_by('pk').values_list('active_loans', 'outstanding_loan')),
+            [(2, 700), (0, 0)],
+        )
+
+    def test_rebuild_command(self):
+        out = io.StringIO()
+        call_command('rebuild_loan_counters', stdout=out)
+        self.assertEqual(out.getvalue(), 'Rebuilt loan counters for 2 accounts\n')
+        self.assertCounters()
+
+    def test_migration_backfill(self):
+        migration = importlib.import_module('transactions.migrations.0005_loan_list_index')
+        migration.fill_loan_counters(apps, None)
+        self.assertCounters()
+
+
+@override_settings(INTEREST_RATES={'Savings': Decimal('0.036')}, INTEREST_DAY_COUNT=360)
+class InterestTests(LedgerAssertions, TestCase):
+    databases = '__all__'
+
+    start, end = date(2026, 9, 1), date(2026, 10, 1)
+
+    def test_balance_days(self):
+        rows = [(date(2026, 9, 11), Decimal(100), Decimal(300)), (date(2026, 9, 21), Decimal(300), Decimal(0))]
+        self.assertEqual(interest.balance_days(Decimal(100), rows, self.start, self.end), 10 * 100 + 10 * 300)
+        self.assertEqual(interest.balance_days(Decimal(200), [], self.start, self.end), 30 * 200)
+        # opened in the month: nothing before its first snapshot's opening balance
+        rows = [(date(2026, 9, 16), Decimal(0), Decimal(500))]
+        self.assertEqual(interest.balance_days(None, rows, self.start, self.end), 15 * 500)
+
+    def test_accrual_amount(self):
+        # 30 days of 1000 at 3.6% a year over a 360 day year
+        self.assertEqual(interest.accrue(Decimal(1000), [], self.start, self.end, Decimal('0.036')), Decimal('3.00'))
+        # rounded to the cent, half a cent up
+        self.assertEqual(interest.accrue(Decimal('1.5'), [], self.start, self.end, Decimal('0.1')), Decimal('0.01'))
+        self.assertEqual(interest.accrue(Decimal('1.8'), [], self.start, self.end, Decimal('0.1')), Decimal('0.02'))
+
+    def accounts(self):
+        period = interest.previous_month()
+        accounts = [make_account(f'saver{n}', 1000 * (n + 1)) for n in range(3)]
+        # the deposits were made before the month, so it is paid on the whole balance
+        DailyBalance.objects.filter(account__in=accounts).update(date=period - timedelta(days=1))
+        return period, accounts
+
+    def test_rerun_after_a_crash_credits_nobody_twice(self):
+        period, accounts = self.accounts()
+        rates = interest.interest_rates()
+        run = interest.start_run(period)
+        self.assertEqual(interest.run_chunk(run, rates, 1), 1)
+        with mock.patch.object(ledger, 'credit_many', side_effect=OperationalError('the server went away')):
+            with self.assertRaises(OperationalError):
+                interest.run_chunk(run, rates, 1)
+
+        # the second chunk was rolled back with its checkpoint, the rerun carries on from the first
+        stored = InterestRun.objects.get(pk=run.pk)
+        self.assertEqual((stored.last_account_id, stored.accounts_credited), (accounts[0].pk, 1))
+        call_command('accrue_interest', month=f'{period:%Y-%m}', chunk_size=1, stdout=io.StringIO(), stderr=io.StringIO())
+
+        days = (interest.month_bounds(period)[1] - period).days
+        expected = {
+            account.pk: (account.balance * days * Decimal('0.036') / 360).quantize(Decimal('0.01')) for account in accounts
+        }
+        paid = dict(Transaction.objects.filter(transaction_type=INTEREST).values_list('account_id', 'amount'))
+        self.assertEqual(paid, expected)
+        self.assertEqual(Transaction.objects.filter(transaction_type=INTEREST).count(), 3)
+        stored.refresh_from_db()
+        self.assertEqual((stored.accounts_credited, stored.total_interest), (3, sum(expected.values())))
+        self.assertIsNotNone(stored.finished)
+        # the crashed process's copy of the run can't post its chunk again
+        with self.assertRaises(interest.InterestRunConflict):
+            interest.run_chunk(run, rates, 1)
+        # and a third run of the command pays nothing more
+        call_command('accrue_interest', month=f'{period:%Y-%m}', stdout=io.StringIO())
+        self.assertEqual(Transaction.objects.filter(transaction_type=INTEREST).count(), 3)
+        for account in accounts:
+            account.refresh_from_db()
+        self.assertLedgerConsistent(accounts)
+
+
+@skipUnless(sharding.enabled(), 'needs more than one ledger shard, run with LOCAL_SQLITE_SHARDS=2')
+class ShardedLedgerTests(LedgerAssertions, TestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        self.home, self.away = sharding.shards()[:2]
+        self.alice = make_account('alice', 1000, shard=self.home)
+        self.bob = make_account('bob', shard=self.away)
+
+    def transit(self):
+        # what is on its way between shards, nothing once every saga has finished
+        balance = Decimal(0)
+        for alias in sharding.shards():
+            for side, amount in JournalLine.objects.using(alias).filter(book=TRANSIT).values_list('side', 'amount'):
+                balance += amount if side == DEBIT else -amount
+        return balance
+
+    def test_accounts_are_found_on_their_shard(self):
+        found = find_accounts([self.alice.account_no, self.bob.account_no, 1])
+        self.assertEqual(
+            {account_no: account._state.db for account_no, account in found.items()},
+            {self.alice.account_no: self.home, self.bob.account_no: self.away},
+        )
+        self.assertEqual(found[self.bob.account_no].user.username, 'bob')
+        self.assertEqual(find_account(self.bob.account_no).pk, self.bob.pk)
+
+    def test_transfer_between_shards_is_a_saga(self):
+        transfer_and_notify(self.alice, self.bob, Decimal(200))
+
+        self.assertEqual(list(TransferSaga.objects.values_list('state', flat=True)), [SAGA_COMPLETED])
+        self.assertEqual((find_account(self.alice.account_no).balance, find_account(self.bob.account_no).balance), (800, 200))
+        self.assertEqual(self.transit(), 0)
+        self.assertLedgerConsistent([self.alice, self.bob])
+
+    def test_a_failed_credit_refunds_the_sender(self):
+        deposit = ledger.deposit
+
+        def refuse(account, amount, transaction_type=DEPOSIT):
+            if transaction_type == RECEIVE_MONEY:
+                raise ledger.InvalidPosting('the receiving shard says no')
+            return deposit(account, amount, transaction_type)
+
+        with mock.patch.object(ledger, 'deposit', refuse), self.assertRaises(sagas.TransferFailed):
+            transfer_and_notify(self.alice, self.bob, Decimal(200))
+
+        self.assertEqual(list(TransferSaga.objects.values_list('state', flat=True)), [SAGA_COMPENSATED])
+        self.assertEqual((find_account(self.alice.account_no).balance, find_account(self.bob.account_no).balance), (1000, 0))
+        self.assertEqual(self.transit(), 0)
+        self.assertLedgerConsistent([self.alice, self.bob])
+
+    def test_standing_orders_run_on_the_payers_shard(self):
+        carol = make_account('carol', shard=self.home)
+        due = timezone.now() - timedelta(minutes=1)
+        for receiver in (carol, self.bob):
+            StandingOrder.objects.create(
+                account=self.alice, receiver_account_no=receiver.account_no, amount=Decimal(50), frequency=MONTHLY,
+                starts_at=due, next_run_at=due,
+            )
+        self.assertEqual(StandingOrder.objects.using(self.home).count(), 2)
+
+        self.assertEqual(standing_orders.drain(), (2, 0))
+        self.assertEqual(list(TransferSaga.objects.values_list('state', flat=True)), [SAGA_COMPLETED])
+        self.assertEqual([find_account(account.account_no).balance for account in (self.alice, carol, self.bob)], [900, 50, 50])
+        self.assertLedgerConsistent([self.alice, carol, self.bob])
+
+    def test_bulk_transfer_pays_every_shard(self):
+        carol = make_account('carol', shard=self.home)
+        balance, results = batch.run_batch(self.alice, [
+            (1, carol.account_no, Decimal(100), None),
+            (2, self.bob.account_no, Decimal(300), None),
+            (3, self.bob.account_no, Decimal(700), None),
+        ])
+
+        self.assertEqual([result['status'] for result in results], ['ok', 'ok', 'rejected'])
+        self.assertEqual(balance, 600)
+        self.assertEqual([find_account(account.account_no).balance for account in (carol, self.bob)], [100, 300])
+        self.assertEqual(self.transit(), 0)
+        self.assertLedgerConsistent([self.alice, carol, self.bob])
+
+    def test_transfer_many_keeps_to_its_shard(self):
+        carol = make_account('carol', shard=self.home)
+        accepted, rejected = ledger.transfer_many([(1, self.alice, carol, Decimal(10)), (2, self.alice, self.bob, Decimal(10))])
+        self.assertEqual([key for key, *_ in accepted], [1])
+        self.assertEqual([key for key, _ in rejected], [2])
+        self.assertLedgerConsistent([self.alice, carol, self.bob])
@@ -1,14 +1,25 @@
 from django.urls import path
-from .views import DepositMoneyView, WithdrawMoneyView, TransactionReportView,LoanRequestView,LoanListView,PayLoanView,transfer_money
+from . import async_views
+from .views import DepositMoneyView, WithdrawMoneyView, TransactionReportView,LoanRequestView,LoanListView,PayLoanView,transfer_money,bulk_transfer,export_transactions,StandingOrderView,cancel_standing_order
 
 
 # app_name = 'transactions'
 urlpatterns = [
     path("deposit/", DepositMoneyView.as_view(), name="deposit_money"),
     path("report/", TransactionReportView.as_view(), name="transaction_report"),
+    path("report/export/", export_transactions, name="transaction_export"),
     path("withdraw/", WithdrawMoneyView.as_view(), name="withdraw_money"),
     path("loan_request/", LoanRequestView.as_view(), name="loan_request"),
     path("loans/", LoanListView.as_view(), name="loan_list"),
     path("loans/<int:loan_id>/", PayLoanView.as_view(), name="pay"),
     path('transfer_money/', transfer_money, name='transfer_money'),
+    path('transfer_money/bulk/', bulk_transfer, name='bulk_transfer'),
+    path('standing_orders/', StandingOrderView.as_view(), name='standing_orders'),
+    path('standing_orders/<int:order_id>/cancel/', cancel_standing_order, name='cancel_standing_order'),
+    # the same flows as async views, serve them with uvicorn swiss_bank.asgi:application
+    path("async/deposit/", async_views.deposit_money, name="async_deposit_money"),
+    path("async/withdraw/", async_views.withdraw_money, name="async_withdraw_money"),
+    path("async/transfer_money/", async_views.transfer_money, name="async_transfer_money"),
+    path("async/report/", async_views.transaction_report, name="async_transaction_report"),
+    path("async/report/export/", async_views.export_transactions, name="async_transaction_export"),
 ]
\ No newline at end of file
@@ -1,36 +1,133 @@
 from django.contrib import messages
+from django.contrib.auth.decorators import login_required
 from django.contrib.auth.mixins import LoginRequiredMixin
+from django.core.exceptions import BadRequest
 from django.urls import reverse_lazy
 from django.utils import timezone
 from django.shortcuts import get_object_or_404, redirect, render
 from django.views import View
-from django.http import HttpResponse
+from django.utils.decorators import method_decorator
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.views.decorators.http import require_POST
 from django.views.generic import CreateView, ListView
-from transactions.constants import DEPOSIT, WITHDRAWAL,LOAN, LOAN_PAID, RECEIVE_MONEY, TRANSFER_MONEY
-from django.core.mail import EmailMessage, EmailMultiAlternatives
+from transactions.constants import DEPOSIT, WITHDRAWAL,LOAN, LOAN_PAID, RECEIVE_MONEY, TRANSFER_MONEY, TRANSACTION_TYPE_NAMES
 from django.template.loader import render_to_string
+from django.db import DEFAULT_DB_ALIAS
+from django.db.transaction import atomic
 from datetime import datetime
-from django.db.models import Sum
-from accounts.models import UserBankAccount
+from accounts.directory import find_account
 from transactions.forms import (
     DepositForm,
     WithdrawForm,
     LoanRequestForm,
     TransferForm,
+    StandingOrderForm,
 )
-from transactions.models import Transaction
+from transactions.models import StandingOrder, Transaction
+from transactions import batch, ledger, limits, report, sagas
+from transactions.pagination import date_range
+from core.idempotency import idempotent
+from core.ratelimit import ratelimit
+from core import sharding
+from core.routing import read_db, reads_from_replica
+from core.mail import queue_email, queue_emails
+from contextlib import ExitStack, contextmanager
 from decimal import Decimal
+import csv
+import io
+import itertools
+import json
 
 def send_transaction_email(user, amount, subject, template):
+        # the mail is only queued here, `manage.py send_queued_mail` does the SMTP work
         message = render_to_string(template, {
             'user' : user,
             'amount' : amount,
         })
-        send_email = EmailMultiAlternatives(subject, '', to=[user.email])
-        send_email.attach_alternative(message, "text/html")
-        send_email.send()
+        queue_email(subject, message, user.email)
+
+@contextmanager
+def posting(account):
+    """
+    The transaction of a posting on the account's shard, which the ledger joins instead of
+    opening a savepoint of its own. The mails are queued on 'default', in the same
+    transaction unless the account is on another shard.
+    """
+    with ExitStack() as stack:
+        if sharding.shard_of(account) != DEFAULT_DB_ALIAS:
+            stack.enter_context(atomic())
+        stack.enter_context(sharding.atomic(account))
+        yield
+
+
+# a posting and its mails commit together, shared by the html, async and api views
+def deposit_and_notify(account, amount):
+    with posting(account):
+        ledger.deposit(account, amount)
+        send_transaction_email(account.user, amount, 'Deposit Message', 'transactions/deposit_email.html')
+
+
+def withdraw_and_notify(account, amount):
+    # the daily caps (limits.py) raise a LedgerError like the ledger's own checks
+    with limits.reserve('withdraw', account, amount), posting(account):
+        ledger.withdraw(account, amount)
+        send_transaction_email(account.user, amount, 'Withdrawal Message', 'transactions/withdrawal_email.html')
+
+
+def transfer_and_notify(sender, receiver, amount):
+    with limits.reserve('transfer', sender, amount):
+        if sharding.same_shard(sender, receiver):
+            with posting(sender):
+                ledger.transfer(sender, receiver, amount)
+                _transfer_mails(sender, receiver, amount)
+        else:
+            # each saga step commits on its own shard, the mails follow once it is done
+            sagas.transfer(sender, receiver, amount)
+            with atomic():
+                _transfer_mails(sender, receiver, amount)
+
+
+def _transfer_mails(sender, receiver, amount):
+    send_transaction_email(sender.user, amount, "Transfer money Mail", "transactions/sender_mail.html")
+    send_transaction_email(receiver.user, amount, "Receive money Mail", "transactions/receiver_mail.html")
+
+def _loan_mails(loans, subject, template):
+    return [
+        (subject, render_to_string(template, {'user': loan.account.user, 'amount': loan.amount}), loan.account.user.email)
+        for loan in loans
+    ]
+
+
+# used by the admin actions and `manage.py decide_loans`, one transaction for the whole selection
+def approve_loans_and_notify(loan_ids):
+    with atomic():
+        loans = ledger.approve_loans(loan_ids)
+        queue_emails(_loan_mails(loans, 'Loan Approval', 'transactions/admin_email.html'))
+    return loans
+
+
+def reject_loans_and_notify(loan_ids):
+    with atomic():
+        loans = ledger.reject_loans(loan_ids)
+        queue_emails(_loan_mails(loans, 'Loan Rejected', 'transactions/loan_rejected_email.html'))
+    return loans
+
+def requested_dates(request):
+    # the start_date/end_date filter shared by the report and the export, a date that
+    # doesn't parse is the client's mistake: BadRequest turns into a 400
+    start_date_str = request.GET.get('start_date')
+    end_date_str = request.GET.get('end_date')
+    if start_date_str and end_date_str:
+        try:
+            start_date = datetime.strptime(start_date_str, '%Y-%m-%d').date()
+            end_date = datetime.strptime(end_date_str, '%Y-%m-%d').date()
+        except ValueError:
+            raise BadRequest('start_date and end_date must be dates as YYYY-MM-DD')
+        return start_date, end_date
+    return None, None
 
 # Create your views here.
+@method_decorator(idempotent, name='dispatch')
 class TransactionCreateMixin(LoginRequiredMixin, CreateView):
     template_name = 'transactions/transaction_form.html'
     model = Transaction
@@ -63,19 +160,15 @@ class DepositMoneyView(TransactionCreateMixin):
 
     def form_valid(self, form):
         amount = form.cleaned_data.get('amount')
-        account = self.request.user.account
-        account.balance += amount
-        account.save(
-            update_fields = ['balance']
-        )
+        deposit_and_notify(self.request.user.account, amount)
         messages.success(
             self.request,
             f'${"{:,.2f}".format(float(amount))} is deposited to your account successfully'
         )
-        send_transaction_email(self.request.user,amount,'Deposit Message','transactions/deposit_email.html')
-        return super().form_valid(form)
+        return redirect(self.success_url)
 
 
+@method_decorator(ratelimit('withdraw'), name='dispatch')
 class WithdrawMoneyView(TransactionCreateMixin):
     form_class = WithdrawForm
     title = 'Withdraw Money'
@@ -86,15 +179,18 @@ class WithdrawMoneyView(TransactionCreateMixin):
 
     def form_valid(self, form):
         amount = form.cleaned_data.get('amount')
-        self.request.user.account.balance -= form.cleaned_data.get('amount')
-        self.request.user.account.save(update_fields=['balance'])
+        try:
+            withdraw_and_notify(self.request.user.account, amount)
+        except ledger.LedgerError as e:
+            # the balance changed since the form was validated
+            form.add_error('amount', str(e))
+            return self.form_invalid(form)
 
         messages.success(
             self.request,
             f'Successfully withdrawn {"{:,.2f}".format(float(amount))}$ from your account'
         )
-        send_transaction_email(self.request.user,amount,'Withdrawal Message','transactions/withdrawal_email .html')
-        return super().form_valid(form)
+        return redirect(self.success_url)
     
 class LoanRequestView(TransactionCreateMixin):
     form_class = LoanRequestForm
@@ -106,147 +202,200 @@ class LoanRequestView(TransactionCreateMixin):
 
     def form_valid(self, form):
         amount = form.cleaned_data.get('amount')
-        current_loan_count = Transaction.objects.filter(
-            account=self.request.user.account,transaction_type=3,loan_approve=True).count()
-        if current_loan_count >= 3:
+        # counter kept by the ledger, already loaded with request.user
+        if self.request.user.account.active_loans >= 3:
             return HttpResponse('You have crossed your loan limits')
          
+        with atomic():
+            send_transaction_email(self.request.user,amount,'Loan Request','transactions/loan_email.html')
+            response = super().form_valid(form)
         messages.success(self.request,f"Congratulations, your loan request for ${amount} has been approved!")
-        send_transaction_email(self.request.user,amount,'Loan Request','transactions/loan_email.html')
-        return super().form_valid(form)
+        return response
     
 
+@method_decorator(reads_from_replica, name='dispatch')
 class TransactionReportView(LoginRequiredMixin,ListView):
     template_name = 'transactions/transaction_report.html'
     model = Transaction
-    balance = 0
+    page_size = report.PAGE_SIZE
     # context_object_name = 'report_list'
 
     def get_queryset(self):
-        queryset = super().get_queryset().filter(
+        return super().get_queryset().filter(
             account=self.request.user.account
         )
-        start_date_str = self.request.GET.get('start_date')
-        end_date_str = self.request.GET.get('end_date')
-        
-        if start_date_str and end_date_str:
-            start_date = datetime.strptime(start_date_str, '%Y-%m-%d').date()
-            end_date = datetime.strptime(end_date_str, '%Y-%m-%d').date()
-            
-            queryset = queryset.filter(timestamp__date__gte=start_date, timestamp__date__lte=end_date)
-            self.balance = Transaction.objects.filter(
-                timestamp__date__gte=start_date, timestamp__date__lte=end_date
-            ).aggregate(Sum('amount'))['amount__sum']
-        else:
-            self.balance = self.request.user.account.balance
-       
-        return queryset.distinct() # has to be a unique query set
     
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context.update({
-            'account': self.request.user.account
-        })
+        start_date, end_date = requested_dates(self.request)
+        # the statement and one page of rows, a final page is rendered once (transactions/report.py)
+        context.update(report.page(self.request.user.account, self.request.GET, start_date, end_date, self.page_size))
+        context['account'] = self.request.user.account
 
         return context
     
 
+class Echo:
+    # csv.writer wants a file, this one hands each formatted line straight back
+    def write(self, value):
+        return value
+
+
+EXPORT_FIELDS = ['id', 'timestamp', 'transaction_type', 'amount', 'balance_after_transaction']
+
+
+@login_required
+@reads_from_replica
+def export_transactions(request):
+    export_format = request.GET.get('format', 'csv')
+    if export_format not in ('csv', 'jsonl'):
+        return HttpResponse('format must be csv or jsonl', status=400)
+
+    # the rows are read while streaming, after the view returned, so the database is fixed here
+    queryset = Transaction.objects.using(read_db(Transaction)).filter(account=request.user.account)
+    start_date, end_date = requested_dates(request)
+    if start_date and end_date:
+        start, end = date_range(start_date, end_date)
+        queryset = queryset.filter(timestamp__gte=start, timestamp__lt=end)
+    # plain tuples fetched chunk by chunk, memory stays flat however long the history is
+    rows = queryset.order_by('timestamp', 'id').values_list(*EXPORT_FIELDS).iterator(chunk_size=2000)
+    type_names = dict(TRANSACTION_TYPE_NAMES)
+
+    if export_format == 'csv':
+        writer = csv.writer(Echo())
+        lines = itertools.chain(
+            [writer.writerow(EXPORT_FIELDS)],
+            (writer.writerow([pk, timestamp.isoformat(), type_names.get(transaction_type, transaction_type), amount, balance])
+             for pk, timestamp, transaction_type, amount, balance in rows),
+        )
+        content_type = 'text/csv'
+    else:
+        lines = (
+            json.dumps({
+                'id': pk,
+                'timestamp': timestamp.isoformat(),
+                'transaction_type': type_names.get(transaction_type, transaction_type),
+                'amount': str(amount),
+                'balance_after_transaction': str(balance),
+            }) + '\n'
+            for pk, timestamp, transaction_type, amount, balance in rows
+        )
+        content_type = 'application/x-ndjson'
+
+    response = StreamingHttpResponse(lines, content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="statement-{request.user.account.account_no}.{export_format}"'
+    return response
+
+
 class PayLoanView(LoginRequiredMixin, View):
     def get(self, request, loan_id):
-        loan = get_object_or_404(Transaction, id=loan_id)
+        loan = get_object_or_404(Transaction, id=loan_id, account=request.user.account)
         # print(loan)
         if loan.loan_approve:
-            user_account = loan.account
-                # Reduce the loan amount from the user's balance
-                # 5000, 500 + 5000 = 5500
-                # balance = 3000, loan = 5000
-            if loan.amount < user_account.balance:
-                user_account.balance -= loan.amount
-                loan.balance_after_transaction = user_account.balance
-                user_account.save()
-                loan.loan_approved = True
-                loan.transaction_type = LOAN_PAID
-                loan.save()
-                return redirect('transactions:loan_list')
-            else:
-                messages.error(
-            self.request,
-            f'Loan amount is greater than available balance'
-        )
+            try:
+                ledger.repay_loan(loan)
+            except ledger.LedgerError as e:
+                messages.error(self.request, str(e))
 
         return redirect('loan_list')
     
+@method_decorator(reads_from_replica, name='dispatch')
 class LoanListView(LoginRequiredMixin,ListView):
     model = Transaction
     template_name = 'transactions/loan_request.html'
     context_object_name = 'loans' 
+    paginate_by = 20
     
     def get_queryset(self):
         user_account = self.request.user.account
-        queryset = Transaction.objects.filter(account=user_account,transaction_type=3)
-        print(queryset)
-        return queryset
-    
-
-class LoanListView(LoginRequiredMixin,ListView):
-    model = Transaction
-    template_name = 'transactions/loan_request.html'
-    context_object_name = 'loans' 
-    
-    def get_queryset(self):
-        user_account = self.request.user.account
-        queryset = Transaction.objects.filter(account=user_account,transaction_type=3)
-        print(queryset)
+        # served by the (account, transaction_type, timestamp) index
+        queryset = Transaction.objects.filter(account=user_account,transaction_type=LOAN)
         return queryset
     
 
+@login_required
+@ratelimit('transfer')
+@idempotent
 def transfer_money(request):
     title = 'Send Money'
     if request.method == 'POST':
         form = TransferForm(request.POST)
         if form.is_valid():
             sender_account = request.user.account
-            print(sender_account.balance)
             receiver = form.cleaned_data['receiver_account']
-            if UserBankAccount.objects.get(account_no = receiver):
-                receiver_account = UserBankAccount.objects.get(account_no = receiver)
-                print(receiver_account.balance)
-                amount = form.cleaned_data['amount']
-                print(amount)
-
-                if sender_account.balance >= amount:
-                    sender_account.balance -= amount
-                    sender_account.save()
-                    send_transaction_email(sender_account.user, amount, "Transfer money Mail", "sender_mail.html")
-                    
-                    
-                    receiver_account.balance += amount
-                    receiver_account.save()
-                    send_transaction_email(receiver_account.user, amount, "Receive money Mail", "receiver_mail.html")
-                    
-                    transaction = Transaction(
-                        account=sender_account,
-                        amount=amount,
-                        balance_after_transaction=sender_account.balance,
-                        transaction_type=TRANSFER_MONEY,  
-                        loan_approve=False,  
-                    )
-                    transaction.save()
-                    transaction = Transaction(
-                        account=receiver_account,
-                        amount=amount,
-                        balance_after_transaction=receiver_account.balance,
-                        transaction_type=RECEIVE_MONEY,  
-                        loan_approve=False, 
-                    )
-                    transaction.save()
-                    return redirect('home') 
+            amount = form.cleaned_data['amount']
+            receiver_account = find_account(receiver)
+            if receiver_account is None:
+                messages.error(request, f'No account found with account no {receiver}')
             else:
-                print('User not found')
-            
+                try:
+                    transfer_and_notify(sender_account, receiver_account, amount)
+                except ledger.LedgerError as e:
+                    messages.error(request, str(e))
+                else:
+                    return redirect('home') 
 
     else:
         form = TransferForm()
 
     return render(request, 'transactions/transfer_money.html', {'form': form})
+
+
+@login_required
+@require_POST
+@ratelimit('transfer')
+@idempotent
+def bulk_transfer(request):
+    # payroll style fan-out: a CSV/JSONL upload of receiver account_no and amount per line
+    upload = request.FILES.get('file')
+    if upload is None:
+        return JsonResponse({'error': 'Upload the batch as "file"'}, status=400)
+    fmt = request.POST.get('format') or ('jsonl' if upload.name.endswith(('.jsonl', '.ndjson')) else 'csv')
+
+    try:
+        balance, results = batch.run_batch(
+            request.user.account, batch.parse_lines(io.TextIOWrapper(upload, encoding='utf-8'), fmt)
+        )
+    except ledger.LedgerError as e:
+        return JsonResponse({'error': str(e)}, status=409)
+
+    accepted = sum(1 for result in results if result['status'] == 'ok')
+    return JsonResponse({
+        'balance': str(balance),
+        'accepted': accepted,
+        'rejected': len(results) - accepted,
+        'results': results,
+    })
+
+
+class StandingOrderView(LoginRequiredMixin, CreateView):
+    # set up a standing order and list the account's orders, run_standing_orders makes the payments
+    template_name = 'transactions/standing_orders.html'
+    form_class = StandingOrderForm
+    success_url = reverse_lazy('standing_orders')
+
+    def get_form_kwargs(self):
+        kwargs = super().get_form_kwargs()
+        kwargs['account'] = self.request.user.account
+        return kwargs
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['orders'] = StandingOrder.objects.filter(account=self.request.user.account, active=True)
+        return context
+
+    def form_valid(self, form):
+        response = super().form_valid(form)
+        messages.success(self.request, f'Standing order of ${form.instance.amount} to {form.instance.receiver_account_no} is set up')
+        return response
+
+
+@login_required
+@require_POST
+def cancel_standing_order(request, order_id):
+    cancelled = StandingOrder.objects.filter(pk=order_id, account=request.user.account, active=True).update(active=False)
+    if cancelled:
+        messages.success(request, 'The standing order is cancelled')
+    return redirect('standing_orders')
+